@@ -8,11 +8,21 @@ from threading import Thread, Event
 from flask import Flask, redirect, url_for, flash, render_template, request
 from .config import Config # Changed to relative import
 from .models import db, User, File, Group # Import models
+from . import search # Registers the full-text index DDL and ORM events
+from . import counters # Registers the status counter ORM events
+from . import storage # Registers the stored object reference counting events
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager, current_user
 from flask_mail import Mail
+from flask_migrate import Migrate, stamp, upgrade
+from sqlalchemy import inspect
 from .mq import mq # Import message queue
 from .workers.tasks import worker_main # Import worker_main
+from .workers.handlers import apply_structured_data
+from .metrics import metrics_bp, start_metrics_flusher, mark_process_dead
+from .events import publish_file_status
+from .near_duplicates import attach_signature
+from .database import engine_options
 import atexit # For graceful shutdown
 from multiprocessing import Process
 
@@ -24,6 +34,9 @@ logger = logging.getLogger(__name__)
 shutdown_event = Event()
 
 mail = Mail()
+migrate = Migrate()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
 
 def from_json(value):
     """Jinja2 filter to parse JSON strings."""
@@ -38,8 +51,12 @@ def from_json(value):
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    )
 
     db.init_app(app)
+    migrate.init_app(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
     CSRFProtect(app)
     mail.init_app(app)
 
@@ -59,7 +76,7 @@ def create_app():
     
 
     with app.app_context():
-        db.create_all()
+        init_database(app)
 
     # Store the message queue and db_uri in app config for access in blueprints
     app.config['MQ'] = mq
@@ -79,6 +96,7 @@ def create_app():
     app.register_blueprint(workers_bp) # Register the new workers blueprint
     app.register_blueprint(groups_bp) # Register the groups blueprint
     app.register_blueprint(editor_bp)
+    app.register_blueprint(metrics_bp)
 
     @app.route('/')
     def initial_redirect():
@@ -91,6 +109,63 @@ def create_app():
 
     return app
 
+def init_database(app):
+    """
+    Prepara o schema do banco.
+    Banco vazio: cria as tabelas a partir dos modelos e marca a revisão atual das migrações.
+    Banco existente: o schema é responsabilidade das migrações (`flask db upgrade`),
+    aplicadas automaticamente apenas se AUTO_MIGRATE estiver ativo.
+    """
+    table_names = inspect(db.engine).get_table_names()
+    if not table_names:
+        db.create_all()
+        stamp(directory=MIGRATIONS_DIR)
+        logger.info("Empty database initialized from models and stamped at the latest migration.")
+    elif 'alembic_version' not in table_names:
+        logger.warning("Database has no migration history. Run 'flask db stamp 0001' and then 'flask db upgrade'.")
+    elif app.config.get('AUTO_MIGRATE') == 'True':
+        upgrade(directory=MIGRATIONS_DIR)
+
+def apply_result(message):
+    """
+    Aplica ao File uma mensagem da fila de resultados dos workers e publica a transição
+    aos streams SSE. Roda no contexto da aplicação, na thread do ingestor de resultados.
+    """
+    file_id = message['file_id']
+    new_status = message['status']
+
+    from .models import File
+    file_record = db.session.query(File).get(file_id)
+    # Fora do modo de escritor único o worker já gravou o status final antes de publicar:
+    # a transição vem na mensagem, não do registro
+    previous = message.get('previous_status') or (file_record.status if file_record else None)
+    if file_record and 'structured_data' not in message:
+        # Transição intermediária enviada pelo worker (modo de escritor único do SQLite)
+        file_record.status = new_status
+        db.session.commit()
+        logger.info(f"Main app updated file {file_id} to status '{new_status}'.")
+    elif file_record:
+        processed_data = message['processed_data']
+        new_file_path = message['filepath']
+        extracted_structured_data = message['structured_data']
+        file_record.processed_data = processed_data
+        apply_structured_data(file_record, extracted_structured_data)
+
+        file_record.status = new_status
+        file_record.filepath = new_file_path
+        if message.get('object_key'):
+            file_record.object_key = message['object_key']
+        if message.get('checksum') and not file_record.checksum:
+            file_record.checksum = message['checksum']
+        if message.get('duplicate_of_id'):
+            file_record.duplicate_of_id = message['duplicate_of_id']
+        if new_status == 'completed':
+            attach_signature(file_record, message.get('signature'))
+        db.session.commit()
+        logger.info(f"Main app updated file {file_id} to status '{new_status}'.")
+    if file_record:
+        publish_file_status(file_record, previous)
+
 def start_workers(app):
     """Starts the dynamic worker manager and results consumer thread."""
     db_uri = app.config['DATABASE_URI']
@@ -105,42 +180,7 @@ def start_workers(app):
         def callback(ch, method, properties, body):
             with ctx:
                 try:
-                    message = json.loads(body)
-                    file_id = message['file_id']
-                    new_status = message['status']
-                    processed_data = message['processed_data']
-                    new_file_path = message['filepath']
-                    extracted_structured_data = message['structured_data']
-
-                    from .models import File
-                    file_record = db.session.query(File).get(file_id)
-                    if file_record:
-                        file_record.processed_data = processed_data
-                        # ... (rest of the mapping)
-                        file_record.nome = extracted_structured_data.get('nome')
-                        file_record.matricula = extracted_structured_data.get('matricula')
-                        file_record.funcao = extracted_structured_data.get('funcao')
-                        file_record.empregador = extracted_structured_data.get('empregador')
-                        file_record.rg = extracted_structured_data.get('rg')
-                        file_record.cpf = extracted_structured_data.get('cpf')
-                        file_record.data_documento = extracted_structured_data.get('data')
-
-                        if 'equipamentos' in extracted_structured_data and extracted_structured_data['equipamentos'] is not None:
-                            file_record.equipamentos = json.dumps(extracted_structured_data['equipamentos'])
-                        else:
-                            file_record.equipamentos = None
-
-                        imei_list = extracted_structured_data.get('imei_numbers')
-                        file_record.imei_numbers = json.dumps(imei_list) if imei_list is not None else None
-
-                        patrimonio_list = extracted_structured_data.get('patrimonio_numbers')
-                        file_record.patrimonio_numbers = json.dumps(patrimonio_list) if patrimonio_list is not None else None
-
-                        file_record.status = new_status
-                        file_record.filepath = new_file_path
-                        db.session.commit()
-                        logger.info(f"Main app updated file {file_id} to status '{new_status}'.")
-                    
+                    apply_result(json.loads(body))
                     if ch:
                         ch.basic_ack(delivery_tag=method.delivery_tag)
                 except Exception as e:
@@ -171,10 +211,16 @@ def start_workers(app):
         
         last_db_check = 0
         db_check_interval = 60 # Check DB every 60 seconds for stuck files
+        last_reconcile = time.time()
+        last_archive = time.time()
+        last_storage_purge = time.time()
 
         try:
             while not shutdown_event.is_set():
                 # Clean up finished processes
+                for p in worker_processes:
+                    if not p.is_alive():
+                        mark_process_dead(p.pid)
                 worker_processes = [p for p in worker_processes if p.is_alive()]
                 
                 # Check queue size
@@ -197,6 +243,40 @@ def start_workers(app):
                             # Refresh q_size after re-enqueueing
                             q_size = manager_mq.get_queue_size()
 
+                # Periodic repair of drifted status counters
+                if current_time - last_reconcile > app.config['STATUS_COUNTER_RECONCILE_SECONDS']:
+                    last_reconcile = current_time
+                    with app_context:
+                        try:
+                            counters.reconcile_status_counters(db.session)
+                        except Exception as e:
+                            db.session.rollback()
+                            logger.error(f"Status counter reconciliation failed: {e}")
+
+                # Periodic archival of old soft-deleted files and metrics
+                if current_time - last_archive > app.config['ARCHIVE_INTERVAL_SECONDS']:
+                    last_archive = current_time
+                    with app_context:
+                        try:
+                            from .archive import run_archival
+                            from .files.chunked import expire_upload_sessions
+                            run_archival(db.session)
+                            expire_upload_sessions(db.session)
+                        except Exception as e:
+                            db.session.rollback()
+                            logger.error(f"Archival job failed: {e}")
+
+                # Remoção em lote dos objetos agendados no R2
+                if current_time - last_storage_purge > app.config['STORAGE_PURGE_INTERVAL_SECONDS']:
+                    last_storage_purge = current_time
+                    with app_context:
+                        try:
+                            from .storage import purge_storage_queue
+                            purge_storage_queue(db.session)
+                        except Exception as e:
+                            db.session.rollback()
+                            logger.error(f"Storage purge failed: {e}")
+
                 running = len(worker_processes)
                 
                 if q_size > 0 and running < max_workers:
@@ -223,6 +303,15 @@ def start_workers(app):
     manager_thread.start()
     app.config['MANAGER_THREAD'] = manager_thread
 
+    # 3. Periodically flush buffered metrics to the Metric table
+    app.config['METRICS_THREAD'] = start_metrics_flusher(app, shutdown_event)
+
+    # 4. Ingest documents dropped by scanners into the configured hot folders
+    from .hot_folder import start_hot_folder_watcher
+    hot_folder_thread = start_hot_folder_watcher(app, shutdown_event)
+    if hot_folder_thread is not None:
+        app.config['HOT_FOLDER_THREAD'] = hot_folder_thread
+
 def shutdown_workers(app):
     """Signals all background tasks to stop."""
     logger.info("Shutting down workers and manager...")
@@ -230,6 +319,12 @@ def shutdown_workers(app):
     
     if 'MANAGER_THREAD' in app.config:
         app.config['MANAGER_THREAD'].join(timeout=15)
+
+    if 'METRICS_THREAD' in app.config:
+        app.config['METRICS_THREAD'].join(timeout=15)
+
+    if 'HOT_FOLDER_THREAD' in app.config:
+        app.config['HOT_FOLDER_THREAD'].join(timeout=15)
         
     mq.close()
     logger.info("Shutdown complete.")
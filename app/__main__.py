@@ -27,15 +27,112 @@ def recreate_db():
         print("Shutting down workers...")
         shutdown_workers(app)
         print("Recreating database...")
-        from app import db
+        from app import db, init_database
         db.drop_all()
-        db.create_all()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS alembic_version")
+        init_database(app)
         print("Database recreated successfully.")
 
+def upgrade_db():
+    """Apply pending database migrations (same as `flask db upgrade`)."""
+    from app import MIGRATIONS_DIR
+    from flask_migrate import upgrade
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR)
+        print("Database upgraded to the latest migration.")
+
+def reconcile_counters():
+    """Recompute the per-user/group status counters from the file table."""
+    from app import db
+    from app.counters import reconcile_status_counters
+    with app.app_context():
+        drifted = reconcile_status_counters(db.session)
+        print(f"Status counters reconciled ({drifted} corrected).")
+
+def archive():
+    """Run the archival job once (soft-deleted files past the grace period and old metrics)."""
+    from app import db
+    from app.archive import run_archival
+    with app.app_context():
+        files, metrics = run_archival(db.session)
+        print(f"Archived {files} files and {metrics} metric rows.")
+
+def restore(file_id):
+    """Restore an archived file back into the file table."""
+    from app import db
+    from app.archive import restore_file
+    with app.app_context():
+        restored = restore_file(db.session, file_id)
+        if restored is None:
+            print(f"File {file_id} is not in the archive.")
+        elif restored.status == 'failed':
+            print(f"File {file_id} restored without its PDF (already purged from storage); marked as failed.")
+        else:
+            print(f"File {file_id} restored.")
+
+def purge_storage():
+    """Drain the storage purge queue once (batched R2 deletes)."""
+    from app import db
+    from app.storage import purge_storage_queue
+    with app.app_context():
+        purged = purge_storage_queue(db.session)
+        print(f"Purged {purged} objects from storage.")
+
+def watch():
+    """Run only the hot folder watcher (ingestion daemon for scanner folders) until interrupted."""
+    from threading import Event
+    from app.hot_folder import start_hot_folder_watcher
+    stop_event = Event()
+    thread = start_hot_folder_watcher(app, stop_event)
+    if thread is None:
+        print("Set HOT_FOLDERS and HOT_FOLDER_USER_ID to enable the hot folder watcher.")
+        return
+    try:
+        while thread.is_alive():
+            thread.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        thread.join(timeout=15)
+
+def batch(args):
+    """Process every PDF in a directory with a local process pool, without the web app or the broker."""
+    import argparse
+    from app import db
+    from app.batch import run_batch
+    parser = argparse.ArgumentParser(prog='python -m app batch')
+    parser.add_argument('directory')
+    parser.add_argument('--user-id', type=int, required=True, help='owner of the imported files')
+    parser.add_argument('--group-id', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None, help='processes in the pool (0 = run inline)')
+    parser.add_argument('--commit-every', type=int, default=None)
+    parser.add_argument('--state', default=None, help='progress journal (default: <directory>/.batch-progress.jsonl)')
+    options = parser.parse_args(args)
+    with app.app_context():
+        counts = run_batch(db.session, options.directory, options.user_id, options.group_id,
+                           workers=options.workers, commit_every=options.commit_every,
+                           state_path=options.state, report=print)
+        if counts.get('failed'):
+            sys.exit(1)
+
 if __name__ == '__main__':
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == 'recreate_db':
         recreate_db()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'upgrade_db':
+        upgrade_db()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'reconcile_counters':
+        reconcile_counters()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'archive':
+        archive()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'purge_storage':
+        purge_storage()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        watch()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        batch(sys.argv[2:])
+    elif len(sys.argv) > 2 and sys.argv[1] == 'restore':
+        restore(int(sys.argv[2]))
     else:
         start_workers(app)
         atexit.register(shutdown_workers, app)
@@ -0,0 +1,78 @@
+import logging
+from sqlalchemy import select, exists, or_, union
+
+from app.models import db, File, Group, group_members
+from app.config import Config
+from app.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Grupos acessíveis (membro ou criador) por usuário: [(id, nome), ...]
+group_scope_cache = TTLCache(Config.ACCESS_SCOPE_CACHE_SECONDS)
+
+
+def accessible_groups(user_id):
+    """
+    Lista (id, nome) dos grupos que o usuário criou ou dos quais é membro, em uma única
+    consulta e com cache por usuário. Usada para montar as opções de grupo dos formulários.
+    """
+    def compute():
+        group_ids = union(
+            select(group_members.c.group_id).where(group_members.c.user_id == user_id),
+            select(Group.id).where(Group.creator_id == user_id)
+        ).subquery()
+        rows = db.session.execute(
+            select(Group.id, Group.name).where(Group.id.in_(select(group_ids.c[0]))).order_by(Group.name)
+        ).all()
+        return [(group_id, name) for group_id, name in rows]
+    return group_scope_cache.get_or_compute(user_id, compute)
+
+
+def group_choices(user_id):
+    return [(0, 'No Group')] + accessible_groups(user_id)
+
+
+def invalidate_access_scope(*user_ids):
+    """Descarta o escopo em cache dos usuários afetados por uma mudança de grupo (ou de todos)."""
+    if not user_ids:
+        group_scope_cache.invalidate()
+    else:
+        affected = set(user_ids)
+        group_scope_cache.invalidate(lambda key: key in affected)
+
+
+def is_member(user_id, group_id):
+    """Sonda de uma linha na chave primária de group_members."""
+    return db.session.query(
+        exists().where(group_members.c.user_id == user_id, group_members.c.group_id == group_id)
+    ).scalar()
+
+
+def can_access_group(user, group):
+    """Admin, criador ou membro do grupo."""
+    return user.is_admin or group.creator_id == user.id or is_member(user.id, group.id)
+
+
+def file_access_filter(user_id):
+    """
+    Filtro de visibilidade de arquivos: próprios ou de grupos acessíveis, como EXISTS
+    correlacionados (índices de group_members e group.creator_id), sem materializar a lista de grupos.
+    """
+    member_of_group = exists().where(
+        group_members.c.group_id == File.group_id,
+        group_members.c.user_id == user_id
+    )
+    created_group = exists().where(
+        Group.id == File.group_id,
+        Group.creator_id == user_id
+    )
+    return or_(File.user_id == user_id, member_of_group, created_group)
+
+
+def can_access_file(user, file_record):
+    if user.is_admin or file_record.user_id == user.id:
+        return True
+    if not file_record.group_id:
+        return False
+    group = db.session.get(Group, file_record.group_id)
+    return group is not None and can_access_group(user, group)
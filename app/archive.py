@@ -0,0 +1,161 @@
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, insert, delete, literal, DateTime
+from sqlalchemy.orm import selectinload
+
+from app.models import File, FileContent, Metric, ArchivedFile, ArchivedMetric, StoredObject
+from app.config import Config
+from app.storage import enqueue_purge
+
+logger = logging.getLogger(__name__)
+
+# Colunas copiadas entre `file` e `file_archive` (duplicate_of_id não: o original pode ter saído)
+ARCHIVED_COLUMNS = (
+    'id', 'filename', 'original_filename', 'filepath', 'upload_date', 'status', 'checksum', 'object_key', 'size', 'deleted_at',
+    'nome', 'matricula', 'funcao', 'empregador', 'rg', 'cpf', 'equipamentos', 'data_documento',
+    'imei_numbers', 'patrimonio_numbers', 'user_id', 'group_id',
+)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _purge_storage(session, archived):
+    """
+    Agenda a remoção do objeto no R2 (se usado) e remove a cópia local. Retorna False se algo falhou.
+    Objetos endereçados por conteúdo entram na fila pela contagem de referências
+    quando `storage_purged` passa a True.
+    """
+    purged = True
+    if Config.R2_FEATURE_FLAG == 'True' and archived.status == 'completed' and not archived.object_key:
+        enqueue_purge(session, [archived.filename])
+    if archived.filepath and os.path.exists(archived.filepath):
+        try:
+            os.remove(archived.filepath)
+        except OSError as e:
+            logger.error(f"Failed to remove local copy of archived file {archived.id}: {e}")
+            purged = False
+    return purged
+
+
+def archive_deleted_files(session, grace_days=None, batch_size=None, max_batches=None, purge_storage=True):
+    """
+    Move arquivos soft-deleted há mais de `grace_days` para `file_archive`, em lotes de
+    `batch_size` (um commit por lote, no máximo `max_batches` lotes por execução).
+    Os registros saem pelo ORM, então contadores, índice de busca e tabelas de ativos
+    acompanham. Retorna o número de arquivos arquivados.
+    """
+    grace_days = Config.ARCHIVE_GRACE_DAYS if grace_days is None else grace_days
+    batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+    max_batches = max_batches or Config.ARCHIVE_MAX_BATCHES
+    cutoff = _now() - timedelta(days=grace_days)
+
+    archived_total = 0
+    for _ in range(max_batches):
+        files = session.execute(
+            select(File).options(selectinload(File.content))
+            .where(File.is_deleted == True, File.deleted_at < cutoff)
+            .order_by(File.deleted_at).limit(batch_size)
+        ).scalars().all()
+        if not files:
+            break
+
+        archived_at = _now()
+        archives = []
+        for file_record in files:
+            archived = ArchivedFile(archived_at=archived_at, storage_purged=False,
+                                    **{column: getattr(file_record, column) for column in ARCHIVED_COLUMNS})
+            if file_record.content is not None:
+                archived.content_codec = file_record.content.codec
+                archived.content_data = file_record.content.data
+                archived.content_size = file_record.content.size
+            archives.append(archived)
+            session.delete(file_record)
+        session.add_all(archives)
+        session.commit()
+
+        # Os objetos só são removidos depois que o lote foi gravado no arquivo morto
+        if purge_storage:
+            for archived in archives:
+                archived.storage_purged = _purge_storage(session, archived)
+            session.commit()
+
+        archived_total += len(archives)
+        logger.info(f"Archived {len(archives)} soft-deleted files.")
+        if len(files) < batch_size:
+            break
+    return archived_total
+
+
+def archive_old_metrics(session, retention_days=None, batch_size=None, max_batches=None):
+    """Move métricas mais antigas que `retention_days` para `metric_archive`, em lotes."""
+    retention_days = Config.METRIC_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+    max_batches = max_batches or Config.ARCHIVE_MAX_BATCHES
+    cutoff = _now() - timedelta(days=retention_days)
+
+    archived_total = 0
+    for _ in range(max_batches):
+        ids = session.execute(
+            select(Metric.id).where(Metric.timestamp < cutoff).order_by(Metric.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        session.execute(insert(ArchivedMetric).from_select(
+            ['id', 'timestamp', 'name', 'value', 'tags', 'archived_at'],
+            select(Metric.id, Metric.timestamp, Metric.name, Metric.value, Metric.tags,
+                   literal(_now(), DateTime)).where(Metric.id.in_(ids))
+        ))
+        session.execute(delete(Metric).where(Metric.id.in_(ids)))
+        session.commit()
+        archived_total += len(ids)
+        if len(ids) < batch_size:
+            break
+    if archived_total:
+        logger.info(f"Archived {archived_total} metric rows older than {retention_days} days.")
+    return archived_total
+
+
+def run_archival(session):
+    """Execução periódica: arquivos soft-deleted e métricas antigas."""
+    files = archive_deleted_files(session, purge_storage=Config.ARCHIVE_PURGE_STORAGE == 'True')
+    metrics = archive_old_metrics(session)
+    return files, metrics
+
+
+def restore_file(session, file_id):
+    """
+    Devolve um arquivo arquivado para a tabela `file` (ativo, não deletado).
+    Retorna o File restaurado, ou None se não estiver no arquivo morto. Se o objeto
+    já foi removido do storage, os dados extraídos voltam mas o arquivo fica como 'failed'
+    (sem download), para ser enviado de novo.
+    """
+    archived = session.get(ArchivedFile, file_id)
+    if archived is None:
+        return None
+
+    file_record = File(**{column: getattr(archived, column) for column in ARCHIVED_COLUMNS})
+    file_record.is_deleted = False
+    file_record.deleted_at = None
+    storage_available = not archived.storage_purged
+    if archived.object_key and archived.storage_purged:
+        # O objeto continua no R2 se outro arquivo ainda o referencia
+        stored = session.get(StoredObject, archived.object_key)
+        storage_available = stored is not None and stored.ref_count > 0
+        if not storage_available:
+            file_record.object_key = None
+    if not storage_available:
+        # Sem o PDF não há o que baixar: 'completed' prometeria um download inexistente
+        file_record.status = 'failed'
+    if archived.content_data is not None:
+        file_record.content = FileContent(codec=archived.content_codec, data=archived.content_data,
+                                          size=archived.content_size)
+    session.add(file_record)
+    session.delete(archived)
+    session.commit()
+    if not storage_available:
+        logger.warning(f"Restored file {file_id} from archive as 'failed': its stored object was already purged.")
+    return file_record
@@ -1,7 +1,8 @@
 from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_user, logout_user, current_user
 from flask_mail import Message
-from app.models import User, db, record_metric
+from app.models import User, db
+from app.metrics import record_metric
 from app.auth.forms import LoginForm, RegistrationForm, RequestResetForm, ResetPasswordForm, MagicLinkForm, CompleteRegistrationForm
 import logging
 from datetime import datetime, timedelta, timezone
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import uuid
+import logging
+import multiprocessing
+
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from app.models import File
+from app.config import Config
+from app.duplicates import save_hashed, original_filter
+from app.ingest import discard
+from app.storage import enqueue_purge
+from app.near_duplicates import attach_signature
+from app.workers.handlers import FileProcessingTask, apply_structured_data
+
+logger = logging.getLogger(__name__)
+
+# Diário de progresso gravado na pasta processada (um JSON por arquivo concluído)
+STATE_FILENAME = '.batch-progress.jsonl'
+
+
+class OfflineProcessingTask(FileProcessingTask):
+    """
+    As etapas do FileProcessingTask (extração, compressão, upload) sem banco nem broker:
+    o resultado volta ao processo do comando batch, que grava tudo em lote.
+    """
+
+    def __init__(self, file_path, checksum):
+        super().__init__(file_id=None, file_path=file_path, session=None, checksum=checksum)
+
+    def _is_duplicate(self):
+        return False # O comando já descartou checksums conhecidos antes de processar
+
+    def _update_db_status(self, *args, **kwargs):
+        pass
+
+    def _finalize_task(self):
+        pass
+
+    def result(self):
+        return {
+            'status': self.status,
+            'processed_data': (self.processed_data or '').strip(),
+            'structured_data': self.structured_data,
+            'filepath': self.current_filepath,
+            'object_key': self.object_key,
+            'signature': self.signature,
+        }
+
+
+# Estado de cada processo do pool (preenchido pelo initializer)
+_known_checksums = frozenset()
+_work_folder = None
+
+
+def _init_pool(known_checksums, work_folder):
+    global _known_checksums, _work_folder
+    _known_checksums = known_checksums
+    _work_folder = work_folder
+
+
+def process_path(source):
+    """
+    Executado no pool: copia o PDF para a pasta de trabalho calculando o SHA-256 (a origem
+    não é alterada) e roda as etapas do pipeline. Conteúdo já registrado no banco é pulado.
+    """
+    extension = os.path.splitext(source)[1].lower()
+    unique_filename = str(uuid.uuid4()) + extension
+    work_path = os.path.join(_work_folder, unique_filename)
+    result = {'source': source, 'original_filename': secure_filename(os.path.basename(source)),
+              'filename': unique_filename}
+    try:
+        with open(source, 'rb') as f:
+            checksum, size = save_hashed(f, work_path)
+    except OSError as e:
+        discard(work_path)
+        return dict(result, status='unreadable', processed_data=str(e))
+    result.update(checksum=checksum, size=size)
+    if checksum in _known_checksums:
+        discard(work_path)
+        return dict(result, status='skipped')
+
+    task = OfflineProcessingTask(work_path, checksum)
+    task.run()
+    return dict(result, **task.result())
+
+
+def discover(directory):
+    """PDFs da pasta (e subpastas), em ordem estável para que execuções retomadas sigam a mesma sequência."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        paths.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                     if name.lower().endswith('.pdf') and not name.startswith('.'))
+    return paths
+
+
+def load_state(state_path):
+    """Arquivos de origem já concluídos em execuções anteriores."""
+    done = set()
+    if not os.path.exists(state_path):
+        return done
+    with open(state_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['source'])
+            except (ValueError, KeyError):
+                continue # Linha truncada por uma interrupção no meio da escrita
+    return done
+
+
+class BatchRun:
+    """Grava os resultados do pool em lotes (um commit cada) e acompanha a vazão."""
+
+    def __init__(self, session, user_id, group_id, state_path, total, commit_every, report):
+        self.session = session
+        self.user_id = user_id
+        self.group_id = group_id
+        self.state_path = state_path
+        self.total = total
+        self.commit_every = commit_every
+        self.report = report
+        self.pending = []
+        self.originals = {} # checksum -> File criado nesta execução
+        self.counts = {'completed': 0, 'failed': 0, 'duplicate': 0, 'skipped': 0, 'unreadable': 0}
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def add(self, result):
+        self.pending.append(result)
+        if len(self.pending) >= self.commit_every:
+            self.flush()
+
+    def _record(self, result):
+        file_record = File(
+            filename=result['filename'],
+            original_filename=result['original_filename'],
+            filepath=result['filepath'],
+            user_id=self.user_id,
+            group_id=self.group_id,
+            status=result['status'],
+            checksum=result['checksum'],
+            size=result['size'],
+            object_key=result['object_key'],
+        )
+        if result['processed_data']:
+            file_record.processed_data = result['processed_data']
+        if result['structured_data']:
+            apply_structured_data(file_record, result['structured_data'])
+
+        original = self.originals.get(result['checksum'])
+        if original is not None:
+            # Mesmo conteúdo duas vezes na pasta: o segundo vira duplicata do primeiro
+            file_record.status = 'duplicate'
+            file_record.processed_data = 'Duplicate file detected.'
+            file_record.duplicate_of = original
+            file_record.object_key = None
+            if Config.R2_FEATURE_FLAG == 'True' and not result['object_key'] and result['status'] == 'completed':
+                enqueue_purge(self.session, [result['filename']])
+            elif Config.R2_FEATURE_FLAG != 'True':
+                discard(result['filepath'])
+        elif result['status'] == 'completed':
+            self.originals[result['checksum']] = file_record
+            # Indexa as assinaturas para que re-digitalizações enviadas depois sejam reconhecidas
+            attach_signature(file_record, result['signature'])
+        return file_record
+
+    def flush(self):
+        if not self.pending:
+            return
+        records = [self._record(result) if result['status'] not in ('skipped', 'unreadable') else None
+                   for result in self.pending]
+        self.session.add_all([record for record in records if record is not None])
+        self.session.commit()
+
+        # O diário só é escrito depois do commit: uma interrupção antes dele refaz o lote
+        with open(self.state_path, 'a', encoding='utf-8') as state:
+            for result, record in zip(self.pending, records):
+                status = record.status if record is not None else result['status']
+                self.counts[status] = self.counts.get(status, 0) + 1
+                self.bytes += result.get('size') or 0
+                state.write(json.dumps({'source': result['source'], 'file_id': record.id if record is not None else None,
+                                        'status': status}) + '\n')
+        self.pending = []
+        self.report(self.progress())
+
+    def done(self):
+        return sum(self.counts.values())
+
+    def progress(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        done = self.done()
+        rate = done / elapsed
+        eta = (self.total - done) / rate if rate else 0
+        return (f"{done}/{self.total} files ({rate:.2f} files/s, {self.bytes / elapsed / 1024 / 1024:.2f} MB/s, "
+                f"ETA {eta / 60:.1f} min) - " + ', '.join(f"{k}: {v}" for k, v in self.counts.items() if v))
+
+
+def run_batch(session, directory, user_id, group_id=None, workers=None, commit_every=None, state_path=None,
+              work_folder=None, report=None):
+    """
+    Processa todos os PDFs de `directory` com um pool local de processos, sem passar pela
+    web, pelo broker ou pelo canal de resultados. Os Files entram já com o status final,
+    BATCH_COMMIT_EVERY por commit. Arquivos listados no diário de progresso (ou cujo
+    conteúdo já está no banco) são pulados, então a mesma chamada retoma uma execução
+    interrompida. `workers=0` processa no próprio processo. Retorna as contagens por status.
+    """
+    report = report or logger.info
+    directory = os.path.abspath(directory)
+    workers = Config.BATCH_WORKERS if workers is None else workers
+    commit_every = commit_every or Config.BATCH_COMMIT_EVERY
+    state_path = state_path or os.path.join(directory, STATE_FILENAME)
+    work_folder = work_folder or Config.UPLOAD_FOLDER
+    os.makedirs(work_folder, exist_ok=True)
+
+    done = load_state(state_path)
+    paths = [path for path in discover(directory) if path not in done]
+    report(f"Batch: {len(paths)} PDF(s) to process in {directory} ({len(done)} already done), {workers or 1} process(es).")
+    if not paths:
+        return {}
+
+    # Conteúdo já registrado e visível para o usuário (exceto apagados, duplicatas e falhas,
+    # que podem ser reprocessadas) não é processado de novo
+    known = frozenset(session.execute(
+        select(File.checksum).where(File.checksum.isnot(None), original_filter(user_id))
+    ).scalars())
+    run = BatchRun(session, user_id, group_id, state_path, len(paths), commit_every, report)
+
+    try:
+        if workers == 0:
+            _init_pool(known, work_folder)
+            for path in paths:
+                run.add(process_path(path))
+        else:
+            # Tarefas longas (OCR): uma por vez por processo, e processos renovados para conter vazamentos
+            with multiprocessing.Pool(workers, initializer=_init_pool, initargs=(known, work_folder),
+                                      maxtasksperchild=Config.BATCH_MAX_TASKS_PER_CHILD) as pool:
+                for result in pool.imap_unordered(process_path, paths, chunksize=1):
+                    run.add(result)
+    finally:
+        # Também em Ctrl+C: o que já foi processado fica gravado e registrado no diário
+        run.flush()
+    report(f"Batch finished: {run.progress()}")
+    return run.counts
@@ -0,0 +1,135 @@
+import os
+import uuid
+import functools
+import tarfile
+import zipfile
+import logging
+
+from werkzeug.utils import secure_filename
+
+from app.config import Config
+from app.duplicates import save_hashed
+from app.ingest import ingest_files, is_allowed_content, discard, MAGIC_HEAD_BYTES
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+def is_archive(filename):
+    return (filename or '').lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _skipped(name):
+    """Metadados que compactadores incluem (__MACOSX/, ._arquivo, .DS_Store) não são documentos."""
+    basename = os.path.basename(name)
+    return name.startswith('__MACOSX/') or not basename or basename.startswith('.')
+
+
+def iter_members(stream, archive_name):
+    """
+    Percorre os arquivos regulares do pacote sem carregá-lo em memória: gera
+    (nome, tamanho declarado, função que abre o stream do membro). A abertura fica com
+    quem consome, para que um membro criptografado ou com compressão não suportada
+    falhe sozinho. ZIP precisa de um stream com seek (o diretório central fica no fim);
+    tar é lido sequencialmente ('r|*').
+    """
+    if archive_name.lower().endswith('.zip'):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skipped(info.filename):
+                    continue
+                yield info.filename, info.file_size, functools.partial(archive.open, info)
+        return
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for info in archive:
+            if not info.isfile() or _skipped(info.name):
+                continue
+            yield info.name, info.size, functools.partial(archive.extractfile, info)
+
+
+def _too_large(name):
+    return f'File "{name}" is too large. Maximum size is {Config.MAX_PDF_SIZE // (1024 * 1024)} MB.', 'danger'
+
+
+def _extract(name, size, open_member, upload_folder, errors):
+    """Valida e grava um membro em UPLOAD_FOLDER. Retorna a entrada para ingest_files, ou None."""
+    original_filename = secure_filename(os.path.basename(name))
+    extension = os.path.splitext(original_filename)[1].lower()
+    if extension.lstrip('.') not in Config.ALLOWED_EXTENSIONS:
+        errors.append((f'Skipped invalid file: {name}. Allowed types are: png, jpg, jpeg, gif, pdf', 'warning'))
+        return None
+    if size > Config.MAX_PDF_SIZE:
+        errors.append(_too_large(name))
+        return None
+    with open_member() as member:
+        head = member.read(MAGIC_HEAD_BYTES)
+        if not is_allowed_content(head):
+            errors.append((f'Skipped file "{name}": File content does not match allowed types (PDF/Images).', 'danger'))
+            return None
+
+        unique_filename = str(uuid.uuid4()) + extension
+        path = os.path.join(upload_folder, unique_filename)
+        try:
+            # O tamanho declarado no cabeçalho não é confiável (zip bomb): o limite vale para os bytes extraídos
+            checksum, written = save_hashed(member, path, head=head, max_bytes=Config.MAX_PDF_SIZE)
+        except ValueError:
+            discard(path)
+            errors.append(_too_large(name))
+            return None
+        except Exception:
+            discard(path)
+            raise
+    return original_filename, unique_filename, path, checksum, written, False
+
+
+def import_archive(session, stream, archive_name, user_id, group_id=None, errors=None, policy=None, upload_folder=None,
+                   raise_errors=False):
+    """
+    Importa um ZIP/tar enviado em lote: cada membro é validado pelos magic numbers, gravado
+    em UPLOAD_FOLDER com o SHA-256 calculado na extração e registrado a cada
+    BULK_IMPORT_BATCH_SIZE membros, para que os workers comecem antes do fim da extração.
+    Erros por membro vão para `errors`. Retorna (enfileirados, duplicatas vinculadas).
+    """
+    errors = [] if errors is None else errors
+    upload_folder = upload_folder or Config.UPLOAD_FOLDER
+    pending = []
+    queued = linked = 0
+
+    def flush():
+        nonlocal queued, linked
+        new_files, linked_files = ingest_files(session, pending, user_id, group_id, errors, policy, raise_errors)
+        queued += len(new_files)
+        linked += len(linked_files)
+        pending.clear()
+
+    members = 0
+    try:
+        for name, size, open_member in iter_members(stream, archive_name):
+            members += 1
+            if members > Config.BULK_IMPORT_MAX_MEMBERS:
+                errors.append((f'Archive "{archive_name}" has more than {Config.BULK_IMPORT_MAX_MEMBERS} files; the rest was skipped.', 'warning'))
+                break
+            try:
+                entry = _extract(name, size, open_member, upload_folder, errors)
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                # Membro corrompido (CRC), criptografado ou com compressão não suportada
+                logger.warning(f"Could not extract '{name}' from {archive_name}: {e}")
+                errors.append((f'File "{name}" in "{archive_name}" could not be extracted.', 'danger'))
+                continue
+            if entry:
+                pending.append(entry)
+            if len(pending) >= Config.BULK_IMPORT_BATCH_SIZE:
+                flush()
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        logger.warning(f"Could not read archive {archive_name}: {e}")
+        errors.append((f'Archive "{archive_name}" could not be read.', 'danger'))
+    except Exception:
+        for entry in pending:
+            discard(entry[2])
+        raise
+    if pending:
+        flush()
+
+    logger.info(f"Imported {archive_name}: {queued} queued, {linked} duplicates linked.")
+    return queued, linked
@@ -17,11 +17,71 @@ class Config:
         "pool_timeout": 30,
         "pool_recycle": 1800,
     }
+    # SQLite: modo WAL + synchronous=NORMAL, espera por locks (ms) e, opcionalmente,
+    # um único escritor (workers enviam as mudanças de status ao processo principal)
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', 'True')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000))
+    SQLITE_SINGLE_WRITER = os.environ.get('SQLITE_SINGLE_WRITER', 'False')
+    # Aplica `flask db upgrade` automaticamente ao iniciar a aplicação
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', 'False')
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
     MAX_CONTENT_LENGTH = 1024 * 1024 * 1024
     MAX_PDF_SIZE = 20 * 1024 * 1024  # 20 MB
     MAX_PDF_PAGES = int(os.environ.get('MAX_PDF_PAGES'))
-    FOLDER_MONITOR_INTERVAL_SECONDS = 60
+    # Monitor de pastas (app/hot_folder.py): HOT_FOLDERS separadas por os.pathsep, cada uma
+    # com grupo opcional ("/mnt/scanner/rh=3"); os arquivos entram em nome de HOT_FOLDER_USER_ID.
+    # Sem inotify (ou em compartilhamentos de rede) as pastas são varridas a cada
+    # FOLDER_MONITOR_INTERVAL_SECONDS e um arquivo só entra após HOT_FOLDER_SETTLE_SECONDS sem mudar
+    HOT_FOLDERS = os.environ.get('HOT_FOLDERS', '')
+    HOT_FOLDER_USER_ID = os.environ.get('HOT_FOLDER_USER_ID')
+    HOT_FOLDER_INOTIFY = os.environ.get('HOT_FOLDER_INOTIFY', 'True')
+    HOT_FOLDER_SETTLE_SECONDS = int(os.environ.get('HOT_FOLDER_SETTLE_SECONDS', 5))
+    HOT_FOLDER_BATCH_SIZE = int(os.environ.get('HOT_FOLDER_BATCH_SIZE', 50))
+    FOLDER_MONITOR_INTERVAL_SECONDS = int(os.environ.get('FOLDER_MONITOR_INTERVAL_SECONDS', 60))
+    DATA_PAGE_SIZE = 10
+    # Threads usadas para gravar em disco os arquivos de um upload em lote
+    UPLOAD_SAVE_WORKERS = int(os.environ.get('UPLOAD_SAVE_WORKERS', 8))
+    # Uploads com checksum já conhecido: 'link' (registra como duplicata do original) ou 'reject'
+    DUPLICATE_UPLOAD_POLICY = os.environ.get('DUPLICATE_UPLOAD_POLICY', 'link')
+    # Importação de pacotes ZIP/tar: membros registrados e enfileirados a cada
+    # BULK_IMPORT_BATCH_SIZE (os workers começam antes do fim da extração)
+    BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 25))
+    BULK_IMPORT_MAX_MEMBERS = int(os.environ.get('BULK_IMPORT_MAX_MEMBERS', 5000))
+    # Comando `python -m app batch <pasta>`: processos do pool local, Files por commit e
+    # tarefas por processo antes de reciclá-lo
+    BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+    BATCH_COMMIT_EVERY = int(os.environ.get('BATCH_COMMIT_EVERY', 100))
+    BATCH_MAX_TASKS_PER_CHILD = int(os.environ.get('BATCH_MAX_TASKS_PER_CHILD', 200))
+    # Upload retomável em partes (/uploads): tamanho máximo de cada parte e validade das
+    # sessões sem atividade; as partes recebidas ficam em CHUNKED_UPLOAD_FOLDER até a montagem
+    CHUNKED_UPLOAD_FOLDER = os.environ.get('CHUNKED_UPLOAD_FOLDER', os.path.join(os.getcwd(), 'uploads_partial'))
+    CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    CHUNKED_UPLOAD_EXPIRY_HOURS = int(os.environ.get('CHUNKED_UPLOAD_EXPIRY_HOURS', 24))
+    # Por quanto tempo os totais da listagem de dados ficam em cache (segundos)
+    DATA_COUNT_CACHE_SECONDS = int(os.environ.get('DATA_COUNT_CACHE_SECONDS', 60))
+    # Compressão do texto extraído (FileContent): 'zstd' (requer o pacote zstandard) ou 'zlib'
+    CONTENT_CODEC = os.environ.get('CONTENT_CODEC', 'zstd')
+    # Arquivação: soft-deleted há mais de ARCHIVE_GRACE_DAYS e métricas com mais de
+    # METRIC_RETENTION_DAYS saem das tabelas quentes, em lotes, a cada ARCHIVE_INTERVAL_SECONDS
+    ARCHIVE_GRACE_DAYS = int(os.environ.get('ARCHIVE_GRACE_DAYS', 30))
+    METRIC_RETENTION_DAYS = int(os.environ.get('METRIC_RETENTION_DAYS', 90))
+    ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 3600))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+    ARCHIVE_MAX_BATCHES = int(os.environ.get('ARCHIVE_MAX_BATCHES', 20))
+    ARCHIVE_PURGE_STORAGE = os.environ.get('ARCHIVE_PURGE_STORAGE', 'True')
+    # Cache por usuário dos grupos acessíveis (opções de grupo nos formulários)
+    ACCESS_SCOPE_CACHE_SECONDS = int(os.environ.get('ACCESS_SCOPE_CACHE_SECONDS', 300))
+    # Stream SSE de status (/workers/events): comentário de keep-alive, duração máxima de cada
+    # conexão (o navegador reconecta sozinho) e eventos retidos por cliente lento
+    SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+    SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+    # Intervalo da reconciliação dos contadores de status por usuário/grupo (segundos)
+    STATUS_COUNTER_RECONCILE_SECONDS = int(os.environ.get('STATUS_COUNTER_RECONCILE_SECONDS', 3600))
+    # Métricas: intervalo de gravação do buffer na tabela Metric
+    METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS', 10))
+    # Token do scrape do /metrics ('Authorization: Bearer <token>'). Sem ele, só admins logados acessam
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
     #COMPLETED_FOLDER = os.path.join(os.getcwd(), 'completed')
 
@@ -33,9 +93,30 @@ class Config:
     if os.name == 'nt':  # Windows
         TESSERACT_CMD = os.path.join(PROJECT_ROOT, 'libs', 'Tesseract-OCR', 'tesseract.exe')
         POPPLER_PATH = os.path.join(PROJECT_ROOT, 'libs', 'poppler-25.11.0', 'Library', 'bin')
+        GHOSTSCRIPT_EXEC = os.environ.get('GHOSTSCRIPT_EXEC', os.path.join(PROJECT_ROOT, 'libs', 'gs', 'bin', 'gswin64c.exe'))
     else:  # Linux (EC2)
         TESSERACT_CMD = 'tesseract'  # Instalado via dnf no PATH
         POPPLER_PATH = None          # Instalado via dnf no PATH
+        GHOSTSCRIPT_EXEC = os.environ.get('GHOSTSCRIPT_EXEC', 'gs')  # Instalado via dnf no PATH
+
+    # Compressão com Ghostscript entre a extração e o upload: só PDFs acima de
+    # PDF_COMPRESSION_MIN_BYTES, e o resultado só é usado se reduzir ao menos MIN_SAVING
+    PDF_COMPRESSION_ENABLED = os.environ.get('PDF_COMPRESSION_ENABLED', 'True')
+    PDF_COMPRESSION_MIN_BYTES = int(os.environ.get('PDF_COMPRESSION_MIN_BYTES', 512 * 1024))
+    PDF_COMPRESSION_LARGE_BYTES = int(os.environ.get('PDF_COMPRESSION_LARGE_BYTES', 5 * 1024 * 1024))
+    PDF_COMPRESSION_MIN_SAVING = float(os.environ.get('PDF_COMPRESSION_MIN_SAVING', 0.15))
+    PDF_COMPRESSION_TIMEOUT_SECONDS = int(os.environ.get('PDF_COMPRESSION_TIMEOUT_SECONDS', 120))
+
+    # Quase-duplicatas (re-digitalizações): distância de Hamming máxima entre os dHash da primeira
+    # página (256 bits, no máximo 31) para indicar o candidato antes da extração, e similaridade de
+    # texto (Jaccard estimado pelo MinHash) para confirmá-lo depois dela. Só uma distância bem menor
+    # (NEAR_DUPLICATE_PAGE_CONFIRM_DISTANCE, com o mesmo número de páginas) marca a duplicata sem OCR:
+    # cópias diferentes do mesmo formulário preenchido têm a primeira página parecida
+    NEAR_DUPLICATE_DETECTION = os.environ.get('NEAR_DUPLICATE_DETECTION', 'True')
+    NEAR_DUPLICATE_PAGE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_PAGE_DISTANCE', 12))
+    NEAR_DUPLICATE_PAGE_CONFIRM_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_PAGE_CONFIRM_DISTANCE', 4))
+    NEAR_DUPLICATE_TEXT_SIMILARITY = float(os.environ.get('NEAR_DUPLICATE_TEXT_SIMILARITY', 0.9))
+    NEAR_DUPLICATE_DPI = int(os.environ.get('NEAR_DUPLICATE_DPI', 50))
 
     # Cloudflare R2 (S3-compatible) Configuration
     CLOUDFLARE_ACCOUNT_ID = os.environ.get('CLOUDFLARE_ACCOUNT_ID')
@@ -43,9 +124,31 @@ class Config:
     CLOUDFLARE_R2_SECRET_ACCESS_KEY = os.environ.get('CLOUDFLARE_R2_SECRET_ACCESS_KEY')
     CLOUDFLARE_R2_BUCKET_NAME = os.environ.get('CLOUDFLARE_R2_BUCKET_NAME')
     CLOUDFLARE_R2_ENDPOINT_URL = os.environ.get('CLOUDFLARE_R2_ENDPOINT_URL')
+    # Cliente R2 compartilhado por processo: conexões no pool, timeouts e tentativas
+    R2_MAX_POOL_CONNECTIONS = int(os.environ.get('R2_MAX_POOL_CONNECTIONS', 20))
+    R2_CONNECT_TIMEOUT = int(os.environ.get('R2_CONNECT_TIMEOUT', 5))
+    R2_READ_TIMEOUT = int(os.environ.get('R2_READ_TIMEOUT', 60))
+    R2_MAX_ATTEMPTS = int(os.environ.get('R2_MAX_ATTEMPTS', 5))
+    # Uploads multipart: tamanho mínimo, tamanho das partes (MB) e partes enviadas em paralelo
+    R2_MULTIPART_THRESHOLD_MB = int(os.environ.get('R2_MULTIPART_THRESHOLD_MB', 8))
+    R2_MULTIPART_CHUNKSIZE_MB = int(os.environ.get('R2_MULTIPART_CHUNKSIZE_MB', 8))
+    R2_MAX_CONCURRENCY = int(os.environ.get('R2_MAX_CONCURRENCY', 10))
+    # Remoção de objetos do R2 em segundo plano (delete_objects em lotes de até 1000 chaves)
+    STORAGE_PURGE_INTERVAL_SECONDS = int(os.environ.get('STORAGE_PURGE_INTERVAL_SECONDS', 30))
+    STORAGE_PURGE_BATCH_SIZE = min(int(os.environ.get('STORAGE_PURGE_BATCH_SIZE', 1000)), 1000)
+    STORAGE_PURGE_MAX_ATTEMPTS = int(os.environ.get('STORAGE_PURGE_MAX_ATTEMPTS', 10))
+    # Idade mínima de um pedido de remoção: maior que a tarefa mais longa de um worker, que pode
+    # ter reaproveitado o objeto (chave de conteúdo) e ainda não gravou a referência
+    STORAGE_PURGE_GRACE_SECONDS = int(os.environ.get('STORAGE_PURGE_GRACE_SECONDS', 3600))
+    # Chaves do R2 derivadas do SHA-256: conteúdo repetido não é reenviado nem armazenado de novo
+    R2_CONTENT_ADDRESSED = os.environ.get('R2_CONTENT_ADDRESSED', 'True')
+    # 'True': o upload vai para o R2 já na requisição; o worker recebe só a cópia local
+    STREAM_UPLOADS_TO_R2 = os.environ.get('STREAM_UPLOADS_TO_R2', 'False')
 
     # CloudAMQP Configuration
     CLOUDAMQP_URL = os.environ.get('CLOUDAMQP_URL')
+    # Intervalo de heartbeat negociado com o broker (segundos)
+    AMQP_HEARTBEAT_SECONDS = int(os.environ.get('AMQP_HEARTBEAT_SECONDS', 60))
     FLASK_ENV = os.environ.get('FLASK_ENV')
 
     # Mail Configuration
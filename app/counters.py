@@ -0,0 +1,152 @@
+import logging
+from collections import Counter
+from sqlalchemy import event, inspect, func, select, update, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import sqlite, postgresql
+
+from app.models import File, FileStatusCounter
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('pending', 'processing', 'completed', 'failed', 'duplicate')
+
+
+def _scopes(user_id, group_id):
+    scopes = []
+    if user_id is not None:
+        scopes.append(('user', user_id))
+    if group_id is not None:
+        scopes.append(('group', group_id))
+    return scopes
+
+
+def _old_value(obj, attr_name):
+    history = getattr(inspect(obj).attrs, attr_name).history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr_name)
+
+
+def _status_deltas(session):
+    """Calcula as variações de contadores causadas pelas mudanças de File pendentes no flush."""
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, File):
+            for scope in _scopes(obj.user_id, obj.group_id):
+                deltas[scope + (obj.status or 'pending',)] += 1
+
+    for obj in session.dirty:
+        if not isinstance(obj, File) or not session.is_modified(obj):
+            continue
+        old_status, new_status = _old_value(obj, 'status'), obj.status
+        old_scopes = _scopes(_old_value(obj, 'user_id'), _old_value(obj, 'group_id'))
+        new_scopes = _scopes(obj.user_id, obj.group_id)
+        if old_status == new_status and old_scopes == new_scopes:
+            continue
+        for scope in old_scopes:
+            deltas[scope + (old_status,)] -= 1
+        for scope in new_scopes:
+            deltas[scope + (new_status,)] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, File):
+            for scope in _scopes(_old_value(obj, 'user_id'), _old_value(obj, 'group_id')):
+                deltas[scope + (_old_value(obj, 'status'),)] -= 1
+    return {key: delta for key, delta in deltas.items() if delta and key[2] is not None}
+
+
+def _apply_delta(connection, scope_type, scope_id, status, delta):
+    table = FileStatusCounter.__table__
+    values = {'scope_type': scope_type, 'scope_id': scope_id, 'status': status, 'count': delta}
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['scope_type', 'scope_id', 'status'],
+            set_={'count': table.c.count + stmt.excluded.count}
+        )
+        connection.execute(stmt)
+        return
+
+    result = connection.execute(
+        update(table)
+        .where(table.c.scope_type == scope_type, table.c.scope_id == scope_id, table.c.status == status)
+        .values(count=table.c.count + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+# Sem active_history, atribuir um valor a um objeto expirado (ex.: após commit)
+# não carrega o valor anterior, e a transição antiga ficaria invisível no flush.
+for _attr in (File.status, File.user_id, File.group_id):
+    event.listen(_attr, 'set', lambda target, value, oldvalue, initiator: value, active_history=True, retval=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_status_counters(session, flush_context):
+    """Atualiza os contadores na mesma transação que grava a transição de status."""
+    deltas = _status_deltas(session)
+    if not deltas:
+        return
+    connection = session.connection()
+    for (scope_type, scope_id, status), delta in sorted(deltas.items()):
+        _apply_delta(connection, scope_type, scope_id, status, delta)
+
+
+def get_status_counts(session, scope_type, scope_id):
+    """Leitura O(1) dos contadores de um usuário ou grupo."""
+    counts = dict.fromkeys(STATUSES, 0)
+    rows = session.query(FileStatusCounter.status, FileStatusCounter.count).filter_by(
+        scope_type=scope_type, scope_id=scope_id
+    ).all()
+    for status, count in rows:
+        counts[status] = count
+    return counts
+
+
+def reconcile_status_counters(session):
+    """
+    Recalcula todos os contadores a partir da tabela `file` e corrige divergências.
+    Retorna o número de contadores que estavam incorretos.
+    """
+    expected = {}
+    for scope_type, column in (('user', File.user_id), ('group', File.group_id)):
+        rows = session.execute(
+            select(column, File.status, func.count()).where(column.isnot(None), File.status.isnot(None)).group_by(column, File.status)
+        ).all()
+        for scope_id, status, count in rows:
+            expected[(scope_type, scope_id, status)] = count
+
+    current = {
+        (c.scope_type, c.scope_id, c.status): c.count
+        for c in session.query(FileStatusCounter).all()
+    }
+    drifted = {key for key in expected.keys() | current.keys() if expected.get(key, 0) != current.get(key, 0)}
+    if drifted:
+        # Só as linhas divergentes, cada uma recalculada em um único comando: deltas gravados
+        # por outras transações entre as leituras acima não são perdidos nem aplicados duas vezes
+        table = FileStatusCounter.__table__
+        for scope_type, scope_id, status in sorted(drifted):
+            column = File.user_id if scope_type == 'user' else File.group_id
+            actual = select(func.count()).where(column == scope_id, File.status == status).scalar_subquery()
+            result = session.execute(
+                update(table)
+                .where(table.c.scope_type == scope_type, table.c.scope_id == scope_id, table.c.status == status)
+                .values(count=actual)
+            )
+            if result.rowcount == 0:
+                try:
+                    with session.begin_nested():
+                        session.execute(table.insert().from_select(
+                            ['scope_type', 'scope_id', 'status', 'count'],
+                            select(literal(scope_type), literal(scope_id), literal(status), actual)
+                        ))
+                except IntegrityError:
+                    # Criada por um flush concorrente: o delta dele já está na linha nova
+                    logger.info(f"Counter {scope_type}/{scope_id}/{status} created concurrently; left as is.")
+        logger.warning(f"Reconciled {len(drifted)} drifted status counters.")
+    session.commit()
+    return len(drifted)
@@ -0,0 +1,68 @@
+import sqlite3
+import logging
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import StaticPool
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Perfil SQLite: o processo web, a thread de resultados e os workers escrevem no mesmo
+# arquivo. WAL permite leituras concorrentes com um escritor, e o busy_timeout faz o
+# escritor esperar pelo lock em vez de falhar com "database is locked".
+SQLITE_POOL_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+}
+
+
+def is_sqlite(uri):
+    return bool(uri) and make_url(uri).get_backend_name() == 'sqlite'
+
+
+def _is_memory(uri):
+    return make_url(uri).database in (None, '', ':memory:')
+
+
+def engine_options(uri, base_options, sqlite_pool=SQLITE_POOL_OPTIONS):
+    """
+    Opções de engine para `uri`. Para SQLite, substitui o pool pensado para PostgreSQL
+    por `sqlite_pool` (ou um StaticPool para bancos em memória).
+    """
+    if not is_sqlite(uri):
+        return dict(base_options)
+
+    options = {key: value for key, value in base_options.items()
+               if key not in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')}
+    connect_args = dict(options.pop('connect_args', {}))
+    connect_args.setdefault('timeout', Config.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    connect_args.setdefault('check_same_thread', False)
+    options['connect_args'] = connect_args
+
+    if _is_memory(uri):
+        options['poolclass'] = StaticPool
+    else:
+        options.update(sqlite_pool)
+    return options
+
+
+def single_writer_enabled(dialect_name):
+    """Workers enviam as transições de status ao processo principal em vez de gravá-las."""
+    return dialect_name == 'sqlite' and Config.SQLITE_SINGLE_WRITER == 'True'
+
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        if Config.SQLITE_WAL == 'True':
+            # Ignorado pelo SQLite em bancos em memória (continua 'memory')
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}')
+    finally:
+        cursor.close()
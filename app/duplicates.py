@@ -0,0 +1,93 @@
+import os
+import zlib
+import hashlib
+import logging
+from collections import Counter
+from sqlalchemy import select, func, and_
+
+from app.models import File
+from app.access import file_access_filter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Bytes lidos do início e do fim do arquivo pelo pré-filtro
+FINGERPRINT_BYTES = 64 * 1024
+
+
+def save_hashed(stream, path, head=b'', max_bytes=None):
+    """
+    Grava `head` + `stream` em `path` calculando o SHA-256 no caminho. Retorna (checksum, tamanho).
+    Com `max_bytes`, interrompe com ValueError assim que o limite é ultrapassado (o arquivo parcial fica com o chamador).
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as f:
+        chunk = head
+        while chunk or (chunk := stream.read(CHUNK_SIZE)):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise ValueError(f'more than {max_bytes} bytes')
+            hasher.update(chunk)
+            f.write(chunk)
+            chunk = b''
+    return hasher.hexdigest(), size
+
+
+def original_filter(user_id):
+    """
+    Arquivos que podem ser o original de uma cópia enviada por `user_id`: visíveis para ele
+    (próprios ou de grupos acessíveis), não apagados e nem duplicatas ou falhas, que
+    precisam ser processados de novo quando o conteúdo volta.
+    """
+    return and_(File.is_deleted == False, File.duplicate_of_id.is_(None),
+                File.status.notin_(['duplicate', 'failed']), file_access_filter(user_id))
+
+
+def find_originals(session, checksums, user_id):
+    """
+    {checksum: id} do primeiro arquivo de `original_filter(user_id)` com cada checksum,
+    em uma consulta sobre o índice ix_file_checksum.
+    """
+    checksums = [checksum for checksum in set(checksums) if checksum]
+    if not checksums:
+        return {}
+    rows = session.execute(
+        select(File.checksum, func.min(File.id))
+        .where(File.checksum.in_(checksums), original_filter(user_id))
+        .group_by(File.checksum)
+    ).all()
+    return {checksum: file_id for checksum, file_id in rows}
+
+
+def quick_fingerprint(path):
+    """
+    Pré-filtro não criptográfico: (tamanho, CRC32 do início e do fim). Arquivos com
+    impressões diferentes certamente não são iguais; iguais ainda precisam do SHA-256.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        crc = zlib.crc32(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            crc = zlib.crc32(f.read(FINGERPRINT_BYTES), crc)
+    return size, crc
+
+
+def duplicate_candidates(session, paths):
+    """
+    Para importações grandes: retorna os caminhos que *podem* ser duplicatas e por isso
+    precisam do SHA-256 antes de enfileirar. Um arquivo é descartado do hash antecipado
+    quando nenhum arquivo registrado tem o mesmo tamanho e nenhum outro do lote tem a
+    mesma impressão. (Arquivos antigos sem `size` continuam cobertos pela verificação do worker.)
+    """
+    fingerprints = {path: quick_fingerprint(path) for path in paths}
+    sizes = {size for size, _ in fingerprints.values()}
+    known_sizes = set()
+    if sizes:
+        known_sizes = set(session.execute(
+            select(File.size).where(File.size.in_(sizes)).distinct()
+        ).scalars())
+    in_batch = Counter(fingerprints.values())
+    return [path for path, fingerprint in fingerprints.items()
+            if fingerprint[0] in known_sizes or in_batch[fingerprint] > 1]
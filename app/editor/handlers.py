@@ -8,7 +8,7 @@ from flask_login import current_user
 from docx import Document
 from io import BytesIO
 
-from app.models import Group
+from app.access import group_choices
 from .forms import DocumentForm
 
 logger = logging.getLogger(__name__)
@@ -32,20 +32,14 @@ class EditorHandler:
 
     def edit_termo(self, filename):
         form = DocumentForm()
-        user_groups = current_user.groups.all()
-        created_groups = Group.query.filter_by(creator_id=current_user.id).all()
-        all_groups = list(set(user_groups + created_groups))
-        form.group.choices = [(0, 'No Group')] + [(g.id, g.name) for g in all_groups]
+        form.group.choices = group_choices(current_user.id)
         return render_template('editor/edit.html', title='Fill Document Data', filename=filename, form=form)
 
     def save_termo(self):
         filename = request.form.get('filename')
         form = DocumentForm()
         
-        user_groups = current_user.groups.all()
-        created_groups = Group.query.filter_by(creator_id=current_user.id).all()
-        all_groups = list(set(user_groups + created_groups))
-        form.group.choices = [(0, 'No Group')] + [(g.id, g.name) for g in all_groups]
+        form.group.choices = group_choices(current_user.id)
 
         if not form.validate_on_submit():
             flash('Please fill all required fields.', 'danger')
@@ -0,0 +1,112 @@
+import json
+import queue
+import itertools
+import threading
+import logging
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Fila de eventos de um cliente SSE. Se o cliente não acompanha, marca `overflowed` em vez de bloquear."""
+
+    def __init__(self, scopes, max_size):
+        self.scopes = frozenset(scopes)
+        self.events = queue.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class StatusBroadcaster:
+    """
+    Distribui as transições de status aplicadas neste processo (ingestor de resultados,
+    uploads) aos streams SSE abertos, por escopo ('user', id) / ('group', id).
+    Em memória: os clientes precisam estar no processo que roda o ingestor de resultados.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, scopes, max_size=None):
+        subscription = Subscription(scopes, max_size or Config.SSE_QUEUE_SIZE)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def publish(self, scopes, payload):
+        scopes = set(scopes)
+        with self._lock:
+            targets = [s for s in self._subscriptions if s.scopes & scopes]
+        if not targets:
+            return
+        event = dict(payload, event_id=next(self._ids))
+        for subscription in targets:
+            subscription.put(event)
+
+
+status_events = StatusBroadcaster()
+
+
+def file_scopes(user_id, group_id):
+    scopes = [('user', user_id)]
+    if group_id:
+        scopes.append(('group', group_id))
+    return scopes
+
+
+def publish_file_status(file_record, previous=None):
+    """Publica a transição de `file_record` (já gravada) para o dono e o grupo do arquivo."""
+    # Sem clientes conectados, nem recarrega o objeto expirado pelo commit
+    if not status_events.subscriber_count() or file_record.status == previous:
+        return
+    try:
+        status_events.publish(file_scopes(file_record.user_id, file_record.group_id), {
+            'file_id': file_record.id,
+            'status': file_record.status,
+            'previous': previous,
+            'original_filename': file_record.original_filename,
+            'user_id': file_record.user_id,
+            'group_id': file_record.group_id,
+        })
+    except Exception as e:
+        # Notificação é best-effort: a transição já está no banco
+        logger.warning(f"Could not publish status event for file {file_record.id}: {e}")
+
+
+def format_sse(data=None, event=None, event_id=None, comment=None, retry=None):
+    """Serializa uma mensagem no formato text/event-stream."""
+    lines = []
+    if comment is not None:
+        lines.append(f': {comment}')
+    if retry is not None:
+        lines.append(f'retry: {retry}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    if data is not None:
+        lines.append('data: ' + json.dumps(data))
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,293 @@
+import os
+import re
+import uuid
+import base64
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from flask import request, current_app, jsonify, url_for
+from flask_login import current_user
+from sqlalchemy import select, update
+from werkzeug.utils import secure_filename
+
+from app.models import db, Group, UploadSession
+from app.config import Config
+from app.access import can_access_group
+from app.storage import file_sha256
+from app.ingest import ingest_files, discard
+from app.bulk_import import is_archive, import_archive
+from .handlers import FileHandler
+
+logger = logging.getLogger(__name__)
+
+# Algoritmos aceitos no cabeçalho Upload-Checksum ("<algoritmo> <digest em base64>")
+CHUNK_CHECKSUM_ALGORITHMS = {'sha256', 'sha1', 'md5'}
+# Código usado pelo tus para "Checksum Mismatch": a parte é descartada e deve ser reenviada
+CHECKSUM_MISMATCH = 460
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+
+
+def part_path(upload_id, folder=None):
+    return os.path.join(folder or Config.CHUNKED_UPLOAD_FOLDER, f'{upload_id}.part')
+
+
+def expire_upload_sessions(session, expiry_hours=None, folder=None):
+    """
+    Remove sessões de upload sem atividade há mais de CHUNKED_UPLOAD_EXPIRY_HOURS (e os
+    bytes parciais). Sessões concluídas saem pelo mesmo critério. Retorna quantas foram removidas.
+    """
+    expiry_hours = Config.CHUNKED_UPLOAD_EXPIRY_HOURS if expiry_hours is None else expiry_hours
+    cutoff = datetime.utcnow() - timedelta(hours=expiry_hours)
+    uploads = session.execute(
+        select(UploadSession).where(UploadSession.updated_at < cutoff)
+    ).scalars().all()
+    for upload in uploads:
+        discard(part_path(upload.id, folder))
+        session.delete(upload)
+    session.commit()
+    if uploads:
+        logger.info(f"Expired {len(uploads)} stale upload sessions.")
+    return len(uploads)
+
+
+class ChunkedUploadHandler(FileHandler):
+    """
+    Upload retomável em partes, no estilo do protocolo tus:
+
+    - POST /uploads {filename, size, checksum?, group?} cria a sessão;
+    - GET /uploads/<id> informa o offset já confirmado (para retomar após queda);
+    - PATCH /uploads/<id> envia os bytes a partir de `Upload-Offset`, com
+      `Upload-Checksum: sha256 <base64>` opcional verificado antes de aceitar a parte;
+    - DELETE /uploads/<id> cancela.
+
+    Quando o último byte chega, o arquivo é movido para UPLOAD_FOLDER e registrado/enfileirado
+    na hora (app/ingest.py), sem esperar o restante do lote. Pacotes ZIP/tar são extraídos
+    e seus membros enfileirados (app/bulk_import.py).
+    """
+
+    def _error(self, message, status, upload=None):
+        response = jsonify({'error': message})
+        response.status_code = status
+        if upload is not None:
+            response.headers['Upload-Offset'] = str(upload.offset)
+        return response
+
+    def _state(self, upload, code=200, **extra):
+        response = jsonify({
+            'upload_id': upload.id,
+            'offset': upload.offset,
+            'size': upload.size,
+            'chunk_size': current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE'],
+            'complete': upload.file_id is not None,
+            'file_id': upload.file_id,
+            **extra,
+        })
+        response.status_code = code
+        response.headers['Upload-Offset'] = str(upload.offset)
+        response.headers['Upload-Length'] = str(upload.size)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    def _get_upload(self, upload_id):
+        upload = db.session.get(UploadSession, upload_id)
+        if upload is None or upload.user_id != current_user.id:
+            return None
+        return upload
+
+    def _part_path(self, upload_id):
+        return part_path(upload_id, current_app.config['CHUNKED_UPLOAD_FOLDER'])
+
+    def create_upload(self):
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename') or ''
+        if not self._allowed_file(filename) and not is_archive(filename):
+            return self._error(f'Invalid file: {filename}. Allowed types are: png, jpg, jpeg, gif, pdf', 400)
+        try:
+            size = int(data.get('size'))
+            group_id = int(data.get('group') or 0)
+        except (TypeError, ValueError):
+            return self._error('size and group must be integers.', 400)
+        if size <= 0:
+            return self._error('size must be positive.', 400)
+        if filename.lower().endswith('.pdf') and size > current_app.config['MAX_PDF_SIZE']:
+            return self._error(f'PDF file "{filename}" is too large.', 413)
+        if size > current_app.config['MAX_CONTENT_LENGTH']:
+            return self._error(f'File "{filename}" is too large.', 413)
+        checksum = (data.get('checksum') or '').lower() or None
+        if checksum and not SHA256_HEX.match(checksum):
+            return self._error('checksum must be a hex SHA-256 digest.', 400)
+        if group_id > 0:
+            group = db.session.get(Group, group_id)
+            if group is None or not can_access_group(current_user, group):
+                return self._error('You cannot upload files to this group.', 403)
+
+        upload = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=current_user.id,
+            group_id=group_id or None,
+            original_filename=secure_filename(filename),
+            size=size,
+            offset=0,
+            checksum=checksum
+        )
+        os.makedirs(current_app.config['CHUNKED_UPLOAD_FOLDER'], exist_ok=True)
+        open(self._part_path(upload.id), 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+
+        response = self._state(upload, 201)
+        response.headers['Location'] = url_for('files.upload_status', upload_id=upload.id)
+        return response
+
+    def upload_status(self, upload_id):
+        upload = self._get_upload(upload_id)
+        if upload is None:
+            return self._error('Upload not found.', 404)
+        return self._state(upload)
+
+    def cancel_upload(self, upload_id):
+        upload = self._get_upload(upload_id)
+        if upload is None:
+            return self._error('Upload not found.', 404)
+        discard(self._part_path(upload.id))
+        db.session.delete(upload)
+        db.session.commit()
+        return '', 204
+
+    def upload_chunk(self, upload_id):
+        upload = self._get_upload(upload_id)
+        if upload is None:
+            return self._error('Upload not found.', 404)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return self._error('Upload-Offset header is required.', 400)
+        if offset != upload.offset:
+            # O cliente deve consultar o offset (GET) e continuar de lá
+            return self._error('Upload-Offset does not match the received bytes.', 409, upload)
+        if upload.file_id is not None:
+            return self._state(upload)
+
+        chunk_size = current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']
+        if (request.content_length or 0) > chunk_size:
+            return self._error(f'Chunks are limited to {chunk_size} bytes.', 413, upload)
+        chunk = request.stream.read(chunk_size + 1)
+        if len(chunk) > chunk_size or offset + len(chunk) > upload.size:
+            return self._error('Chunk exceeds the chunk size or the declared file size.', 413, upload)
+
+        checksum_error = self._verify_chunk(chunk, request.headers.get('Upload-Checksum'))
+        if checksum_error:
+            return self._error(*checksum_error, upload)
+
+        if chunk:
+            path = self._part_path(upload.id)
+            if not os.path.exists(path):
+                return self._error('Upload data is no longer available.', 410)
+            # Reserva a parte antes de gravar: o UPDATE condicional trava a linha até o commit, então
+            # uma requisição repetida/concorrente com o mesmo offset espera e perde (rowcount 0)
+            # em vez de sobrescrever o .part depois que esta parte foi confirmada
+            result = db.session.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload.id, UploadSession.offset == offset)
+                .values(offset=offset + len(chunk), updated_at=datetime.utcnow())
+            )
+            if result.rowcount == 0:
+                db.session.rollback()
+                db.session.refresh(upload)
+                return self._error('Upload-Offset does not match the received bytes.', 409, upload)
+            try:
+                with open(path, 'r+b') as f:
+                    f.seek(offset)
+                    f.write(chunk)
+                    f.truncate()
+            except OSError:
+                db.session.rollback()
+                raise
+            db.session.commit()
+            db.session.refresh(upload)
+
+        if upload.offset == upload.size:
+            return self._complete(upload)
+        return self._state(upload)
+
+    def _verify_chunk(self, chunk, header):
+        """(mensagem, status) se o Upload-Checksum é inválido ou não confere com a parte, senão None."""
+        if not header:
+            return None
+        algorithm, _, digest = header.strip().partition(' ')
+        algorithm = algorithm.lower()
+        if algorithm not in CHUNK_CHECKSUM_ALGORITHMS:
+            return f'Unsupported checksum algorithm: {algorithm}.', 400
+        try:
+            expected = base64.b64decode(digest.strip(), validate=True)
+        except ValueError:
+            return 'Upload-Checksum digest must be base64.', 400
+        if hashlib.new(algorithm, chunk).digest() != expected:
+            return 'Chunk checksum mismatch.', CHECKSUM_MISMATCH
+        return None
+
+    def _complete(self, upload):
+        """Monta o arquivo final em UPLOAD_FOLDER, confere o conteúdo e o registra/enfileira."""
+        part = self._part_path(upload.id)
+        if is_archive(upload.original_filename):
+            return self._import_archive(upload, part)
+        try:
+            with open(part, 'rb') as f:
+                allowed = self._is_actual_allowed_file(f)
+        except FileNotFoundError:
+            # Outra requisição já montou (ou descartou) este upload
+            return self._error('Upload data is no longer available.', 410, upload)
+        if not allowed:
+            return self._reject(upload, part, f'File "{upload.original_filename}": File content does not match allowed types (PDF/Images).', 415)
+
+        unique_filename = upload.id + os.path.splitext(upload.original_filename)[1]
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+        shutil.move(part, path)
+        checksum = file_sha256(path)
+        if upload.checksum and checksum != upload.checksum:
+            return self._reject(upload, path, f'File "{upload.original_filename}" does not match the declared checksum.', CHECKSUM_MISMATCH)
+
+        errors = []
+        new_files, linked = ingest_files(
+            db.session, [(upload.original_filename, unique_filename, path, checksum, upload.size, False)],
+            upload.user_id, upload.group_id, errors, policy=current_app.config['DUPLICATE_UPLOAD_POLICY']
+        )
+        registered = new_files + linked
+        if not registered:
+            message = errors[0][0] if errors else 'File could not be registered.'
+            return self._reject(upload, path, message, 409 if errors and errors[0][1] == 'warning' else 500)
+
+        upload.file_id = registered[0].id
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Chunked upload {upload.id} completed as file {upload.file_id} ({upload.size} bytes).")
+        return self._state(upload, status=registered[0].status)
+
+    def _import_archive(self, upload, part):
+        """
+        Pacote ZIP/tar: os membros vão para a fila direto do arquivo montado e a sessão é
+        encerrada (um GET posterior responde 404; reenviar o pacote só vincula duplicatas).
+        """
+        errors = []
+        try:
+            with open(part, 'rb') as f:
+                queued, linked = import_archive(
+                    db.session, f, upload.original_filename, upload.user_id, upload.group_id, errors,
+                    policy=current_app.config['DUPLICATE_UPLOAD_POLICY'], upload_folder=current_app.config['UPLOAD_FOLDER']
+                )
+        except FileNotFoundError:
+            return self._error('Upload data is no longer available.', 410, upload)
+        response = self._state(upload, complete=True, queued=queued, linked=linked,
+                               errors=[message for message, _ in errors])
+        discard(part)
+        db.session.delete(upload)
+        db.session.commit()
+        return response
+
+    def _reject(self, upload, path, message, status):
+        discard(path)
+        db.session.delete(upload)
+        db.session.commit()
+        return self._error(message, status)
@@ -1,22 +1,32 @@
 import os
 import uuid
+import base64
 import logging
-import boto3
-import magic
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
-from flask import render_template, redirect, url_for, flash, request, current_app, send_from_directory
+from flask import render_template, redirect, url_for, flash, request, current_app, send_from_directory, jsonify, abort
 from flask_login import current_user
-from flask_paginate import Pagination
 from werkzeug.utils import secure_filename
-from sqlalchemy import or_
+from sqlalchemy import select, tuple_, func
+from sqlalchemy.orm import load_only
 from datetime import datetime, timezone
 
-from app.models import db, File, Group, record_metric
-from app.mq import MessageQueue
+from app.models import db, File, Group, FileEquipment, FileImei, FilePatrimonio, normalize_asset_code, prefix_match, load_json_list
+from app.search import search_index
+from app.storage import get_r2_client, stream_upload
+from app.duplicates import save_hashed
+from app.ingest import ingest_files, is_allowed_content, MAGIC_HEAD_BYTES
+from app.bulk_import import is_archive, import_archive
+from app.config import Config
+from app.cache import TTLCache
+from app.access import group_choices, can_access_group, can_access_file, file_access_filter
 from .forms import FileUploadForm, SearchForm
 
 logger = logging.getLogger(__name__)
 
+# Totais da listagem por (usuário, busca, filtro); contagem exata apenas sob demanda
+data_count_cache = TTLCache(Config.DATA_COUNT_CACHE_SECONDS)
+
 class FileHandler:
     """
     Encapsula a lógica de manipulação de arquivos (upload, visualização, etc.).
@@ -28,16 +38,9 @@ class FileHandler:
 
     def _is_actual_allowed_file(self, file_stream):
         """Verifica o tipo real do arquivo usando magic numbers."""
-        head = file_stream.read(2048) # Lê os primeiros 2048 bytes para determinar o tipo
+        head = file_stream.read(MAGIC_HEAD_BYTES) # Lê os primeiros bytes para determinar o tipo
         file_stream.seek(0) # Volta para o início do stream
-        
-        mime = magic.from_buffer(head, mime=True)
-        allowed_mimes = {
-            'application/pdf': 'pdf',
-            'image/png': 'png',
-            'image/jpeg': 'jpg'
-        }
-        return mime in allowed_mimes
+        return is_allowed_content(head)
 
     def home(self):
         return render_template('home.html', title='Home')
@@ -49,10 +52,7 @@ class FileHandler:
     def upload_file(self):
         form = FileUploadForm()
         # Populate group choices
-        user_groups = current_user.groups.all()
-        created_groups = Group.query.filter_by(creator_id=current_user.id).all()
-        all_groups = list(set(user_groups + created_groups))
-        form.group.choices = [(0, 'No Group')] + [(g.id, g.name) for g in all_groups]
+        form.group.choices = group_choices(current_user.id)
 
         if request.method == 'POST':
             uploaded_files = request.files.getlist('file')
@@ -62,7 +62,12 @@ class FileHandler:
                 return redirect(request.url)
 
             # Get group id from form
-            group_id = int(request.form.get('group', 0))
+            group_id = request.form.get('group', 0, type=int)
+            if group_id > 0:
+                group = db.session.get(Group, group_id)
+                if group is None or not can_access_group(current_user, group):
+                    flash('You cannot upload files to this group.', 'danger')
+                    return redirect(request.url)
             successful_uploads = self._process_uploaded_files(uploaded_files, group_id)
             
             if successful_uploads > 0:
@@ -75,54 +80,101 @@ class FileHandler:
         return render_template('upload.html', title='Upload File', form=form)
 
     def _process_uploaded_files(self, files, group_id=0):
-        successful_uploads = 0
-        local_mq = MessageQueue()
+        """
+        Ingestão em lote: valida cada arquivo, grava todos em disco em paralelo, insere as
+        linhas de File em um único commit e publica as tarefas em um lote confirmado.
+        Erros são reportados por arquivo sem interromper o restante do lote. Pacotes ZIP/tar
+        são extraídos e enfileirados aos poucos (app/bulk_import.py).
+        """
+        errors = []
+        accepted = []
+        archives = []
+        for file in files:
+            if file and is_archive(file.filename):
+                archives.append(file)
+                continue
+            if not file or not self._allowed_file(file.filename):
+                errors.append((f'Skipped invalid file: {file.filename}. Allowed types are: png, jpg, jpeg, gif, pdf', 'warning'))
+                continue
+            # Check actual file type via magic numbers
+            if not self._is_actual_allowed_file(file):
+                errors.append((f'Skipped file "{file.filename}": File content does not match allowed types (PDF/Images).', 'danger'))
+                continue
+            # Check file size for PDFs
+            if file.filename.lower().endswith('.pdf') and file.content_length > current_app.config['MAX_PDF_SIZE']:
+                errors.append((f'PDF file "{file.filename}" is too large. Maximum size is 200 MB.', 'danger'))
+                continue
+
+            original_filename = secure_filename(file.filename)
+            unique_filename = str(uuid.uuid4()) + os.path.splitext(original_filename)[1]
+            file_path_in_uploads = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+            accepted.append((file, original_filename, unique_filename, file_path_in_uploads))
+
+        saved = self._save_concurrently(accepted, errors)
+        uploads = [(original_filename, unique_filename, path) + result
+                   for (_, original_filename, unique_filename, path), result in saved]
+        new_files, linked = ingest_files(db.session, uploads, current_user.id, group_id, errors,
+                                         policy=current_app.config['DUPLICATE_UPLOAD_POLICY'])
+        queued, linked = len(new_files), len(linked)
+
+        for archive in archives:
+            archive_queued, archive_linked = import_archive(
+                db.session, archive.stream, archive.filename, current_user.id, group_id, errors,
+                policy=current_app.config['DUPLICATE_UPLOAD_POLICY'], upload_folder=current_app.config['UPLOAD_FOLDER']
+            )
+            queued += archive_queued
+            linked += archive_linked
+
+        if linked:
+            flash(f'{linked} duplicate file(s) linked to earlier uploads and not reprocessed.', 'info')
+        self._flash_upload_errors(errors)
+        return queued + linked
+
+    def _save_concurrently(self, accepted, errors):
+        """
+        Grava os uploads em disco em paralelo, calculando o SHA-256 durante a gravação.
+        Com STREAM_UPLOADS_TO_R2, cada upload segue direto para o R2 enquanto a cópia local
+        é gravada. Retorna [(entrada, (checksum, tamanho, enviado ao R2))] dos que foram salvos.
+        """
+        if not accepted:
+            return []
+        config = current_app.config
+        stream_to_r2 = config['R2_FEATURE_FLAG'] == 'True' and config['STREAM_UPLOADS_TO_R2'] == 'True'
+
+        def save(entry):
+            file, _, unique_filename, path = entry
+            if stream_to_r2:
+                try:
+                    return stream_upload(file.stream, unique_filename, path, config) + (True,)
+                except Exception as e:
+                    # O worker envia o arquivo depois, como no fluxo normal
+                    logger.warning(f"Streaming upload of '{unique_filename}' to R2 failed, saving locally: {e}")
+                    file.stream.seek(0)
+            return save_hashed(file.stream, path) + (False,)
+
+        saved = []
+        with ThreadPoolExecutor(max_workers=min(current_app.config['UPLOAD_SAVE_WORKERS'], len(accepted))) as executor:
+            futures = [(entry, executor.submit(save, entry)) for entry in accepted]
+            for entry, future in futures:
+                try:
+                    saved.append((entry, future.result()))
+                except Exception as e:
+                    logger.error(f"Error saving upload '{entry[1]}': {e}", exc_info=True)
+                    self._discard(entry[3])
+                    errors.append((f'File "{entry[1]}" could not be saved. Please try again.', 'danger'))
+        return saved
+
+    def _discard(self, path):
         try:
-            for file in files:
-                if file and self._allowed_file(file.filename):
-                    # Check actual file type via magic numbers
-                    if not self._is_actual_allowed_file(file):
-                        flash(f'Skipped file "{file.filename}": File content does not match allowed types (PDF/Images).', 'danger')
-                        continue
-
-                    # Check file size for PDFs
-                    if file.filename.lower().endswith('.pdf') and file.content_length > current_app.config['MAX_PDF_SIZE']:
-                        flash(f'PDF file "{file.filename}" is too large. Maximum size is 200 MB.', 'danger')
-                        continue
-
-                    original_filename = secure_filename(file.filename)
-                    unique_filename = str(uuid.uuid4()) + os.path.splitext(original_filename)[1]
-                    file_path_in_uploads = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-
-                    file.save(file_path_in_uploads)
-
-                    new_file = File(
-                        filename=unique_filename,
-                        original_filename=original_filename,
-                        filepath=file_path_in_uploads,
-                        user_id=current_user.id,
-                        group_id=group_id if group_id > 0 else None,
-                        status='pending'
-                    )
-                    db.session.add(new_file)
-                    db.session.commit()
-
-                    record_metric('file_upload', 1, {'user_id': current_user.id, 'file_id': new_file.id})
-
-                    local_mq.publish_task({'file_id': new_file.id, 'filepath': new_file.filepath})
-                    successful_uploads += 1
-                    logger.info(f"File '{original_filename}' uploaded by '{current_user.username}' and added to queue.")
-
-                    # O arquivo local é removido na task do worker após o upload para o R2
-                else:
-                    flash(f'Skipped invalid file: {file.filename}. Allowed types are: png, jpg, jpeg, gif, pdf', 'warning')
-        except Exception as e:
-            logger.error(f"Error during file processing/queueing: {e}", exc_info=True)
-            flash("An error occurred during file upload. Please try again.", "danger")
-        finally:
-            local_mq.close()
-            
-        return successful_uploads
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _flash_upload_errors(self, errors, limit=10):
+        for message, category in errors[:limit]:
+            flash(message, category)
+        if len(errors) > limit:
+            flash(f'{len(errors) - limit} more file(s) were skipped.', 'warning')
 
     def view_data(self):
         search_form = SearchForm()
@@ -135,19 +187,125 @@ class FileHandler:
             return redirect(url_for('files.view_data', query=query, filter=filter_field))
 
         files_query = self._build_data_query(query, filter_field)
-        page = int(request.args.get('page', 1))
-        per_page = 10
-        total_filtered = files_query.count()
-        files = files_query.offset((page - 1) * per_page).limit(per_page).all()
-        pagination = Pagination(page=page, per_page=per_page, total=total_filtered, css_framework='bootstrap4')
+        per_page = current_app.config['DATA_PAGE_SIZE']
+        exact = request.args.get('exact') == '1'
+
+        if filter_field == 'processed_data' and query:
+            # Resultados ranqueados por relevância: paginação por posição
+            page = max(1, int(request.args.get('page', 1)))
+            rows = files_query.options(*self._listing_options()).offset((page - 1) * per_page).limit(per_page + 1).all()
+            files = rows[:per_page]
+            next_args = {'page': page + 1} if len(rows) > per_page else None
+            prev_args = {'page': page - 1} if page > 1 else None
+        else:
+            files, next_args, prev_args = self._keyset_page(
+                files_query, per_page, request.args.get('after'), request.args.get('before')
+            )
 
+        total_filtered = self._cached_count(files_query, query, filter_field, exact)
         # Total PDFs available to the user (own + group files)
-        total_available = self._build_data_query('', '').count()
+        total_available = self._cached_count(self._build_data_query('', ''), '', '', exact)
 
         if query:
             flash(f"Showing results for '{query}' in '{filter_field}'", 'info')
 
-        return render_template('data.html', title='View Data', files=files, search_form=search_form, current_query=query, current_filter=filter_field, pagination=pagination, total=total_available)
+        return render_template('data.html', title='View Data', files=files, search_form=search_form, current_query=query,
+                               current_filter=filter_field, next_args=next_args, prev_args=prev_args,
+                               total=total_available, total_filtered=total_filtered, exact=exact,
+                               equipment_counts=self._equipment_counts(files))
+
+    def file_details(self, file_id):
+        """Detalhes de um documento (texto extraído e ativos), carregados ao abrir o modal da listagem."""
+        file_record = db.session.get(File, file_id)
+        if file_record is None or file_record.is_deleted or not can_access_file(current_user, file_record):
+            abort(404)
+        return jsonify({
+            'id': file_record.id,
+            'original_filename': file_record.original_filename,
+            'status': file_record.status,
+            'nome': file_record.nome,
+            'matricula': file_record.matricula,
+            'funcao': file_record.funcao,
+            'empregador': file_record.empregador,
+            'rg': file_record.rg,
+            'cpf': file_record.cpf,
+            # Valores como extraídos (as tabelas de ativos guardam a forma normalizada para busca)
+            'equipamentos': [item.get('nome_equipamento') for item in load_json_list(file_record.equipamentos) if isinstance(item, dict)],
+            'patrimonio_numbers': load_json_list(file_record.patrimonio_numbers),
+            'imei_numbers': load_json_list(file_record.imei_numbers),
+            'processed_data': file_record.processed_data,
+            'download_url': url_for('files.download_file', filename=file_record.filename) if file_record.status == 'completed' else None,
+        })
+
+    # Colunas exibidas na tabela; o texto extraído e as listas JSON ficam de fora da listagem
+    LISTING_COLUMNS = (
+        File.id, File.filename, File.original_filename, File.upload_date, File.status,
+        File.nome, File.matricula, File.user_id, File.group_id
+    )
+
+    def _listing_options(self):
+        return (load_only(*self.LISTING_COLUMNS),)
+
+    def _equipment_counts(self, files):
+        """Quantidade de equipamentos por arquivo da página, em uma única consulta agregada."""
+        if not files:
+            return {}
+        rows = db.session.execute(
+            select(FileEquipment.file_id, func.count())
+            .where(FileEquipment.file_id.in_([f.id for f in files]))
+            .group_by(FileEquipment.file_id)
+        ).all()
+        return dict(rows)
+
+    def _keyset_page(self, files_query, per_page, after=None, before=None):
+        """
+        Paginação por cursor em (upload_date, id): o custo é o mesmo na primeira
+        e na milésima página. Retorna (arquivos, args da próxima página, args da anterior).
+        """
+        key = tuple_(File.upload_date, File.id)
+        files_query = files_query.options(*self._listing_options())
+        cursor = self._decode_cursor(before or after)
+
+        if before and cursor:
+            rows = files_query.filter(key > cursor).order_by(None) \
+                .order_by(File.upload_date.asc(), File.id.asc()).limit(per_page + 1).all()
+            has_prev = len(rows) > per_page
+            files = list(reversed(rows[:per_page]))
+            has_next = True
+        else:
+            if cursor:
+                files_query = files_query.filter(key < cursor)
+            rows = files_query.order_by(File.id.desc()).limit(per_page + 1).all()
+            files = rows[:per_page]
+            has_next = len(rows) > per_page
+            has_prev = cursor is not None
+
+        next_args = {'after': self._encode_cursor(files[-1])} if files and has_next else None
+        prev_args = {'before': self._encode_cursor(files[0])} if files and has_prev else None
+        return files, next_args, prev_args
+
+    def _encode_cursor(self, file):
+        raw = f"{file.upload_date.isoformat()}|{file.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def _decode_cursor(self, token):
+        if not token:
+            return None
+        try:
+            upload_date, file_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+            return datetime.fromisoformat(upload_date), int(file_id)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def _cached_count(self, files_query, query, filter_field, exact=False):
+        """Contagem em cache por usuário; `exact=True` recalcula e atualiza o cache."""
+        scope = 'admin' if current_user.is_admin else current_user.id
+        cache_key = (scope, query, filter_field)
+        if exact:
+            total = files_query.order_by(None).count()
+            data_count_cache.set(cache_key, total)
+            return total
+        return data_count_cache.get_or_compute(cache_key, lambda: files_query.order_by(None).count())
 
     def _build_data_query(self, query, filter_field):
         # Base query: completed/failed AND NOT deleted
@@ -157,29 +315,38 @@ class FileHandler:
         )
         
         if not current_user.is_admin:
-            # User can see their own files OR files from groups they belong to
-            user_group_ids = [g.id for g in current_user.groups.all()]
-            user_created_group_ids = [g.id for g in Group.query.filter_by(creator_id=current_user.id).all()]
-            all_group_ids = list(set(user_group_ids + user_created_group_ids))
-            
-            files_query = files_query.filter(
-                or_(
-                    File.user_id == current_user.id,
-                    File.group_id.in_(all_group_ids)
-                )
-            )
+            # User can see their own files OR files from groups they belong to / created
+            files_query = files_query.filter(file_access_filter(current_user.id))
 
         files_query = files_query.order_by(File.upload_date.desc())
-        
+
         if not query:
             return files_query
 
+        dialect_name = db.session.get_bind().dialect.name
+        if filter_field == 'processed_data':
+            # Busca full-text ranqueada (FTS5 no SQLite, tsvector/GIN no PostgreSQL).
+            # O texto é guardado comprimido, então não há fallback com LIKE.
+            matches = search_index.search_subquery(dialect_name, query) if search_index.is_supported(dialect_name) else None
+            if matches is None:
+                return files_query.filter(db.false())
+            return files_query.join(matches, matches.c.file_id == File.id) \
+                .order_by(None).order_by(matches.c.rank.desc(), File.upload_date.desc())
+
+        # Ativos: busca exata/por prefixo nas tabelas normalizadas (sonda de índice)
+        if filter_field == 'imei_numbers':
+            matching_ids = select(FileImei.file_id).where(prefix_match(FileImei.imei, normalize_asset_code(query)))
+            return files_query.filter(File.id.in_(matching_ids))
+        if filter_field == 'patrimonio_numbers':
+            matching_ids = select(FilePatrimonio.file_id).where(prefix_match(FilePatrimonio.patrimonio, normalize_asset_code(query)))
+            return files_query.filter(File.id.in_(matching_ids))
+
         search_pattern = f"%{query}%"
+        if filter_field == 'equipamentos':
+            matching_ids = select(FileEquipment.file_id).where(FileEquipment.nome_equipamento.ilike(search_pattern))
+            return files_query.filter(File.id.in_(matching_ids))
+
         filter_map = {
-            'equipamentos': File.equipamentos,
-            'imei_numbers': File.imei_numbers,
-            'patrimonio_numbers': File.patrimonio_numbers,
-            'processed_data': File.processed_data,
             'matricula': File.matricula,
             'funcao': File.funcao,
             'empregador': File.empregador,
@@ -198,13 +365,7 @@ class FileHandler:
             return redirect(url_for('files.view_data'))
         
         # Check permissions: owner, admin, or group member
-        is_member = False
-        if file_record.group_id:
-            group = Group.query.get(file_record.group_id)
-            if group and current_user in group.members:
-                is_member = True
-
-        if file_record.user_id != current_user.id and not current_user.is_admin and not is_member:
+        if not can_access_file(current_user, file_record):
             flash('You are not authorized to download this file.', 'danger')
             return redirect(url_for('files.view_data'))
 
@@ -216,9 +377,13 @@ class FileHandler:
             try:
                 s3_client = self._get_r2_client()
                 bucket_name = current_app.config['CLOUDFLARE_R2_BUCKET_NAME']
+                params = {'Bucket': bucket_name, 'Key': file_record.storage_key}
+                if file_record.object_key:
+                    # A chave é o checksum; o download mantém o nome original
+                    params['ResponseContentDisposition'] = f'attachment; filename="{file_record.original_filename}"'
                 presigned_url = s3_client.generate_presigned_url(
                     'get_object',
-                    Params={'Bucket': bucket_name, 'Key': file_record.filename},
+                    Params=params,
                     ExpiresIn=60  # URL válida por 60 segundos
                 )
                 logger.info(f"Generated presigned URL for download: {presigned_url}")
@@ -255,6 +420,7 @@ class FileHandler:
             file_to_delete.is_deleted = True
             file_to_delete.deleted_at = datetime.now(timezone.utc)
             db.session.commit()
+            data_count_cache.invalidate()
             flash(f'File "{file_to_delete.original_filename}" deleted successfully.', 'success')
         except Exception as e:
             db.session.rollback()
@@ -264,10 +430,4 @@ class FileHandler:
         return redirect(url_for('files.view_data'))
 
     def _get_r2_client(self):
-        return boto3.client(
-            service_name='s3',
-            endpoint_url=current_app.config['CLOUDFLARE_R2_ENDPOINT_URL'],
-            aws_access_key_id=current_app.config['CLOUDFLARE_R2_ACCESS_KEY_ID'],
-            aws_secret_access_key=current_app.config['CLOUDFLARE_R2_SECRET_ACCESS_KEY'],
-            region_name='auto'
-        )
+        return get_r2_client(current_app.config)
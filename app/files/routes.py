@@ -1,6 +1,7 @@
 from flask import Blueprint
 from flask_login import login_required
 from .handlers import FileHandler
+from .chunked import ChunkedUploadHandler
 
 # Cria o Blueprint de arquivos
 files_bp = Blueprint('files', __name__)
@@ -14,5 +15,13 @@ files_bp.route('/home')(login_required(file_handler.home))
 files_bp.route('/health')(login_required(file_handler.health))
 files_bp.route('/upload', methods=['GET', 'POST'])(login_required(file_handler.upload_file))
 files_bp.route('/data', methods=['GET', 'POST'])(login_required(file_handler.view_data))
+files_bp.route('/data/<int:file_id>/details')(login_required(file_handler.file_details))
 files_bp.route('/download/<filename>')(login_required(file_handler.download_file))
-files_bp.route('/delete/<int:file_id>', methods=['POST'])(login_required(file_handler.delete_file))
\ No newline at end of file
+files_bp.route('/delete/<int:file_id>', methods=['POST'])(login_required(file_handler.delete_file))
+
+# Upload retomável em partes (API JSON usada pela página de upload para arquivos grandes)
+chunked_handler = ChunkedUploadHandler()
+files_bp.route('/uploads', methods=['POST'])(login_required(chunked_handler.create_upload))
+files_bp.route('/uploads/<upload_id>', methods=['GET'])(login_required(chunked_handler.upload_status))
+files_bp.route('/uploads/<upload_id>', methods=['PATCH'])(login_required(chunked_handler.upload_chunk))
+files_bp.route('/uploads/<upload_id>', methods=['DELETE'])(login_required(chunked_handler.cancel_upload))
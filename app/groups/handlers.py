@@ -1,24 +1,28 @@
 from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import current_user, login_required
-from app.models import db, Group, User, File
+from app.models import db, Group, User, File, group_members
+from app.access import accessible_groups, can_access_group, is_member, invalidate_access_scope
+from app.files.handlers import data_count_cache
+from app.storage import enqueue_purge
 from .forms import GroupForm, AddMemberForm
 import logging
 import os
-import boto3
 from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
 class GroupHandler:
+    def _membership_changed(self, user_id):
+        # O escopo de grupos e os totais da listagem desse usuário mudaram
+        invalidate_access_scope(user_id)
+        data_count_cache.invalidate(lambda key: key[0] == user_id)
+
     @login_required
     def list_groups(self):
         # Groups the user created or is a member of
-        user_groups = current_user.groups.all()
-        created_groups = Group.query.filter_by(creator_id=current_user.id).all()
-        
-        # Merge and remove duplicates
-        all_groups = list(set(user_groups + created_groups))
-        
+        group_ids = [group_id for group_id, _ in accessible_groups(current_user.id)]
+        all_groups = Group.query.filter(Group.id.in_(group_ids)).order_by(Group.name).all() if group_ids else []
+
         return render_template('groups/list.html', title='My Groups', groups=all_groups)
 
     @login_required
@@ -34,6 +38,7 @@ class GroupHandler:
             group.members.append(current_user)
             db.session.add(group)
             db.session.commit()
+            invalidate_access_scope(current_user.id)
             flash(f'Group "{group.name}" created successfully!', 'success')
             return redirect(url_for('groups.list_groups'))
         return render_template('groups/create.html', title='Create Group', form=form)
@@ -43,18 +48,19 @@ class GroupHandler:
         group = Group.query.get_or_404(group_id)
         
         # Security check: User must be a member
-        if current_user not in group.members and not current_user.is_admin:
+        if not can_access_group(current_user, group):
             flash('You do not have permission to view this group.', 'danger')
             return redirect(url_for('groups.list_groups'))
             
         add_form = AddMemberForm()
         if add_form.validate_on_submit():
             user_to_add = User.query.filter_by(email=add_form.email.data).first()
-            if user_to_add in group.members:
+            if is_member(user_to_add.id, group.id):
                 flash('User is already a member of this group.', 'info')
             else:
-                group.members.append(user_to_add)
+                db.session.execute(group_members.insert().values(user_id=user_to_add.id, group_id=group.id))
                 db.session.commit()
+                self._membership_changed(user_to_add.id)
                 flash(f'User {user_to_add.username} added to group.', 'success')
             return redirect(url_for('groups.group_details', group_id=group.id))
             
@@ -80,9 +86,13 @@ class GroupHandler:
         user_to_remove = User.query.get_or_404(user_id)
         if user_to_remove == group.creator:
             flash('The creator cannot be removed from the group.', 'danger')
-        elif user_to_remove in group.members:
-            group.members.remove(user_to_remove)
+        elif is_member(user_to_remove.id, group.id):
+            db.session.execute(group_members.delete().where(
+                group_members.c.user_id == user_to_remove.id,
+                group_members.c.group_id == group.id
+            ))
             db.session.commit()
+            self._membership_changed(user_to_remove.id)
             flash(f'User {user_to_remove.username} removed from group.', 'success')
         
         return redirect(url_for('groups.group_details', group_id=group.id))
@@ -111,20 +121,11 @@ class GroupHandler:
                 return redirect(url_for('groups.group_details', group_id=group.id))
 
             # If user IS the creator/admin, perform a PERMANENT delete
-            # Delete from R2 if applicable
-            if current_app.config['R2_FEATURE_FLAG'] == 'True' and file_to_delete.status == 'completed':
-                try:
-                    s3_client = boto3.client(
-                        service_name='s3',
-                        endpoint_url=current_app.config['CLOUDFLARE_R2_ENDPOINT_URL'],
-                        aws_access_key_id=current_app.config['CLOUDFLARE_R2_ACCESS_KEY_ID'],
-                        aws_secret_access_key=current_app.config['CLOUDFLARE_R2_SECRET_ACCESS_KEY'],
-                        region_name='auto'
-                    )
-                    s3_client.delete_object(Bucket=current_app.config['CLOUDFLARE_R2_BUCKET_NAME'], Key=file_to_delete.filename)
-                    logger.info(f"Deleted file {file_to_delete.filename} from R2.")
-                except Exception as e:
-                    logger.error(f"Failed to delete file from R2: {e}")
+            # Remoção do R2 fica na fila do purger, na mesma transação (objetos endereçados
+            # por conteúdo entram na fila pela contagem de referências)
+            if current_app.config['R2_FEATURE_FLAG'] == 'True' and file_to_delete.status == 'completed' \
+                    and not file_to_delete.object_key:
+                enqueue_purge(db.session, [file_to_delete.filename])
 
             # Delete local file if it exists
             if os.path.exists(file_to_delete.filepath):
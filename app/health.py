@@ -1,9 +1,9 @@
 import os
 import pika
-import boto3
 from sqlalchemy import text
 from app.models import db
 from app.config import Config
+from app.storage import get_r2_client
 import logging
 
 logger = logging.getLogger(__name__)
@@ -42,16 +42,7 @@ def check_storage():
         return False, "Configurações de R2 incompletas no .env"
 
     try:
-        from botocore.config import Config as BotoConfig
-        s3 = boto3.client(
-            's3',
-            endpoint_url=Config.CLOUDFLARE_R2_ENDPOINT_URL,
-            aws_access_key_id=Config.CLOUDFLARE_R2_ACCESS_KEY_ID,
-            aws_secret_access_key=Config.CLOUDFLARE_R2_SECRET_ACCESS_KEY,
-            region_name='auto',
-            config=BotoConfig(signature_version='s3v4')
-        )
-        s3.head_bucket(Bucket=Config.CLOUDFLARE_R2_BUCKET_NAME)
+        get_r2_client().head_bucket(Bucket=Config.CLOUDFLARE_R2_BUCKET_NAME)
         return True, "Operacional"
     except Exception as e:
         error_msg = str(e)
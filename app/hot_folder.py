@@ -0,0 +1,273 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+
+from werkzeug.utils import secure_filename
+
+from app.config import Config
+from app.duplicates import save_hashed
+from app.ingest import ingest_files, is_allowed_content, discard, MAGIC_HEAD_BYTES
+from app.bulk_import import is_archive, import_archive
+
+try:
+    import inotify_simple # Opcional (Linux): eventos em vez de varredura periódica
+except ImportError:
+    inotify_simple = None
+
+logger = logging.getLogger(__name__)
+
+# Subpasta (em cada pasta monitorada) para onde vão os arquivos recusados
+REJECTED_FOLDER = '.rejected'
+# Nomes de arquivos ainda sendo gravados por scanners/copiadores comuns
+TEMPORARY_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '~')
+
+
+def parse_hot_folders(value):
+    """
+    HOT_FOLDERS: pastas separadas por os.pathsep, cada uma com um grupo opcional
+    ("/mnt/scanner/rh=3"). Retorna [(pasta, group_id ou None)].
+    """
+    folders = []
+    for entry in (value or '').split(os.pathsep):
+        entry = entry.strip()
+        if not entry:
+            continue
+        path, _, group_id = entry.partition('=')
+        folders.append((os.path.abspath(path), int(group_id) if group_id else None))
+    return folders
+
+
+class HotFolderWatcher:
+    """
+    Ingestão contínua das pastas em que os scanners gravam. Um arquivo só é consumido quando
+    está completo: fechado após escrita (evento do inotify) ou com tamanho e mtime estáveis
+    por HOT_FOLDER_SETTLE_SECONDS entre duas varreduras (compartilhamentos de rede não geram
+    eventos do inotify para gravações remotas). Os prontos são copiados para UPLOAD_FOLDER com
+    o SHA-256 calculado na cópia e registrados/publicados em lotes de HOT_FOLDER_BATCH_SIZE;
+    o original só é removido depois que o lote foi gravado.
+    """
+
+    def __init__(self, folders, user_id, upload_folder=None, settle_seconds=None, batch_size=None,
+                 policy=None, clock=time.monotonic):
+        self.folders = folders
+        self.user_id = user_id
+        self.upload_folder = upload_folder or Config.UPLOAD_FOLDER
+        self.settle_seconds = Config.HOT_FOLDER_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.batch_size = batch_size or Config.HOT_FOLDER_BATCH_SIZE
+        self.policy = policy
+        self._clock = clock
+        # caminho -> (tamanho, mtime, instante em que essa assinatura foi vista pela primeira vez)
+        self._observed = {}
+
+    def _candidates(self):
+        """Arquivos visíveis nas pastas monitoradas (e subpastas), com o grupo de cada pasta."""
+        for root, group_id in self.folders:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for name in filenames:
+                    if name.startswith('.') or name.lower().endswith(TEMPORARY_SUFFIXES):
+                        continue
+                    yield os.path.join(dirpath, name), root, group_id
+
+    def scan(self, closed=()):
+        """
+        Varre as pastas e retorna [(caminho, pasta raiz, group_id)] dos arquivos prontos.
+        `closed`: caminhos que o inotify informou como fechados após escrita (prontos na hora).
+        """
+        now = self._clock()
+        ready, seen = [], set()
+        for path, root, group_id in self._candidates():
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            previous = self._observed.get(path)
+            if previous is None or previous[:2] != signature:
+                self._observed[path] = signature + (now,)
+                if path not in closed:
+                    continue
+            elif path not in closed and now - previous[2] < self.settle_seconds:
+                continue
+            if stat.st_size > 0:
+                ready.append((path, root, group_id))
+        for path in set(self._observed) - seen:
+            del self._observed[path]
+        return ready
+
+    def pending(self):
+        """True se há arquivos mudando de tamanho (a próxima varredura deve vir logo)."""
+        now = self._clock()
+        return any(now - seen_at < self.settle_seconds for _, _, seen_at in self._observed.values())
+
+    def _reject(self, path, root, reason):
+        logger.warning(f"Hot folder: rejecting {path}: {reason}")
+        rejected = os.path.join(root, REJECTED_FOLDER)
+        os.makedirs(rejected, exist_ok=True)
+        target = os.path.join(rejected, os.path.basename(path))
+        if os.path.exists(target):
+            target = os.path.join(rejected, f"{uuid.uuid4().hex[:8]}-{os.path.basename(path)}")
+        shutil.move(path, target)
+        self._observed.pop(path, None)
+
+    def _copy(self, path, root):
+        """Valida e copia um documento para UPLOAD_FOLDER. Retorna a entrada para ingest_files, ou None."""
+        original_filename = secure_filename(os.path.basename(path))
+        extension = os.path.splitext(original_filename)[1].lower()
+        if extension.lstrip('.') not in Config.ALLOWED_EXTENSIONS:
+            self._reject(path, root, 'file type not allowed')
+            return None
+        with open(path, 'rb') as source:
+            head = source.read(MAGIC_HEAD_BYTES)
+            if not is_allowed_content(head):
+                source.close()
+                self._reject(path, root, 'content does not match allowed types')
+                return None
+            unique_filename = str(uuid.uuid4()) + extension
+            target = os.path.join(self.upload_folder, unique_filename)
+            try:
+                checksum, size = save_hashed(source, target, head=head, max_bytes=Config.MAX_PDF_SIZE)
+            except ValueError:
+                discard(target)
+                source.close()
+                self._reject(path, root, 'file too large')
+                return None
+            except OSError:
+                discard(target)
+                raise
+        return original_filename, unique_filename, target, checksum, size, False
+
+    def _consume(self, paths):
+        for path in paths:
+            discard(path)
+            self._observed.pop(path, None)
+
+    def ingest(self, session, ready):
+        """Registra e publica os arquivos prontos em lotes. Retorna (enfileirados, duplicatas vinculadas)."""
+        queued = linked = 0
+        errors = []
+        by_group = {}
+        for path, root, group_id in ready:
+            by_group.setdefault(group_id, []).append((path, root))
+
+        for group_id, entries in by_group.items():
+            batch, sources = [], []
+            for position, (path, root) in enumerate(entries, 1):
+                try:
+                    if is_archive(path):
+                        with open(path, 'rb') as archive:
+                            counts = import_archive(session, archive, os.path.basename(path), self.user_id, group_id,
+                                                    errors, self.policy, self.upload_folder, raise_errors=True)
+                        queued, linked = queued + counts[0], linked + counts[1]
+                        self._consume([path])
+                        entry = None
+                    else:
+                        entry = self._copy(path, root)
+                except OSError as e:
+                    # Sumiu, sem permissão ou ainda travado pelo scanner: tenta na próxima varredura
+                    logger.warning(f"Hot folder: could not read {path}: {e}")
+                    entry = None
+                if entry:
+                    batch.append(entry)
+                    sources.append(path)
+                if batch and (len(batch) >= self.batch_size or position == len(entries)):
+                    new_files, linked_files = ingest_files(session, batch, self.user_id, group_id, errors,
+                                                           self.policy, raise_errors=True)
+                    queued += len(new_files)
+                    linked += len(linked_files)
+                    self._consume(sources)
+                    batch, sources = [], []
+
+        for message, _ in errors:
+            logger.warning(f"Hot folder: {message}")
+        if queued or linked:
+            logger.info(f"Hot folder: {queued} file(s) queued, {linked} duplicate(s) linked.")
+        return queued, linked
+
+    def _open_inotify(self):
+        if inotify_simple is None or Config.HOT_FOLDER_INOTIFY != 'True':
+            return None
+        try:
+            inotify = inotify_simple.INotify()
+        except OSError as e:
+            logger.warning(f"Hot folder: inotify unavailable ({e}); polling only.")
+            return None
+        self._watches = {}
+        self._watch_tree(inotify)
+        return inotify
+
+    def _watch_tree(self, inotify):
+        flags = inotify_simple.flags
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        for root, _ in self.folders:
+            for dirpath, dirnames, _ in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                if dirpath not in self._watches.values():
+                    try:
+                        self._watches[inotify.add_watch(dirpath, mask)] = dirpath
+                    except OSError as e:
+                        logger.warning(f"Hot folder: cannot watch {dirpath}: {e}")
+
+    def _wait(self, inotify, timeout, stop_event):
+        """Espera por eventos (ou pelo timeout). Retorna os caminhos fechados após escrita."""
+        if inotify is None:
+            stop_event.wait(timeout)
+            return set()
+        closed, new_dirs = set(), False
+        for event in inotify.read(timeout=int(timeout * 1000)):
+            directory = self._watches.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            if event.mask & inotify_simple.flags.ISDIR:
+                new_dirs = True
+            elif event.mask & (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO):
+                closed.add(os.path.join(directory, event.name))
+        if new_dirs:
+            self._watch_tree(inotify)
+        return closed
+
+    def run(self, app, stop_event):
+        from app.models import db
+        inotify = self._open_inotify()
+        mode = 'inotify + polling' if inotify else 'polling'
+        logger.info(f"Hot folder watcher started ({mode}) on {[folder for folder, _ in self.folders]}.")
+        closed = set()
+        try:
+            while not stop_event.is_set():
+                ready = self.scan(closed)
+                if ready:
+                    with app.app_context():
+                        try:
+                            self.ingest(db.session, ready)
+                        except Exception as e:
+                            db.session.rollback()
+                            logger.error(f"Hot folder ingestion failed, will retry: {e}", exc_info=True)
+                        finally:
+                            db.session.remove()
+                timeout = self.settle_seconds if self.pending() else Config.FOLDER_MONITOR_INTERVAL_SECONDS
+                closed = self._wait(inotify, max(timeout, 1), stop_event)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+
+def start_hot_folder_watcher(app, stop_event):
+    """Thread do monitor de pastas, se HOT_FOLDERS estiver configurado. Retorna a thread ou None."""
+    folders = parse_hot_folders(app.config.get('HOT_FOLDERS'))
+    if not folders:
+        return None
+    user_id = app.config.get('HOT_FOLDER_USER_ID')
+    if not user_id:
+        logger.error("HOT_FOLDERS is set but HOT_FOLDER_USER_ID is not; hot folder ingestion disabled.")
+        return None
+    for folder, _ in folders:
+        os.makedirs(folder, exist_ok=True)
+    watcher = HotFolderWatcher(folders, int(user_id), upload_folder=app.config['UPLOAD_FOLDER'],
+                               policy=app.config['DUPLICATE_UPLOAD_POLICY'])
+    thread = threading.Thread(target=watcher.run, args=(app, stop_event), daemon=True)
+    thread.start()
+    return thread
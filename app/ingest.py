@@ -0,0 +1,135 @@
+import os
+import logging
+import magic
+
+from app.models import File
+from app.config import Config
+from app.metrics import record_metric
+from app.mq import MessageQueue
+from app.storage import enqueue_purge
+from app.duplicates import find_originals
+from app.events import publish_file_status
+
+logger = logging.getLogger(__name__)
+
+
+# Tipos aceitos pelo conteúdo real (magic numbers), independente da extensão
+ALLOWED_MIMES = {
+    'application/pdf': 'pdf',
+    'image/png': 'png',
+    'image/jpeg': 'jpg'
+}
+# Bytes lidos do início do arquivo para identificar o tipo
+MAGIC_HEAD_BYTES = 2048
+
+
+def is_allowed_content(head):
+    """True se os primeiros bytes do arquivo são de um PDF ou imagem aceitos."""
+    return magic.from_buffer(head, mime=True) in ALLOWED_MIMES
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def task_message(file_record, stored=False):
+    message = {'file_id': file_record.id, 'filepath': file_record.filepath}
+    if file_record.checksum:
+        # O worker usa o checksum calculado no upload em vez de reler o arquivo
+        message['checksum'] = file_record.checksum
+    if stored:
+        # Objeto já enviado ao R2 na requisição; o worker não reenvia
+        message['stored'] = True
+    return message
+
+
+def _register(session, uploads, user_id, group_id, errors, policy):
+    """
+    Monta as linhas de File dos arquivos já gravados. Checksums já conhecidos (no banco ou
+    repetidos no próprio lote) não vão para a fila: conforme `policy` são rejeitados
+    ('reject') ou registrados como 'duplicate' apontando para o original ('link').
+    """
+    originals = find_originals(session, [upload[3] for upload in uploads], user_id)
+    new_files, linked, first_in_batch = [], [], {}
+    for original_filename, unique_filename, path, checksum, size, stored in uploads:
+        file_record = File(
+            filename=unique_filename,
+            original_filename=original_filename,
+            filepath=path,
+            user_id=user_id,
+            group_id=group_id or None,
+            status='pending',
+            checksum=checksum,
+            size=size
+        )
+        original_id = originals.get(checksum)
+        original = first_in_batch.get(checksum)
+        if original_id is None and original is None:
+            if checksum:
+                first_in_batch[checksum] = file_record
+            new_files.append(file_record)
+            continue
+
+        # Duplicata conhecida: a cópia local (e o objeto enviado na requisição) não são mais necessários
+        discard(path)
+        if stored:
+            enqueue_purge(session, [unique_filename])
+        if policy == 'reject':
+            errors.append((f'Skipped file "{original_filename}": it duplicates a file already uploaded.', 'warning'))
+            continue
+        file_record.status = 'duplicate'
+        file_record.processed_data = 'Duplicate file detected.'
+        if original_id is not None:
+            file_record.duplicate_of_id = original_id
+        else:
+            file_record.duplicate_of = original
+        linked.append(file_record)
+    return new_files, linked
+
+
+def ingest_files(session, uploads, user_id, group_id=None, errors=None, policy=None, raise_errors=False):
+    """
+    Registra arquivos já gravados em UPLOAD_FOLDER e publica os novos na fila.
+    `uploads`: [(nome original, nome único, caminho, sha256, tamanho, já enviado ao R2)].
+    As linhas entram em um único commit e as tarefas em um lote confirmado; erros por
+    arquivo vão para `errors` como (mensagem, categoria). Retorna (novos, duplicatas vinculadas).
+    Com `raise_errors`, uma falha ao gravar o lote é propagada (quem chama mantém os originais e tenta de novo).
+    """
+    errors = [] if errors is None else errors
+    policy = policy or Config.DUPLICATE_UPLOAD_POLICY
+    new_files, linked = _register(session, uploads, user_id, group_id, errors, policy)
+    if not new_files and not linked:
+        return [], []
+
+    try:
+        session.add_all(new_files + linked)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error inserting {len(new_files) + len(linked)} uploaded files: {e}", exc_info=True)
+        for original_filename, _, path, _, _, _ in uploads:
+            discard(path)
+            errors.append((f'File "{original_filename}" could not be registered. Please try again.', 'danger'))
+        if raise_errors:
+            raise
+        return [], []
+
+    for file_record in new_files + linked:
+        publish_file_status(file_record)
+    if new_files:
+        for new_file in new_files:
+            record_metric('file_upload', 1, {'user_id': user_id, 'file_id': new_file.id})
+        streamed = {unique_filename for _, unique_filename, _, _, _, stored in uploads if stored}
+        local_mq = MessageQueue()
+        try:
+            local_mq.publish_tasks([task_message(f, f.filename in streamed) for f in new_files])
+        except Exception as e:
+            # Os arquivos continuam 'pending' e são reenfileirados pelo worker manager
+            logger.error(f"Error queueing {len(new_files)} uploaded files: {e}", exc_info=True)
+        finally:
+            local_mq.close()
+        logger.info(f"{len(new_files)} file(s) from user {user_id} added to queue.")
+    return new_files, linked
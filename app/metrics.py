@@ -0,0 +1,150 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+
+from flask import Blueprint, Response, request, abort, current_app
+from flask_login import current_user
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+from sqlalchemy import insert
+
+from app.models import Metric
+
+logger = logging.getLogger(__name__)
+
+# Com PROMETHEUS_MULTIPROC_DIR definido (antes de iniciar o processo), cada worker
+# grava seus valores em arquivos mmap e o /metrics agrega todos os processos.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+METRIC_EVENTS = Counter('app_metric_events_total', 'Number of recorded application metric events.', ['name'])
+METRIC_VALUES = Histogram(
+    'app_metric_value', 'Values of recorded application metrics.', ['name'],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+FILE_PROCESSING_SECONDS = Histogram(
+    'app_file_processing_seconds', 'Wall time spent processing a file in a worker.', ['status'],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+
+
+class MetricsBuffer:
+    """
+    Acumula métricas em memória, agregadas por (nome, tags), e grava tudo de uma
+    vez na tabela Metric em `flush`. Registrar uma métrica não toca o banco.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        # Processos filhos (fork) herdam o buffer do pai; descarta para não gravar em dobro.
+        if self._pid != os.getpid():
+            self._rows = {}
+            self._pid = os.getpid()
+
+    def record(self, name, value, tags=None):
+        tags_json = json.dumps(tags, sort_keys=True) if tags else None
+        with self._lock:
+            self._check_pid()
+            key = (name, tags_json)
+            self._rows[key] = self._rows.get(key, 0) + value
+
+    def drain(self):
+        with self._lock:
+            self._check_pid()
+            rows, self._rows = self._rows, {}
+        return rows
+
+    def restore(self, rows):
+        with self._lock:
+            for key, value in rows.items():
+                self._rows[key] = self._rows.get(key, 0) + value
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self, session):
+        """Grava as métricas acumuladas em um único INSERT. Retorna o número de linhas gravadas."""
+        rows = self.drain()
+        if not rows:
+            return 0
+        timestamp = datetime.now(timezone.utc)
+        try:
+            session.execute(insert(Metric), [
+                {'timestamp': timestamp, 'name': name, 'value': value, 'tags': tags}
+                for (name, tags), value in rows.items()
+            ])
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            self.restore(rows)
+            logger.error(f"Failed to flush {len(rows)} metric rows: {e}")
+            return 0
+        return len(rows)
+
+
+metrics_buffer = MetricsBuffer()
+
+
+def record_metric(name, value, tags=None, session=None):
+    """
+    Registra uma métrica (contador + histograma do Prometheus e buffer para a tabela Metric).
+    `session` é aceito por compatibilidade; a gravação acontece no próximo flush.
+    """
+    METRIC_EVENTS.labels(name=name).inc()
+    METRIC_VALUES.labels(name=name).observe(value)
+    metrics_buffer.record(name, value, tags)
+
+
+def flush_metrics(session):
+    return metrics_buffer.flush(session)
+
+
+def start_metrics_flusher(app, stop_event):
+    """Thread que grava o buffer de métricas a cada METRICS_FLUSH_SECONDS até `stop_event`."""
+    from app.models import db
+
+    def flusher():
+        interval = app.config['METRICS_FLUSH_SECONDS']
+        while not stop_event.wait(interval):
+            with app.app_context():
+                flush_metrics(db.session)
+                db.session.remove()
+        with app.app_context():
+            flush_metrics(db.session)
+            db.session.remove()
+
+    thread = threading.Thread(target=flusher, daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_process_dead(pid):
+    """Remove os arquivos de métricas de um worker que terminou (modo multiprocesso)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    # Contadores por usuário e estado interno dos workers: só com o token do scrape ou para admins.
+    # Sem METRICS_TOKEN configurado, o acesso anônimo é negado
+    token = current_app.config.get('METRICS_TOKEN')
+    scraper = bool(token) and request.headers.get('Authorization') == f'Bearer {token}'
+    if not scraper and not (current_user.is_authenticated and current_user.is_admin):
+        abort(401)
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
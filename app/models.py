@@ -1,23 +1,21 @@
 from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, and_
+from sqlalchemy.orm import Session
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin # Import UserMixin
 import json
+import zlib
 from flask import current_app
 from itsdangerous import URLSafeTimedSerializer as Serializer
+from app.config import Config
 
-db = SQLAlchemy()
+try:
+    import zstandard # Opcional: melhor razão de compressão para o texto extraído
+except ImportError:
+    zstandard = None
 
-def record_metric(name, value, tags=None, session=None):
-    """Record a metric in the database."""
-    tags_json = json.dumps(tags) if tags else None
-    metric = Metric(name=name, value=value, tags=tags_json)
-    if session:
-        session.add(metric)
-        session.commit()
-    else:
-        db.session.add(metric)
-        db.session.commit()
+db = SQLAlchemy()
 
 class User(db.Model, UserMixin): # Inherit UserMixin
     id = db.Column(db.Integer, primary_key=True)
@@ -75,7 +73,11 @@ class File(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='pending') # pending, processing, completed, failed
     checksum = db.Column(db.String(256), nullable=True) # Add checksum column
-    processed_data = db.Column(db.Text) # Store OCR or other processed data (raw text)
+    # Chave do objeto no R2 derivada do SHA-256 (ver app/storage.py); None = objeto legado em `filename`
+    object_key = db.Column(db.String(256), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True) # Bytes recebidos no upload
+    # Upload com o mesmo checksum de um arquivo anterior (não reprocessado)
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='SET NULL'), nullable=True)
     is_deleted = db.Column(db.Boolean, default=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
     nome = db.Column(db.String(255), nullable=True)
@@ -95,9 +97,265 @@ class File(db.Model):
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
     group = db.relationship('Group', backref=db.backref('files', lazy=True))
 
+    duplicate_of = db.relationship('File', remote_side=[id], foreign_keys=[duplicate_of_id])
+
+    # Tabelas normalizadas derivadas das colunas JSON acima (ver _sync_asset_tables)
+    equipment_items = db.relationship('FileEquipment', backref='file', lazy=True, cascade='all, delete-orphan', order_by='FileEquipment.id')
+    imei_items = db.relationship('FileImei', backref='file', lazy=True, cascade='all, delete-orphan', order_by='FileImei.id')
+    patrimonio_items = db.relationship('FilePatrimonio', backref='file', lazy=True, cascade='all, delete-orphan', order_by='FilePatrimonio.id')
+
+    # Texto extraído (OCR), comprimido em uma tabela à parte; acessado via `processed_data`
+    content = db.relationship('FileContent', backref='file', uselist=False, lazy=True, cascade='all, delete-orphan')
+    # Assinaturas para detecção de quase-duplicatas (re-digitalizações)
+    signature = db.relationship('FileSignature', uselist=False, lazy=True, cascade='all, delete-orphan')
+
+    # Índices para os caminhos de acesso mais usados (ver migrations/versions).
+    # Os índices de listagem são parciais: só cobrem arquivos não deletados.
+    __table_args__ = (
+        db.Index('ix_file_checksum', 'checksum'),
+        db.Index('ix_file_object_key', 'object_key'),
+        db.Index('ix_file_size', 'size'),
+        db.Index('ix_file_filename', 'filename'),
+        db.Index('ix_file_user_status', 'user_id', 'status'),
+        db.Index('ix_file_user_listing', 'user_id', 'upload_date',
+                 sqlite_where=db.text('is_deleted = 0'), postgresql_where=db.text('is_deleted = false')),
+        db.Index('ix_file_group_listing', 'group_id', 'upload_date',
+                 sqlite_where=db.text('is_deleted = 0'), postgresql_where=db.text('is_deleted = false')),
+        db.Index('ix_file_status_listing', 'status', 'upload_date',
+                 sqlite_where=db.text('is_deleted = 0'), postgresql_where=db.text('is_deleted = false')),
+        # Candidatos à arquivação (app/archive.py): só os soft-deleted
+        db.Index('ix_file_archive_candidates', 'deleted_at',
+                 sqlite_where=db.text('is_deleted = 1'), postgresql_where=db.text('is_deleted = true')),
+    )
+
+    @property
+    def processed_data(self):
+        """Texto extraído do documento (descomprimido sob demanda a partir de FileContent)."""
+        return self.content.text if self.content is not None else None
+
+    @processed_data.setter
+    def processed_data(self, value):
+        if value is None:
+            self.content = None
+        elif self.content is None:
+            self.content = FileContent(text=value)
+        else:
+            self.content.text = value
+
+    @property
+    def storage_key(self):
+        """Chave do objeto no R2: endereçada por conteúdo, ou o nome único para arquivos antigos."""
+        return self.object_key or self.filename
+
     def __repr__(self):
         return f'<File {self.filename}>'
 
+def compress_text(value, codec=None):
+    """Comprime texto com zstd (se disponível e configurado) ou zlib. Retorna (codec, bytes)."""
+    codec = codec or Config.CONTENT_CODEC
+    raw = value.encode('utf-8')
+    if codec == 'zstd' and zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=3).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+def decompress_text(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Content was stored with zstd but the 'zstandard' package is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    return zlib.decompress(data).decode('utf-8')
+
+class FileContent(db.Model):
+    """Texto bruto extraído de um arquivo, comprimido e fora da tabela `file` (lida pelas listagens)."""
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), primary_key=True)
+    codec = db.Column(db.String(10), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False) # Tamanho original (bytes UTF-8)
+
+    @property
+    def text(self):
+        # Descomprime uma vez por versão de `data` (um refresh do banco invalida o cache)
+        data = self.data
+        cached = self.__dict__.get('_text_cache')
+        if cached is None or cached[0] is not data:
+            cached = (data, decompress_text(self.codec, data))
+            self.__dict__['_text_cache'] = cached
+        return cached[1]
+
+    @text.setter
+    def text(self, value):
+        self.codec, self.data = compress_text(value)
+        self.size = len(value.encode('utf-8'))
+        self.__dict__['_text_cache'] = (self.data, value)
+
+    def __repr__(self):
+        return f'<FileContent {self.file_id} ({self.codec}, {self.size} bytes)>'
+
+def normalize_asset_code(value):
+    """Normaliza IMEIs e números de patrimônio para busca exata e por prefixo."""
+    return str(value).strip().lower()
+
+def prefix_match(column, prefix):
+    """Filtro por prefixo como intervalo, para que o índice B-tree seja usado em qualquer banco."""
+    return and_(column >= prefix, column < prefix + '\uffff')
+
+class FileEquipment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), nullable=False, index=True)
+    nome_equipamento = db.Column(db.String(255), nullable=True)
+    imei = db.Column(db.String(64), nullable=True)
+    patrimonio = db.Column(db.String(64), nullable=True)
+
+    def __repr__(self):
+        return f'<FileEquipment {self.nome_equipamento}>'
+
+class FileImei(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), nullable=False, index=True)
+    imei = db.Column(db.String(64), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_file_imei_lookup', 'imei', 'file_id'),
+    )
+
+    def __repr__(self):
+        return f'<FileImei {self.imei}>'
+
+class FilePatrimonio(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), nullable=False, index=True)
+    patrimonio = db.Column(db.String(64), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_file_patrimonio_lookup', 'patrimonio', 'file_id'),
+    )
+
+    def __repr__(self):
+        return f'<FilePatrimonio {self.patrimonio}>'
+
+class FileSignature(db.Model):
+    """
+    Assinaturas de similaridade de um arquivo processado (app/near_duplicates.py): dHash da
+    primeira página rasterizada e MinHash do texto normalizado. As faixas (bands) indexadas
+    ficam em FileSignatureBand para a busca por candidatos (LSH).
+    """
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), primary_key=True)
+    page_hash = db.Column(db.String(64), nullable=True) # dHash em hex
+    page_count = db.Column(db.Integer, nullable=True)
+    text_minhash = db.Column(db.Text, nullable=True) # Valores do MinHash em hex, concatenados
+
+    bands = db.relationship('FileSignatureBand', backref='signature', lazy=True, cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<FileSignature {self.file_id}>'
+
+class FileSignatureBand(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file_signature.file_id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(8), nullable=False) # 'page' ou 'text'
+    band = db.Column(db.SmallInteger, nullable=False)
+    value = db.Column(db.String(16), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_file_signature_band_lookup', 'kind', 'band', 'value'),
+    )
+
+    def __repr__(self):
+        return f'<FileSignatureBand {self.kind}:{self.band}:{self.value}>'
+
+def load_json_list(value):
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+@event.listens_for(Session, 'before_flush')
+def _sync_asset_tables(session, flush_context, instances):
+    """
+    Mantém as tabelas de equipamentos/IMEI/patrimônio em sincronia com as colunas JSON
+    de File, dentro da mesma transação que grava os dados estruturados.
+    """
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty):
+            if not isinstance(obj, File):
+                continue
+            attrs = inspect(obj).attrs
+            if attrs.equipamentos.history.has_changes():
+                obj.equipment_items = [
+                    FileEquipment(
+                        nome_equipamento=item.get('nome_equipamento'),
+                        imei=normalize_asset_code(item['imei']) if item.get('imei') else None,
+                        patrimonio=normalize_asset_code(item['patrimonio']) if item.get('patrimonio') else None
+                    )
+                    for item in load_json_list(obj.equipamentos) if isinstance(item, dict)
+                ]
+            if attrs.imei_numbers.history.has_changes():
+                obj.imei_items = [FileImei(imei=normalize_asset_code(v)) for v in load_json_list(obj.imei_numbers) if v]
+            if attrs.patrimonio_numbers.history.has_changes():
+                obj.patrimonio_items = [FilePatrimonio(patrimonio=normalize_asset_code(v)) for v in load_json_list(obj.patrimonio_numbers) if v]
+
+class FileStatusCounter(db.Model):
+    """Contadores de arquivos por status, por usuário ou grupo (mantidos em app/counters.py)."""
+    scope_type = db.Column(db.String(10), primary_key=True) # 'user' ou 'group'
+    scope_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<FileStatusCounter {self.scope_type}:{self.scope_id} {self.status}={self.count}>'
+
+class StoredObject(db.Model):
+    """
+    Objeto endereçado por conteúdo no R2 e quantos arquivos o referenciam, incluindo
+    arquivados cujo objeto ainda não foi liberado (mantido pelos eventos do ORM em app/storage.py).
+    """
+    __tablename__ = 'stored_object'
+    key = db.Column(db.String(256), primary_key=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StoredObject {self.key} refs={self.ref_count}>'
+
+class StoragePurge(db.Model):
+    """Fila de objetos a remover do R2, drenada em lotes por app/storage.purge_storage_queue."""
+    __tablename__ = 'storage_purge'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(256), nullable=False)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<StoragePurge {self.key}>'
+
+class UploadSession(db.Model):
+    """
+    Upload retomável em partes (ver app/files/chunked.py): os bytes recebidos ficam em
+    CHUNKED_UPLOAD_FOLDER e `offset` marca até onde o arquivo já foi confirmado.
+    """
+    __tablename__ = 'upload_session'
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex, também usado no nome do arquivo final
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
+    original_filename = db.Column(db.String(256), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False) # Tamanho total declarado pelo cliente
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    checksum = db.Column(db.String(64), nullable=True) # SHA-256 do arquivo inteiro, se informado
+    file_id = db.Column(db.Integer, nullable=True) # Preenchido quando o arquivo é montado e registrado
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_upload_session_updated_at', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.offset}/{self.size}>'
+
 class Metric(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.now(timezone.utc))
@@ -105,9 +363,62 @@ class Metric(db.Model):
     value = db.Column(db.Float, nullable=False)
     tags = db.Column(db.Text, nullable=True)  # JSON string for additional metadata
 
+    __table_args__ = (
+        db.Index('ix_metric_timestamp', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Metric {self.name} at {self.timestamp}>'
 
+class ArchivedFile(db.Model):
+    """
+    Arquivo soft-deleted movido para fora da tabela `file` após o período de carência
+    (ver app/archive.py). Guarda os mesmos dados e o texto ainda comprimido.
+    """
+    __tablename__ = 'file_archive'
+    id = db.Column(db.Integer, primary_key=True) # Mesmo id que o registro tinha em `file`
+    filename = db.Column(db.String(256), nullable=False)
+    original_filename = db.Column(db.String(256), nullable=False)
+    filepath = db.Column(db.String(512), nullable=False)
+    upload_date = db.Column(db.DateTime)
+    status = db.Column(db.String(50))
+    checksum = db.Column(db.String(256), nullable=True)
+    object_key = db.Column(db.String(256), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    nome = db.Column(db.String(255), nullable=True)
+    matricula = db.Column(db.String(255), nullable=True)
+    funcao = db.Column(db.String(255), nullable=True)
+    empregador = db.Column(db.String(255), nullable=True)
+    rg = db.Column(db.String(255), nullable=True)
+    cpf = db.Column(db.String(255), nullable=True)
+    equipamentos = db.Column(db.Text, nullable=True)
+    data_documento = db.Column(db.String(50), nullable=True)
+    imei_numbers = db.Column(db.Text, nullable=True)
+    patrimonio_numbers = db.Column(db.Text, nullable=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    group_id = db.Column(db.Integer, nullable=True)
+    content_codec = db.Column(db.String(10), nullable=True)
+    content_data = db.Column(db.LargeBinary, nullable=True)
+    content_size = db.Column(db.Integer, nullable=True)
+    storage_purged = db.Column(db.Boolean, nullable=False, default=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ArchivedFile {self.filename}>'
+
+class ArchivedMetric(db.Model):
+    __tablename__ = 'metric_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime)
+    name = db.Column(db.String(255), nullable=False)
+    value = db.Column(db.Float, nullable=False)
+    tags = db.Column(db.Text, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ArchivedMetric {self.name} at {self.timestamp}>'
+
 # Association table for User and Group
 group_members = db.Table('group_members',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
@@ -119,7 +430,7 @@ class Group(db.Model):
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
     # Relationship to members
     members = db.relationship('User', secondary=group_members, backref=db.backref('groups', lazy='dynamic'))
@@ -2,6 +2,7 @@ import pika
 import json
 import logging
 import multiprocessing
+import threading
 from app.config import Config
 
 logger = logging.getLogger(__name__)
@@ -17,6 +18,7 @@ class MessageQueue:
         self.task_queue_name = 'file_processing_queue'
         self.results_queue_name = 'file_processing_results'
         self.use_local_fallback = False
+        self._confirmed_channel = None
 
     def connect(self):
         try:
@@ -24,6 +26,8 @@ class MessageQueue:
             # Timeout curto para detecção rápida de falha
             parameters.connection_attempts = 1
             parameters.retry_delay = 1
+            parameters.heartbeat = Config.AMQP_HEARTBEAT_SECONDS
+            parameters.blocked_connection_timeout = Config.AMQP_HEARTBEAT_SECONDS
             self.connection = pika.BlockingConnection(parameters)
             self.channel = self.connection.channel()
             self.channel.queue_declare(queue=self.task_queue_name, durable=True)
@@ -59,6 +63,41 @@ class MessageQueue:
             self.use_local_fallback = True
             local_task_queue.put(json.dumps(message))
 
+    def publish_tasks(self, messages):
+        """
+        Publica um lote de tarefas com publisher confirms: cada mensagem só é considerada
+        entregue após o ack do broker. Se o broker falhar no meio do lote, o restante
+        vai para a fila local.
+        """
+        if not messages:
+            return
+        if not self.connection or self.connection.is_closed:
+            self.connect()
+
+        pending = list(messages)
+        if not self.use_local_fallback:
+            try:
+                if self._confirmed_channel is not self.channel:
+                    self.channel.confirm_delivery()
+                    self._confirmed_channel = self.channel
+                while pending:
+                    self.channel.basic_publish(
+                        exchange='',
+                        routing_key=self.task_queue_name,
+                        body=json.dumps(pending[0]),
+                        properties=pika.BasicProperties(delivery_mode=2)
+                    )
+                    pending.pop(0)
+                logger.info(f"Published {len(messages)} tasks to CloudAMQP (confirmed).")
+            except Exception as e:
+                logger.warning(f"Failed to publish batch to CloudAMQP after {len(messages) - len(pending)} tasks, falling back to local: {e}")
+                self.use_local_fallback = True
+
+        for message in pending:
+            local_task_queue.put(json.dumps(message))
+        if pending:
+            logger.info(f"Published {len(pending)} tasks to LOCAL queue.")
+
     def publish_result(self, message):
         if not self.connection or self.connection.is_closed:
             # Não tentamos reconectar aqui para evitar delay no worker, 
@@ -149,6 +188,58 @@ class MessageQueue:
             import time
             time.sleep(1)
 
+    def run_with_heartbeat(self, func, *args, **kwargs):
+        """
+        Executa `func` em uma thread separada enquanto a thread atual continua
+        atendendo a conexão AMQP, mantendo os heartbeats vivos durante OCRs longos.
+        Retorna o resultado de `func` ou relança a exceção gerada por ela.
+        """
+        if self.use_local_fallback or not self.connection or not self.connection.is_open:
+            return func(*args, **kwargs)
+
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = func(*args, **kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+
+        worker_thread = threading.Thread(target=target, daemon=True)
+        worker_thread.start()
+        while worker_thread.is_alive():
+            try:
+                if self.connection.is_open:
+                    self.connection.process_data_events(time_limit=1)
+                else:
+                    worker_thread.join(timeout=1)
+            except Exception as e:
+                # A conexão caiu durante a tarefa; apenas aguardamos o fim do processamento
+                logger.warning(f"Lost AMQP connection while task was running: {e}")
+                worker_thread.join()
+        worker_thread.join()
+
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    def ack(self, delivery_tag):
+        """Confirma uma mensagem; retorna False se o canal já estiver fechado."""
+        try:
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not ack delivery {delivery_tag}, broker will redeliver it: {e}")
+            return False
+
+    def nack(self, delivery_tag, requeue=False):
+        try:
+            self.channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not nack delivery {delivery_tag}: {e}")
+            return False
+
     def close(self):
         if self.connection and self.connection.is_open:
             self.connection.close()
@@ -0,0 +1,193 @@
+import re
+import zlib
+import random
+import hashlib
+import logging
+import unicodedata
+
+from PIL import Image
+from pypdf import PdfReader
+from pdf2image import convert_from_path
+from sqlalchemy import select, func, and_, or_
+
+from app.models import File, FileSignature, FileSignatureBand
+from app.access import file_access_filter
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# dHash da primeira página: grade de 16x16 gradientes = 256 bits (64 dígitos hex)
+HASH_SIZE = 16
+# O hash é indexado em 32 faixas de 8 bits: dois hashes a até 31 bits de distância
+# compartilham ao menos uma faixa, então NEAR_DUPLICATE_PAGE_DISTANCE deve ficar abaixo disso
+PAGE_BANDS = 32
+# MinHash do texto: 128 permutações em 16 faixas de 8 (LSH), sobre 5-gramas de caracteres
+# (mais tolerantes a erros de OCR que n-gramas de palavras)
+MINHASH_PERMUTATIONS = 128
+TEXT_BANDS = 16
+SHINGLE_CHARS = 5
+# Textos mais curtos que isso não têm n-gramas suficientes para uma estimativa confiável
+MIN_TEXT_CHARS = 200
+# Candidatos verificados por busca (os que compartilham mais faixas primeiro)
+MAX_CANDIDATES = 50
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# Permutações fixas: assinaturas gravadas continuam comparáveis entre processos e versões
+_rng = random.Random(20261018)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(MINHASH_PERMUTATIONS)]
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Hash perceptual por diferença: compara cada pixel com o vizinho da direita na imagem reduzida."""
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = gray.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f'{bits:0{hash_size * hash_size // 4}x}'
+
+
+def page_signature(pdf_path):
+    """(dHash da primeira página, número de páginas), ou (None, None) se o PDF não puder ser rasterizado."""
+    try:
+        with open(pdf_path, 'rb') as f:
+            page_count = len(PdfReader(f).pages)
+        images = convert_from_path(pdf_path, dpi=Config.NEAR_DUPLICATE_DPI, first_page=1, last_page=1,
+                                   grayscale=True, poppler_path=Config.POPPLER_PATH)
+    except Exception as e:
+        logger.warning(f"Could not rasterize first page of {pdf_path} for near-duplicate check: {e}")
+        return None, None
+    if not images:
+        return None, None
+    return dhash(images[0]), page_count
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def page_bands(page_hash):
+    width = len(page_hash) // PAGE_BANDS
+    return [page_hash[i * width:(i + 1) * width] for i in range(PAGE_BANDS)]
+
+
+def normalize_for_shingles(text):
+    """Sem acentos, minúsculo, só letras e dígitos separados por um espaço."""
+    ascii_text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', ascii_text))
+
+
+def text_minhash(text):
+    """MinHash do texto normalizado (128 valores de 16 dígitos hex concatenados), ou None se o texto for curto."""
+    normalized = normalize_for_shingles(text or '')
+    if len(normalized) < MIN_TEXT_CHARS:
+        return None
+    shingles = {zlib.crc32(normalized[i:i + SHINGLE_CHARS].encode('ascii'))
+                for i in range(len(normalized) - SHINGLE_CHARS + 1)}
+    return ''.join(f'{min((a * h + b) % _MERSENNE_PRIME for h in shingles):016x}' for a, b in _PERMUTATIONS)
+
+
+def _minhash_values(signature):
+    return [signature[i:i + 16] for i in range(0, len(signature), 16)]
+
+
+def minhash_similarity(a, b):
+    """Fração de permutações com o mesmo mínimo: estimativa da similaridade de Jaccard."""
+    values_a, values_b = _minhash_values(a), _minhash_values(b)
+    return sum(x == y for x, y in zip(values_a, values_b)) / len(values_a)
+
+
+def text_bands(signature):
+    values = _minhash_values(signature)
+    rows = len(values) // TEXT_BANDS
+    return [hashlib.blake2b(''.join(values[i * rows:(i + 1) * rows]).encode('ascii'), digest_size=8).hexdigest()
+            for i in range(TEXT_BANDS)]
+
+
+def attach_signature(file_record, signature):
+    """
+    Grava (ou substitui) as assinaturas de `file_record` e suas faixas de LSH.
+    `signature`: {'page_hash', 'page_count', 'text_minhash'}, como calculado pelo worker.
+    """
+    if not signature or not (signature.get('page_hash') or signature.get('text_minhash')):
+        return
+    record = file_record.signature or FileSignature()
+    record.page_hash = signature.get('page_hash')
+    record.page_count = signature.get('page_count')
+    record.text_minhash = signature.get('text_minhash')
+    bands = []
+    if record.page_hash:
+        bands += [FileSignatureBand(kind='page', band=i, value=v) for i, v in enumerate(page_bands(record.page_hash))]
+    if record.text_minhash:
+        bands += [FileSignatureBand(kind='text', band=i, value=v) for i, v in enumerate(text_bands(record.text_minhash))]
+    record.bands = bands
+    file_record.signature = record
+
+
+def _candidates(session, kind, bands, user_id, exclude_id, *columns):
+    """
+    Arquivos concluídos visíveis para `user_id` (próprios ou de grupos acessíveis) que compartilham
+    ao menos uma faixa (índice ix_file_signature_band_lookup), ordenados pelo número de faixas em comum.
+    """
+    matches_band = or_(*[and_(FileSignatureBand.band == i, FileSignatureBand.value == v) for i, v in enumerate(bands)])
+    hits = select(FileSignatureBand.file_id, func.count().label('hits')).where(FileSignatureBand.kind == kind, matches_band)
+    if exclude_id is not None:
+        hits = hits.where(FileSignatureBand.file_id != exclude_id)
+    hits = hits.group_by(FileSignatureBand.file_id).subquery()
+    return session.execute(
+        select(FileSignature, *columns)
+        .join(hits, hits.c.file_id == FileSignature.file_id)
+        .join(File, File.id == FileSignature.file_id)
+        .where(File.status == 'completed', File.deleted_at.is_(None), file_access_filter(user_id))
+        .order_by(hits.c.hits.desc(), FileSignature.file_id)
+        .limit(MAX_CANDIDATES)
+    ).all()
+
+
+def find_page_match(session, page_hash, page_count, user_id, exclude_id=None):
+    """
+    (file_id, distância) do arquivo de `user_id` com o mesmo número de páginas e a primeira
+    página mais parecida, ou None. Formulários do mesmo modelo têm a primeira página parecida:
+    acima de NEAR_DUPLICATE_PAGE_CONFIRM_DISTANCE a coincidência só indica o candidato, e quem
+    decide é a comparação do texto (find_text_match).
+    """
+    best = None
+    for candidate, in _candidates(session, 'page', page_bands(page_hash), user_id, exclude_id):
+        if candidate.page_count != page_count:
+            continue
+        distance = hamming(page_hash, candidate.page_hash)
+        if distance <= Config.NEAR_DUPLICATE_PAGE_DISTANCE and (best is None or distance < best[1]):
+            best = (candidate.file_id, distance)
+    return best
+
+
+def _identifier(value):
+    return re.sub(r'[^0-9a-z]', '', str(value or '').lower())
+
+
+def _same_identifiers(structured_data, cpf, matricula):
+    """
+    Termos diferentes do mesmo modelo têm quase todo o texto em comum: CPF e matrícula,
+    quando extraídos dos dois documentos, precisam coincidir.
+    """
+    for field, existing in (('cpf', cpf), ('matricula', matricula)):
+        new, old = _identifier((structured_data or {}).get(field)), _identifier(existing)
+        if new and old and new != old:
+            return False
+    return True
+
+
+def find_text_match(session, minhash, user_id, structured_data=None, exclude_id=None):
+    """(file_id, similaridade) do arquivo de `user_id` com texto mais parecido, ou None."""
+    best = None
+    for candidate, cpf, matricula in _candidates(session, 'text', text_bands(minhash), user_id, exclude_id,
+                                                 File.cpf, File.matricula):
+        similarity = minhash_similarity(minhash, candidate.text_minhash)
+        if similarity < Config.NEAR_DUPLICATE_TEXT_SIMILARITY or not _same_identifiers(structured_data, cpf, matricula):
+            continue
+        if best is None or similarity > best[1]:
+            best = (candidate.file_id, similarity)
+    return best
@@ -0,0 +1,117 @@
+import re
+import logging
+import unicodedata
+from sqlalchemy import DDL, event, inspect, text, Integer, Float
+
+from app.models import File, FileContent
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'file_search'
+
+# SQLite: tabela virtual FTS5 (rowid = file.id), com remoção de acentos no tokenizer.
+# PostgreSQL: tsvector em português com índice GIN, em uma tabela separada de `file`.
+_CREATE_DDL = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        f"file_id INTEGER PRIMARY KEY REFERENCES file (id) ON DELETE CASCADE, "
+        f"document TSVECTOR NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin (document)",
+    ],
+}
+
+
+def fold_text(value):
+    """Remove acentos e converte para minúsculas (mesma normalização da extração)."""
+    normalized = unicodedata.normalize('NFD', value or '')
+    return normalized.encode('ascii', 'ignore').decode('utf-8').lower()
+
+
+class SearchIndex:
+    """
+    Índice full-text sobre o texto extraído (FileContent, exposto como File.processed_data).
+    É mantido incrementalmente pelos eventos do ORM sempre que o texto muda.
+    """
+
+    def is_supported(self, dialect_name):
+        return dialect_name in _CREATE_DDL
+
+    def update(self, connection, file_id, content):
+        dialect = connection.dialect.name
+        if not self.is_supported(dialect):
+            return
+        folded = fold_text(content)
+        if dialect == 'sqlite':
+            connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :file_id"), {'file_id': file_id})
+            if folded.strip():
+                connection.execute(
+                    text(f"INSERT INTO {SEARCH_TABLE} (rowid, body) VALUES (:file_id, :body)"),
+                    {'file_id': file_id, 'body': folded}
+                )
+        else:
+            connection.execute(
+                text(f"INSERT INTO {SEARCH_TABLE} (file_id, document) "
+                     f"VALUES (:file_id, to_tsvector('portuguese', :body)) "
+                     f"ON CONFLICT (file_id) DO UPDATE SET document = EXCLUDED.document"),
+                {'file_id': file_id, 'body': folded}
+            )
+
+    def remove(self, connection, file_id):
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :file_id"), {'file_id': file_id})
+        elif dialect == 'postgresql':
+            connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE file_id = :file_id"), {'file_id': file_id})
+
+    def search_subquery(self, dialect_name, query):
+        """
+        Retorna um subquery (file_id, rank) com os documentos que casam com `query`.
+        Cada termo é buscado por prefixo e todos os termos precisam estar presentes.
+        Retorna None se a busca não tiver termos válidos.
+        """
+        terms = re.findall(r'\w+', fold_text(query))
+        if not terms:
+            return None
+
+        if dialect_name == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            stmt = text(
+                f"SELECT rowid AS file_id, -bm25({SEARCH_TABLE}) AS rank "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match"
+            )
+        else:
+            match = ' & '.join(f'{term}:*' for term in terms)
+            stmt = text(
+                f"SELECT file_id, ts_rank(document, to_tsquery('portuguese', :match)) AS rank "
+                f"FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('portuguese', :match)"
+            )
+        return stmt.bindparams(match=match).columns(file_id=Integer, rank=Float).subquery('search_results')
+
+
+search_index = SearchIndex()
+
+
+for _dialect, _statements in _CREATE_DDL.items():
+    for _statement in _statements:
+        event.listen(File.__table__, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+event.listen(File.__table__, 'before_drop', DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}").execute_if(dialect=('sqlite', 'postgresql')))
+
+
+@event.listens_for(FileContent, 'after_insert')
+@event.listens_for(FileContent, 'after_update')
+def _index_processed_data(mapper, connection, target):
+    if inspect(target).attrs.data.history.has_changes():
+        search_index.update(connection, target.file_id, target.text)
+
+
+@event.listens_for(FileContent, 'after_delete')
+def _remove_content_from_index(mapper, connection, target):
+    search_index.remove(connection, target.file_id)
+
+
+@event.listens_for(File, 'after_delete')
+def _remove_from_index(mapper, connection, target):
+    search_index.remove(connection, target.id)
@@ -0,0 +1,341 @@
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from collections import Counter
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+from sqlalchemy import event, inspect, select, insert, delete, update
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import sqlite, postgresql
+
+from app.config import Config
+from app.models import File, ArchivedFile, StoredObject, StoragePurge
+
+logger = logging.getLogger(__name__)
+
+# Um cliente S3/R2 por processo (e por conjunto de credenciais). Clientes do boto3 são
+# thread-safe e mantêm um pool de conexões HTTPS; criar um por operação custa CPU e um
+# novo handshake TLS. Processos filhos (fork) descartam os clientes herdados do pai.
+_lock = threading.Lock()
+_clients = {}
+_pid = os.getpid()
+
+
+def _setting(config, name):
+    if isinstance(config, dict):
+        return config.get(name)
+    return getattr(config, name, None)
+
+
+def _client_config():
+    return BotoConfig(
+        signature_version='s3v4',
+        max_pool_connections=Config.R2_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=Config.R2_CONNECT_TIMEOUT,
+        read_timeout=Config.R2_READ_TIMEOUT,
+        retries={'max_attempts': Config.R2_MAX_ATTEMPTS, 'mode': 'standard'},
+    )
+
+
+def get_r2_client(config=None):
+    """
+    Retorna o cliente R2 compartilhado do processo. `config` pode ser o `app.config`
+    do Flask ou a classe Config (padrão, usada pelos workers).
+    """
+    global _pid
+    config = Config if config is None else config
+    key = (
+        _setting(config, 'CLOUDFLARE_R2_ENDPOINT_URL'),
+        _setting(config, 'CLOUDFLARE_R2_ACCESS_KEY_ID'),
+        _setting(config, 'CLOUDFLARE_R2_SECRET_ACCESS_KEY'),
+    )
+    with _lock:
+        if _pid != os.getpid():
+            _clients.clear()
+            _pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            endpoint_url, access_key_id, secret_access_key = key
+            client = boto3.client(
+                service_name='s3',
+                endpoint_url=endpoint_url,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+                region_name='auto',
+                config=_client_config()
+            )
+            _clients[key] = client
+            logger.debug(f"Created shared R2 client for process {_pid}.")
+        return client
+
+
+def reset_r2_clients():
+    """Descarta os clientes em cache (troca de credenciais, testes)."""
+    with _lock:
+        _clients.clear()
+
+
+def get_transfer_config():
+    """
+    Uploads multipart: partes de R2_MULTIPART_CHUNKSIZE_MB enviadas em paralelo por até
+    R2_MAX_CONCURRENCY threads (limitadas pelo pool de conexões do cliente).
+    """
+    mb = 1024 * 1024
+    return TransferConfig(
+        multipart_threshold=Config.R2_MULTIPART_THRESHOLD_MB * mb,
+        multipart_chunksize=Config.R2_MULTIPART_CHUNKSIZE_MB * mb,
+        max_concurrency=min(Config.R2_MAX_CONCURRENCY, Config.R2_MAX_POOL_CONNECTIONS),
+        use_threads=True,
+    )
+
+
+def public_url(object_name, config=None):
+    config = Config if config is None else config
+    return f"{_setting(config, 'CLOUDFLARE_R2_ENDPOINT_URL')}/{object_name}"
+
+
+class HashingReader:
+    """
+    Envolve um stream de leitura: cada bloco lido é somado ao SHA-256 e copiado para
+    `spool` (arquivo local usado depois pelo worker).
+    """
+
+    def __init__(self, stream, spool=None):
+        self._stream = stream
+        self._spool = spool
+        self._hasher = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        if chunk:
+            self._hasher.update(chunk)
+            self.size += len(chunk)
+            if self._spool is not None:
+                self._spool.write(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+def stream_upload(stream, object_name, spool_path, config=None):
+    """
+    Envia `stream` direto para o R2 (multipart, em paralelo) enquanto grava a cópia local
+    em `spool_path` e calcula o SHA-256. Retorna (checksum, tamanho).
+    """
+    config = Config if config is None else config
+    with open(spool_path, 'wb') as spool:
+        reader = HashingReader(stream, spool)
+        get_r2_client(config).upload_fileobj(
+            reader, _setting(config, 'CLOUDFLARE_R2_BUCKET_NAME'), object_name, Config=get_transfer_config()
+        )
+    logger.info(f"Streamed {reader.size} bytes to R2 as {object_name}.")
+    return reader.hexdigest(), reader.size
+
+
+def file_sha256(path):
+    """SHA-256 de um arquivo local, ou None se não puder ser lido."""
+    hasher = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                hasher.update(chunk)
+    except OSError as e:
+        logger.error(f"Error calculating checksum for {path}: {e}")
+        return None
+    return hasher.hexdigest()
+
+
+def content_key(checksum, filename):
+    """Chave endereçada por conteúdo: bytes iguais viram o mesmo objeto no R2."""
+    extension = os.path.splitext(filename)[1].lower()
+    return f"sha256/{checksum[:2]}/{checksum}{extension}"
+
+
+def object_exists(client, key, bucket=None):
+    bucket = bucket or Config.CLOUDFLARE_R2_BUCKET_NAME
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+# Contagem de referências: StoredObject.ref_count acompanha quantos registros apontam
+# para cada object_key (arquivos em `file` e arquivados cujo objeto não foi liberado).
+# Quando chega a zero, a linha é removida e a chave entra na fila de remoção no mesmo flush.
+
+for _attr in (File.object_key, ArchivedFile.storage_purged):
+    event.listen(_attr, 'set', lambda target, value, oldvalue, initiator: value, active_history=True, retval=True)
+
+
+def _references(obj, state='current'):
+    """Chave referenciada por `obj` antes ('old') ou depois ('current') do flush, ou None."""
+    def value(attr_name):
+        if state == 'old':
+            history = getattr(inspect(obj).attrs, attr_name).history
+            if history.deleted:
+                return history.deleted[0]
+        return getattr(obj, attr_name)
+
+    if isinstance(obj, File):
+        return value('object_key')
+    if isinstance(obj, ArchivedFile) and not value('storage_purged'):
+        return obj.object_key
+    return None
+
+
+def _reference_deltas(session):
+    deltas = Counter()
+    for obj in session.new:
+        key = _references(obj)
+        if key:
+            deltas[key] += 1
+    for obj in session.dirty:
+        if not isinstance(obj, (File, ArchivedFile)) or not session.is_modified(obj):
+            continue
+        old_key, new_key = _references(obj, 'old'), _references(obj)
+        if old_key != new_key:
+            if old_key:
+                deltas[old_key] -= 1
+            if new_key:
+                deltas[new_key] += 1
+    for obj in session.deleted:
+        key = _references(obj, 'old')
+        if key:
+            deltas[key] -= 1
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def _apply_reference_delta(connection, key, delta):
+    table = StoredObject.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(table).values(key=key, ref_count=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'], set_={'ref_count': table.c.ref_count + stmt.excluded.ref_count}
+        )
+        connection.execute(stmt)
+        return
+    result = connection.execute(
+        update(table).where(table.c.key == key).values(ref_count=table.c.ref_count + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(key=key, ref_count=delta))
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_object_references(session, flush_context):
+    deltas = _reference_deltas(session)
+    if not deltas:
+        return
+    connection = session.connection()
+    for key, delta in sorted(deltas.items()):
+        _apply_reference_delta(connection, key, delta)
+
+    released = [key for key, delta in deltas.items() if delta < 0]
+    if released:
+        table = StoredObject.__table__
+        unreferenced = connection.execute(
+            select(table.c.key).where(table.c.key.in_(released), table.c.ref_count <= 0)
+        ).scalars().all()
+        if unreferenced:
+            connection.execute(delete(table).where(table.c.key.in_(unreferenced)))
+            enqueue_purge(connection, unreferenced)
+
+
+def enqueue_purge(session, keys):
+    """
+    Agenda a remoção de `keys` do R2 na transação corrente (`session` pode ser uma
+    Session ou uma Connection). O purger remove os objetos depois, em lotes.
+    """
+    keys = [key for key in keys if key]
+    if keys:
+        session.execute(insert(StoragePurge.__table__), [{'key': key, 'attempts': 0} for key in keys])
+
+
+def purge_storage_queue(session, batch_size=None, max_batches=None, grace_seconds=None):
+    """
+    Drena a fila `storage_purge` com delete_objects (até 1000 chaves por chamada).
+    Só entram pedidos com mais de STORAGE_PURGE_GRACE_SECONDS: um worker que encontrou o
+    objeto pela chave de conteúdo (e pulou o envio) só grava a referência ao concluir a tarefa.
+    Chaves que voltaram a ser referenciadas saem da fila sem remoção; falhas ficam na
+    fila com `attempts` incrementado até STORAGE_PURGE_MAX_ATTEMPTS.
+    Retorna o número de objetos removidos.
+    """
+    if Config.R2_FEATURE_FLAG != 'True':
+        return 0
+    grace_seconds = Config.STORAGE_PURGE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    batch_size = min(batch_size or Config.STORAGE_PURGE_BATCH_SIZE, 1000)
+    max_batches = max_batches or Config.ARCHIVE_MAX_BATCHES
+    table = StoragePurge.__table__
+    purged_total = 0
+    last_id = 0
+
+    for _ in range(max_batches):
+        # Avança por id: chaves que falharam nesta execução só voltam na próxima
+        rows = session.execute(
+            select(table.c.id, table.c.key)
+            .where(table.c.id > last_id, table.c.attempts < Config.STORAGE_PURGE_MAX_ATTEMPTS,
+                   table.c.requested_at <= cutoff)
+            .order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ids_by_key = {}
+        for row_id, key in rows:
+            ids_by_key.setdefault(key, []).append(row_id)
+
+        # Re-referenciadas entre o enfileiramento e agora (ex.: mesmo conteúdo enviado de novo)
+        referenced = set(session.execute(
+            select(StoredObject.key).where(StoredObject.key.in_(ids_by_key), StoredObject.ref_count > 0)
+        ).scalars())
+        referenced |= set(session.execute(
+            select(File.filename).where(File.filename.in_(ids_by_key), File.object_key.is_(None))
+        ).scalars())
+        keys = [key for key in ids_by_key if key not in referenced]
+
+        failed = {}
+        if keys:
+            try:
+                response = get_r2_client().delete_objects(
+                    Bucket=Config.CLOUDFLARE_R2_BUCKET_NAME,
+                    Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+                )
+                failed = {error['Key']: f"{error.get('Code')}: {error.get('Message')}"
+                          for error in response.get('Errors', []) if error.get('Key') in ids_by_key}
+            except Exception as e:
+                logger.error(f"Batch purge of {len(keys)} objects failed: {e}")
+                failed = {key: str(e) for key in keys}
+
+        done_ids = [row_id for key, row_ids in ids_by_key.items() if key not in failed for row_id in row_ids]
+        if done_ids:
+            session.execute(delete(table).where(table.c.id.in_(done_ids)))
+        for key, error in failed.items():
+            session.execute(
+                update(table).where(table.c.id.in_(ids_by_key[key]))
+                .values(attempts=table.c.attempts + 1, last_error=error[:1000])
+            )
+        session.commit()
+
+        purged = len(keys) - len(failed)
+        purged_total += purged
+        if purged:
+            logger.info(f"Purged {purged} objects from R2.")
+        if failed and len(failed) == len(keys):
+            break # R2 indisponível: tenta de novo na próxima execução
+        if len(rows) < batch_size:
+            break
+    return purged_total
@@ -1,6 +1,8 @@
 import hashlib
 import logging
 
+from app.duplicates import original_filter
+
 logger = logging.getLogger(__name__)
 
 class DuplicateChecker:
@@ -16,13 +18,18 @@ class DuplicateChecker:
             logger.error(f"Error calculating checksum for {filepath}: {e}", exc_info=True)
             return None
 
-    def process_file(self, file_id, filepath, db_session, File):
+    def process_file(self, file_id, filepath, db_session, File, checksum=None, write=True):
         """
         Processa um arquivo para verificar duplicatas e atualiza o checksum no banco de dados.
+        `checksum` já calculado no upload evita reler o arquivo. Com `write=False` (modo de
+        escritor único) nada é gravado: o checksum e o original ficam em `self.checksum` e
+        `self.duplicate_of_id` para seguirem na mensagem de resultado.
         Retorna True se um duplicado for encontrado, False caso contrário.
         """
+        self.checksum = None
+        self.duplicate_of_id = None
         try:
-            checksum = self._calculate_checksum(filepath)
+            checksum = checksum or self._calculate_checksum(filepath)
             if not checksum:
                 logger.warning(f"Could not calculate checksum for {filepath}. Skipping duplicate check.")
                 return False
@@ -32,12 +39,18 @@ class DuplicateChecker:
                 logger.warning(f"File record not found for ID: {file_id} during duplicate check.")
                 return False
 
-            file_record.checksum = checksum
-            if checksum:
-                existing_file = db_session.query(File).filter(
-                    File.checksum == checksum,
-                    File.id != file_id
-                ).first()
+            # Só um arquivo anterior, visível para o dono e não apagado, duplicado ou falho conta como original
+            existing_file = db_session.query(File).filter(
+                File.checksum == checksum,
+                File.id < file_id,
+                original_filter(file_record.user_id)
+            ).order_by(File.id).first()
+            self.checksum = checksum
+            self.duplicate_of_id = existing_file.id if existing_file else None
+            if write:
+                file_record.checksum = checksum
+                if existing_file:
+                    file_record.duplicate_of_id = existing_file.id
                 db_session.commit()
 
             if existing_file:
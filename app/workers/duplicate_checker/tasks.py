@@ -1,9 +1,13 @@
 from .handlers import DuplicateChecker
 
-def process_file_for_duplicates(file_id, filepath, db_session, File):
+def process_file_for_duplicates(file_id, filepath, db_session, File, checksum=None, write=True, outcome=None):
     """
     Ponto de entrada para a verificação de duplicatas.
     Instancia e usa a classe DuplicateChecker para processar o arquivo.
+    `outcome` (dict), se informado, recebe o checksum e o id do original encontrados.
     """
     checker = DuplicateChecker()
-    return checker.process_file(file_id, filepath, db_session, File)
\ No newline at end of file
+    is_duplicate = checker.process_file(file_id, filepath, db_session, File, checksum=checksum, write=write)
+    if outcome is not None:
+        outcome.update(checksum=checker.checksum, duplicate_of_id=checker.duplicate_of_id)
+    return is_duplicate
\ No newline at end of file
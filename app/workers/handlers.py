@@ -1,35 +1,68 @@
 import os
 import logging
 import json
-import boto3
 from botocore.exceptions import ClientError
 from sqlalchemy.orm import Session
 from multiprocessing import Queue
 
-from app.models import File, record_metric
+import time
+from app.models import File
+from app.metrics import record_metric, FILE_PROCESSING_SECONDS
+from app.database import single_writer_enabled
 from app.config import Config
+from app.storage import get_r2_client, get_transfer_config, public_url, file_sha256, content_key, object_exists
 from app.workers.pdf_processing.extraction import extract_text_from_pdf, extract_data_from_text
+from app.workers.pdf_processing.compression import compress_if_smaller
 from app.workers.duplicate_checker.tasks import process_file_for_duplicates
+from app.near_duplicates import page_signature, text_minhash, find_page_match, find_text_match, attach_signature
 from app.mq import mq
 
 logger = logging.getLogger(__name__)
 
+def apply_structured_data(file_record, structured_data):
+    """Copia os dados extraídos do documento para as colunas do File."""
+    file_record.nome = structured_data.get('nome')
+    file_record.matricula = structured_data.get('matricula')
+    file_record.funcao = structured_data.get('funcao')
+    file_record.empregador = structured_data.get('empregador')
+    file_record.rg = structured_data.get('rg')
+    file_record.cpf = structured_data.get('cpf')
+    file_record.equipamentos = json.dumps(structured_data.get('equipamentos')) if structured_data.get('equipamentos') else None
+    file_record.data_documento = structured_data.get('data')
+    file_record.imei_numbers = json.dumps(structured_data.get('imei_numbers')) if structured_data.get('imei_numbers') else None
+    file_record.patrimonio_numbers = json.dumps(structured_data.get('patrimonio_numbers')) if structured_data.get('patrimonio_numbers') else None
+
 class FileProcessingTask:
     """
     Encapsula a lógica de orquestração para processar um único arquivo.
     """
 
-    def __init__(self, file_id: int, file_path: str, session: Session):
+    def __init__(self, file_id: int, file_path: str, session: Session, stored: bool = False, checksum: str = None):
         self.file_id = file_id
+        # stored: o upload já foi enviado ao R2 pela requisição (STREAM_UPLOADS_TO_R2)
+        self.stored = stored
+        self.checksum = checksum
+        self.object_key = None
         self.original_filepath = file_path
         self.current_filepath = file_path
         self.session = session
         self.status = 'pending'
+        # Último status gravado/enviado e o anterior a ele: a mensagem final leva a transição
+        self.reported_status = None
+        self.previous_status = None
         self.processed_data = ""
         self.structured_data = {}
+        # Quase-duplicata: original encontrado pelas assinaturas; assinaturas gravadas se o arquivo for concluído
+        self.duplicate_of_id = None
+        self.signature = {}
+        # (file_id, distância) do arquivo com a primeira página parecida; só confirmado pelo texto
+        self.page_match = None
+        # Sem sessão (comando batch), o estado é devolvido a quem executou a tarefa
+        self.single_writer = session is not None and single_writer_enabled(session.get_bind().dialect.name)
 
     def run(self):
         """Executa o fluxo de processamento do arquivo."""
+        started = time.monotonic()
         try:
             logger.info(f"Worker {os.getpid()} starting task for file ID {self.file_id}")
             self._update_db_status('processing')
@@ -38,7 +71,20 @@ class FileProcessingTask:
                 self._handle_duplicate()
                 return
 
+            # Re-digitalização: pela primeira página quase idêntica antes do OCR; uma só parecida
+            # indica o candidato, que o texto extraído confirma logo depois
+            near_duplicate = self._find_near_duplicate_page()
+            if near_duplicate:
+                self._handle_duplicate(near_duplicate)
+                return
+
             self._extract_data()
+            near_duplicate = self._find_near_duplicate_text()
+            if near_duplicate:
+                self._handle_duplicate(near_duplicate)
+                return
+
+            self._compress()
             self._upload_to_r2()
 
             self.status = 'completed'
@@ -51,16 +97,88 @@ class FileProcessingTask:
             self._handle_error(f"An unexpected error occurred: {e}")
         finally:
             self._finalize_task()
+            FILE_PROCESSING_SECONDS.labels(status=self.status).observe(time.monotonic() - started)
 
     def _is_duplicate(self):
-        return process_file_for_duplicates(self.file_id, self.current_filepath, self.session, File)
+        if not self.single_writer:
+            return process_file_for_duplicates(self.file_id, self.current_filepath, self.session, File, checksum=self.checksum)
+        # Escritor único: só leitura aqui; checksum e original seguem na mensagem de resultado
+        outcome = {}
+        is_duplicate = process_file_for_duplicates(self.file_id, self.current_filepath, self.session, File,
+                                                   checksum=self.checksum, write=False, outcome=outcome)
+        self.checksum = outcome.get('checksum') or self.checksum
+        self.duplicate_of_id = outcome.get('duplicate_of_id')
+        return is_duplicate
 
-    def _handle_duplicate(self):
+    def _handle_duplicate(self, message="Duplicate file detected."):
         logger.info(f"File {self.file_id} is a duplicate. Halting processing.")
         self.status = 'duplicate'
-        self.processed_data = "Duplicate file detected."
+        self.processed_data = message
+        self.structured_data = {}
+        self._discard_stored_object()
         self._update_db_status('duplicate', processed_data=self.processed_data)
 
+    def _near_duplicates_enabled(self):
+        return (Config.NEAR_DUPLICATE_DETECTION == 'True'
+                and os.path.splitext(self.current_filepath)[1].lower() == '.pdf')
+
+    def _uploader_id(self):
+        """Dono do arquivo: as assinaturas só são comparadas com arquivos que ele pode ver."""
+        return self.session.query(File.user_id).filter(File.id == self.file_id).scalar()
+
+    def _find_near_duplicate_page(self):
+        """
+        Mensagem de quase-duplicata se a primeira página é quase idêntica à de um arquivo concluído,
+        senão None. Uma página só parecida fica em `page_match` para o texto confirmar.
+        """
+        if not self._near_duplicates_enabled():
+            return None
+        page_hash, page_count = page_signature(self.current_filepath)
+        self.signature.update(page_hash=page_hash, page_count=page_count)
+        if not page_hash or self.session is None:
+            return None
+        try:
+            self.page_match = find_page_match(self.session, page_hash, page_count, self._uploader_id(),
+                                              exclude_id=self.file_id)
+        except Exception as e:
+            self.session.rollback()
+            logger.warning(f"Near-duplicate page lookup failed for file ID {self.file_id}: {e}")
+            return None
+        if self.page_match is None:
+            return None
+        file_id, distance = self.page_match
+        if distance > Config.NEAR_DUPLICATE_PAGE_CONFIRM_DISTANCE:
+            logger.info(f"File {self.file_id} first page resembles file {file_id} "
+                        f"(page hash distance {distance}); waiting for the text to confirm.")
+            return None
+        self.duplicate_of_id = file_id
+        logger.info(f"File {self.file_id} is a re-scan of file {file_id} (page hash distance {distance}).")
+        return f"Near-duplicate of file #{file_id}: first page matches ({distance} of 256 hash bits differ)."
+
+    def _find_near_duplicate_text(self):
+        """Mensagem de quase-duplicata se o texto extraído é quase igual ao de um arquivo concluído, senão None."""
+        if not self._near_duplicates_enabled() or not (self.processed_data or '').strip():
+            return None
+        minhash = text_minhash(self.processed_data)
+        self.signature['text_minhash'] = minhash
+        if not minhash or self.session is None:
+            return None
+        try:
+            match = find_text_match(self.session, minhash, self._uploader_id(), self.structured_data,
+                                    exclude_id=self.file_id)
+        except Exception as e:
+            self.session.rollback()
+            logger.warning(f"Near-duplicate text lookup failed for file ID {self.file_id}: {e}")
+            return None
+        if match is None:
+            return None
+        self.duplicate_of_id, similarity = match
+        logger.info(f"File {self.file_id} is a re-scan of file {self.duplicate_of_id} (text similarity {similarity:.2f}).")
+        message = f"Near-duplicate of file #{self.duplicate_of_id}: extracted text is {similarity:.0%} similar"
+        if self.page_match and self.page_match[0] == self.duplicate_of_id:
+            message += f" and first page matches ({self.page_match[1]} of 256 hash bits differ)"
+        return message + "."
+
     def _extract_data(self):
         file_extension = os.path.splitext(self.current_filepath)[1].lower()
         if file_extension != '.pdf':
@@ -71,10 +189,34 @@ class FileProcessingTask:
         else:
             logger.warning(f"Extraction returned empty text for {self.file_id}. No structured data.")
 
+    def _compress(self):
+        # O objeto enviado na requisição (STREAM_UPLOADS_TO_R2) já está no R2 como veio
+        if self.stored:
+            return
+        if Config.R2_FEATURE_FLAG == 'True' and Config.R2_CONTENT_ADDRESSED == 'True':
+            # A chave do objeto vem dos bytes enviados pelo usuário, não da saída do Ghostscript
+            self._content_checksum()
+        try:
+            original_size, final_size = compress_if_smaller(self.current_filepath)
+        except Exception as e:
+            logger.warning(f"Compression stage skipped for file ID {self.file_id}: {e}")
+            return
+        if final_size < original_size:
+            record_metric('pdf_compression_saved_bytes', original_size - final_size, {'file_id': self.file_id})
+
     def _upload_to_r2(self):
         if Config.R2_FEATURE_FLAG == 'True':
             filename = os.path.basename(self.original_filepath)
-            r2_url = self._get_r2_uploader().upload(self.current_filepath, filename)
+            if self.stored:
+                r2_url = public_url(filename)
+            else:
+                checksum = self._content_checksum() if Config.R2_CONTENT_ADDRESSED == 'True' else None
+                if checksum:
+                    # Bytes já enviados antes (mesmo checksum) não são transferidos de novo
+                    self.object_key = content_key(checksum, filename)
+                    r2_url = self._get_r2_uploader().upload(self.current_filepath, self.object_key, skip_existing=True)
+                else:
+                    r2_url = self._get_r2_uploader().upload(self.current_filepath, filename)
 
             if r2_url:
                 logger.info(f"File {self.file_id} successfully uploaded to R2.")
@@ -99,53 +241,81 @@ class FileProcessingTask:
                 logger.error(f"Error moving file {self.original_filepath} to {new_path}: {e}")
                 raise
 
+    def _content_checksum(self):
+        if not self.checksum:
+            file_record = self.session.get(File, self.file_id)
+            self.checksum = (file_record.checksum if file_record else None) or file_sha256(self.current_filepath)
+        return self.checksum
+
     def _handle_error(self, error_message):
         logger.error(f"Error processing file ID {self.file_id}: {error_message}", exc_info=True)
         self.status = 'failed'
         self.processed_data = error_message
+        self.object_key = None
+        self._discard_stored_object()
         self._update_db_status('failed', processed_data=error_message)
 
+    def _discard_stored_object(self):
+        # Arquivos que não chegam a 'completed' não ficam no R2 (como no fluxo sem streaming)
+        if not self.stored:
+            return
+        try:
+            get_r2_client().delete_object(Bucket=Config.CLOUDFLARE_R2_BUCKET_NAME,
+                                          Key=os.path.basename(self.original_filepath))
+        except Exception as e:
+            logger.error(f"Failed to remove streamed object for file ID {self.file_id}: {e}")
+
     def _finalize_task(self):
         self._update_db_status(
             status=self.status,
             file_path=self.current_filepath,
             processed_data=self.processed_data,
-            structured_data=self.structured_data
+            structured_data=self.structured_data,
+            object_key=self.object_key
         )
         if self.status == 'completed' and self.structured_data:
             equipamentos = self.structured_data.get('equipamentos', [])
-            record_metric('equipment_count', len(equipamentos), {'file_id': self.file_id}, self.session)
+            record_metric('equipment_count', len(equipamentos), {'file_id': self.file_id})
             imei_numbers = self.structured_data.get('imei_numbers', [])
-            record_metric('imei_count', len(imei_numbers), {'file_id': self.file_id}, self.session)
+            record_metric('imei_count', len(imei_numbers), {'file_id': self.file_id})
             patrimonio_numbers = self.structured_data.get('patrimonio_numbers', [])
-            record_metric('patrimonio_count', len(patrimonio_numbers), {'file_id': self.file_id}, self.session)
+            record_metric('patrimonio_count', len(patrimonio_numbers), {'file_id': self.file_id})
         mq.publish_result({
             'file_id': self.file_id,
             'status': self.status,
             'processed_data': self.processed_data,
             'filepath': self.current_filepath,
-            'structured_data': self.structured_data
+            'structured_data': self.structured_data,
+            'object_key': self.object_key,
+            'duplicate_of_id': self.duplicate_of_id,
+            'checksum': self.checksum,
+            'signature': self.signature if self.status == 'completed' else None,
+            'previous_status': self.previous_status
         })
         logger.info(f"Worker {os.getpid()} finished task for file ID {self.file_id}. Final status: {self.status}")
 
-    def _update_db_status(self, status, file_path=None, processed_data=None, structured_data=None):
+    def _update_db_status(self, status, file_path=None, processed_data=None, structured_data=None, object_key=None):
+        if status != self.reported_status:
+            self.previous_status, self.reported_status = self.reported_status, status
+        if self.single_writer:
+            # O processo principal é o único escritor: o estado final segue na mensagem
+            # de resultado de _finalize_task; aqui só a transição para 'processing'.
+            if status == 'processing':
+                mq.publish_result({'file_id': self.file_id, 'status': status})
+            return
         try:
             file_record = self.session.get(File, self.file_id)
             if file_record:
                 file_record.status = status
                 if file_path: file_record.filepath = file_path
+                if object_key: file_record.object_key = object_key
                 if processed_data: file_record.processed_data = processed_data.strip()
                 if structured_data:
-                    file_record.nome = structured_data.get('nome')
-                    file_record.matricula = structured_data.get('matricula')
-                    file_record.funcao = structured_data.get('funcao')
-                    file_record.empregador = structured_data.get('empregador')
-                    file_record.rg = structured_data.get('rg')
-                    file_record.cpf = structured_data.get('cpf')
-                    file_record.equipamentos = json.dumps(structured_data.get('equipamentos')) if structured_data.get('equipamentos') else None
-                    file_record.data_documento = structured_data.get('data')
-                    file_record.imei_numbers = json.dumps(structured_data.get('imei_numbers')) if structured_data.get('imei_numbers') else None
-                    file_record.patrimonio_numbers = json.dumps(structured_data.get('patrimonio_numbers')) if structured_data.get('patrimonio_numbers') else None
+                    apply_structured_data(file_record, structured_data)
+                if status == 'duplicate' and self.duplicate_of_id:
+                    file_record.duplicate_of_id = self.duplicate_of_id
+                if status == 'completed':
+                    attach_signature(file_record, self.signature)
                 self.session.commit()
                 logger.info(f"DB status for file ID {self.file_id} updated to '{status}'.")
         except Exception as e:
@@ -166,26 +336,24 @@ class R2Uploader:
             logger.error("R2 credentials not fully configured.")
             return None
         try:
-            return boto3.client(
-                service_name='s3',
-                endpoint_url=Config.CLOUDFLARE_R2_ENDPOINT_URL,
-                aws_access_key_id=Config.CLOUDFLARE_R2_ACCESS_KEY_ID,
-                aws_secret_access_key=Config.CLOUDFLARE_R2_SECRET_ACCESS_KEY,
-                region_name='auto'
-            )
+            return get_r2_client()
         except Exception as e:
             logger.error(f"Error initializing R2 client: {e}")
             return None
 
-    def upload(self, local_file_path, object_name):
+    def upload(self, local_file_path, object_name, skip_existing=False):
         if not self.s3_client:
             return None
         try:
-            self.s3_client.upload_file(local_file_path, Config.CLOUDFLARE_R2_BUCKET_NAME, object_name)
+            if skip_existing and object_exists(self.s3_client, object_name):
+                logger.info(f"Object {object_name} already in R2; skipping upload of {local_file_path}.")
+                return public_url(object_name)
+            self.s3_client.upload_file(local_file_path, Config.CLOUDFLARE_R2_BUCKET_NAME, object_name,
+                                       Config=get_transfer_config())
             # Retornar a URL pública não assinada é geralmente mais útil para armazenamento no DB
-            public_url = f"{Config.CLOUDFLARE_R2_ENDPOINT_URL}/{object_name}"
-            logger.info(f"File uploaded to R2. Public URL: {public_url}")
-            return public_url
+            url = public_url(object_name)
+            logger.info(f"File uploaded to R2. Public URL: {url}")
+            return url
         except ClientError as e:
             logger.error(f"Failed to upload {local_file_path} to R2: {e}")
             return None
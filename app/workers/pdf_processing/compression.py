@@ -1,26 +1,33 @@
 import os
+import shutil
 import logging
 import subprocess
+from pypdf import PdfReader
 from app.config import Config
 
 logger = logging.getLogger(__name__)
 
+_ghostscript_path = None
+
 def check_ghostscript_installed():
-    """Checks if Ghostscript is installed and accessible via the configured path."""
-    if os.path.exists(Config.GHOSTSCRIPT_EXEC):
-        logger.info(f"Ghostscript found at {Config.GHOSTSCRIPT_EXEC}.")
-        return True
-    else:
-        logger.warning(f"Ghostscript executable not found at {Config.GHOSTSCRIPT_EXEC}. Please install Ghostscript and ensure Config.GHOSTSCRIPT_EXEC is correct.")
-        return False
+    """Checks if Ghostscript is installed and accessible via the configured path (or the PATH)."""
+    global _ghostscript_path
+    if _ghostscript_path is None:
+        _ghostscript_path = shutil.which(Config.GHOSTSCRIPT_EXEC) or (
+            Config.GHOSTSCRIPT_EXEC if os.path.exists(Config.GHOSTSCRIPT_EXEC) else ''
+        )
+        if _ghostscript_path:
+            logger.info(f"Ghostscript found at {_ghostscript_path}.")
+        else:
+            logger.warning(f"Ghostscript executable not found at {Config.GHOSTSCRIPT_EXEC}. PDF compression is disabled. Please install Ghostscript and ensure Config.GHOSTSCRIPT_EXEC is correct.")
+    return bool(_ghostscript_path)
 
-def compress_pdf(input_pdf_path, output_pdf_path, quality='screen'):
+def compress_pdf(input_pdf_path, output_pdf_path, quality='screen', timeout=None):
     """
     Compresses a PDF file using Ghostscript.
     Quality options: 'screen', 'ebook', 'printer', 'prepress', 'default'.
     """
     logger.info(f"Attempting to compress PDF: {input_pdf_path} to {output_pdf_path} with quality: {quality}")
-    check_ghostscript_installed()
     gs_command = [
         Config.GHOSTSCRIPT_EXEC,
         '-sDEVICE=pdfwrite',
@@ -28,21 +35,74 @@ def compress_pdf(input_pdf_path, output_pdf_path, quality='screen'):
         f'-dPDFSETTINGS=/{quality}',
         '-dNOPAUSE',
         '-dBATCH',
+        '-dSAFER',
         '-q',
         f'-sOutputFile={output_pdf_path}',
         input_pdf_path
     ]
 
     try:
-        subprocess.run(gs_command, check=True, capture_output=True, text=True)
+        subprocess.run(gs_command, check=True, capture_output=True, text=True, timeout=timeout)
         logger.info(f"Successfully compressed PDF: {input_pdf_path} -> {output_pdf_path}")
         return True
     except FileNotFoundError:
         logger.error(f"Ghostscript executable '{Config.GHOSTSCRIPT_EXEC}' not found. Cannot compress PDF. Please install Ghostscript and ensure the path is correct or it's in your system's PATH.")
         return False
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Ghostscript timed out after {timeout}s compressing {input_pdf_path}.")
+        return False
     except subprocess.CalledProcessError as e:
         logger.error(f"Error compressing PDF {input_pdf_path} with Ghostscript: {e.stderr}", exc_info=True)
         return False
     except Exception as e:
         logger.error(f"An unexpected error occurred during PDF compression for {input_pdf_path}: {e}", exc_info=True)
         return False
+
+def is_scanned_pdf(pdf_path, sample_pages=3):
+    """True se as primeiras páginas não têm texto (documento digitalizado, só imagens)."""
+    try:
+        reader = PdfReader(pdf_path)
+        for page in reader.pages[:sample_pages]:
+            if (page.extract_text() or '').strip():
+                return False
+        return True
+    except Exception as e:
+        logger.warning(f"Could not inspect pages of {pdf_path}: {e}")
+        return False
+
+def choose_preset(size_bytes, scanned):
+    """
+    Preset do Ghostscript pelo tamanho e tipo das páginas: digitalizações grandes vão
+    para 'ebook' (150 dpi, ainda legível); o resto usa 'printer', que preserva a
+    resolução e ganha na recompressão dos streams e fontes.
+    """
+    if scanned and size_bytes >= Config.PDF_COMPRESSION_LARGE_BYTES:
+        return 'ebook'
+    return 'printer'
+
+def compress_if_smaller(pdf_path):
+    """
+    Etapa de compressão do pipeline: comprime `pdf_path` no lugar se o resultado for
+    ao menos PDF_COMPRESSION_MIN_SAVING menor. Retorna (tamanho original, tamanho final);
+    em qualquer falha o arquivo original é mantido.
+    """
+    original_size = os.path.getsize(pdf_path)
+    if (Config.PDF_COMPRESSION_ENABLED != 'True' or original_size < Config.PDF_COMPRESSION_MIN_BYTES
+            or not check_ghostscript_installed()):
+        return original_size, original_size
+
+    preset = choose_preset(original_size, is_scanned_pdf(pdf_path))
+    output_path = f"{pdf_path}.gs.pdf"
+    try:
+        if not compress_pdf(pdf_path, output_path, quality=preset, timeout=Config.PDF_COMPRESSION_TIMEOUT_SECONDS):
+            return original_size, original_size
+        compressed_size = os.path.getsize(output_path)
+        if compressed_size > original_size * (1 - Config.PDF_COMPRESSION_MIN_SAVING):
+            logger.info(f"Compression of {pdf_path} saved too little ({original_size} -> {compressed_size} bytes); keeping original.")
+            return original_size, original_size
+        os.replace(output_path, pdf_path)
+        logger.info(f"Compressed {pdf_path} with /{preset}: {original_size} -> {compressed_size} bytes.")
+        return original_size, compressed_size
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
@@ -1,22 +1,108 @@
-from flask import Blueprint, render_template
+import time
+
+from flask import Blueprint, Response, render_template, jsonify, request, abort, current_app
 from flask_login import login_required, current_user
-from app.models import File
+from sqlalchemy import select
+from app.models import db, File, Group
+from app.counters import get_status_counts, STATUSES
+from app.access import can_access_group, accessible_groups, file_access_filter
+from app.events import status_events, file_scopes, format_sse
 
 workers_bp = Blueprint('workers', __name__, url_prefix='/workers')
 
+# Limite de IDs por consulta em /workers/files.json
+MAX_STATUS_IDS = 500
+# Status em que o arquivo não muda mais sozinho
+FINAL_STATUSES = ('completed', 'failed', 'duplicate')
+
 @workers_bp.route('/status')
 @login_required
 def worker_status():
-    user_query = File.query.filter_by(user_id=current_user.id)
-    
-    pending_count = user_query.filter_by(status='pending').count()
-    processing_count = user_query.filter_by(status='processing').count()
-    completed_count = user_query.filter_by(status='completed').count()
-    failed_count = user_query.filter_by(status='failed').count()
+    counts = get_status_counts(db.session, 'user', current_user.id)
 
     return render_template('worker_status.html', title='Worker Status',
-                           pending_count=pending_count,
-                           processing_count=processing_count,
-                           completed_count=completed_count,
-                           failed_count=failed_count)
+                           pending_count=counts['pending'],
+                           processing_count=counts['processing'],
+                           completed_count=counts['completed'],
+                           failed_count=counts['failed'])
+
+@workers_bp.route('/status.json')
+@login_required
+def worker_status_json():
+    """Mesmos contadores da página de status, opcionalmente para um grupo (?group_id=)."""
+    group_id = request.args.get('group_id', type=int)
+    if group_id is None:
+        return jsonify({'scope': 'user', 'id': current_user.id, 'counts': get_status_counts(db.session, 'user', current_user.id)})
+
+    group = Group.query.get_or_404(group_id)
+    if not can_access_group(current_user, group):
+        abort(403)
+    return jsonify({'scope': 'group', 'id': group_id, 'counts': get_status_counts(db.session, 'group', group_id)})
+
+@workers_bp.route('/files.json')
+@login_required
+def files_status_json():
+    """
+    Status de um lote de arquivos (?ids=1,2,3), por exemplo os de um upload: uma consulta só,
+    restrita aos arquivos visíveis para o usuário. `done` indica que nenhum ainda está na fila.
+    """
+    try:
+        ids = sorted({int(value) for value in request.args.get('ids', '').split(',') if value.strip()})
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of integers.'}), 400
+    if len(ids) > MAX_STATUS_IDS:
+        return jsonify({'error': f'At most {MAX_STATUS_IDS} ids per request.'}), 400
+
+    rows = []
+    if ids:
+        query = select(File.id, File.status, File.original_filename).where(File.id.in_(ids), File.is_deleted == False)
+        if not current_user.is_admin:
+            query = query.where(file_access_filter(current_user.id))
+        rows = db.session.execute(query.order_by(File.id)).all()
+
+    counts = dict.fromkeys(STATUSES, 0)
+    for _, status, _ in rows:
+        counts[status] = counts.get(status, 0) + 1
+    return jsonify({
+        'files': [{'id': file_id, 'status': status, 'original_filename': name} for file_id, status, name in rows],
+        'counts': counts,
+        'done': all(status in FINAL_STATUSES for _, status, _ in rows),
+    })
+
+@workers_bp.route('/events')
+@login_required
+def status_events_stream():
+    """
+    Server-Sent Events com as transições de status dos arquivos do usuário e dos seus grupos.
+    O primeiro evento ('counts') traz os contadores atuais; depois só chegam transições
+    ('status'). Se o cliente ficar para trás, recebe 'resync' e deve recarregar pelo JSON.
+    A conexão é encerrada após SSE_MAX_STREAM_SECONDS e o EventSource reconecta sozinho.
+    """
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    max_duration = current_app.config['SSE_MAX_STREAM_SECONDS']
+    scopes = file_scopes(current_user.id, None) + [('group', group_id) for group_id, _ in accessible_groups(current_user.id)]
+    snapshot = {'scope': 'user', 'id': current_user.id, 'counts': get_status_counts(db.session, 'user', current_user.id)}
+    subscription = status_events.subscribe(scopes)
+
+    # Sem stream_with_context: o contexto (e a sessão do banco) é encerrado antes da espera por eventos
+
+    def generate():
+        deadline = time.monotonic() + max_duration
+        try:
+            yield format_sse(snapshot, event='counts', retry=3000)
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0.01)))
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield format_sse({}, event='resync')
+                if event is None:
+                    yield format_sse(comment='keep-alive')
+                    continue
+                yield format_sse({k: v for k, v in event.items() if k != 'event_id'}, event='status', event_id=event['event_id'])
+        finally:
+            status_events.unsubscribe(subscription)
 
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Sem buffer no nginx: cada evento sai na hora
+    })
@@ -7,6 +7,8 @@ from sqlalchemy.orm import sessionmaker, Session
 
 from app.workers.handlers import FileProcessingTask
 from app.mq import mq, MessageQueue
+from app.metrics import flush_metrics
+from app.database import engine_options
 from app.config import Config
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,19 +21,25 @@ def _get_db_session(db_uri: str) -> Session:
     """Retorna uma sessão de banco de dados, criando o engine apenas uma vez."""
     global _engine, _SessionFactory
     if _engine is None:
-        _engine = create_engine(db_uri, pool_size=1, max_overflow=0, pool_recycle=1800)
+        options = engine_options(
+            db_uri, {'pool_size': 1, 'max_overflow': 0, 'pool_recycle': 1800},
+            sqlite_pool={'pool_size': 1, 'max_overflow': 1}
+        )
+        _engine = create_engine(db_uri, **options)
         _SessionFactory = sessionmaker(bind=_engine)
     return _SessionFactory()
 
-def process_file_task(file_id: int, file_path: str, db_uri: str, session: Session):
+def process_file_task(file_id: int, file_path: str, db_uri: str, session: Session, **task_options):
     """
     Ponto de entrada para processar um arquivo.
     Instancia e executa a tarefa de processamento de arquivo.
+    `task_options` (stored, checksum) vêm da mensagem quando o upload foi enviado ao R2 na requisição.
     """
     task = FileProcessingTask(
         file_id=file_id,
         file_path=file_path,
-        session=session
+        session=session,
+        **task_options
     )
     task.run()
 
@@ -45,6 +53,7 @@ def worker_main(db_uri: str):
     # Use a local MessageQueue instance for each worker process
     worker_mq = MessageQueue()
     worker_mq.connect() # No longer raises if connection fails, sets use_local_fallback instead
+    last_metrics_flush = time.monotonic()
 
     try:
         while True:
@@ -79,17 +88,25 @@ def worker_main(db_uri: str):
                     logger.info(f"Worker {os.getpid()} received task: File ID {file_id}")
 
                     worker_session = _get_db_session(db_uri)
-                    process_file_task(file_id, file_path, db_uri, session=worker_session)
+                    # O processamento (OCR) roda em outra thread enquanto esta
+                    # thread mantém os heartbeats da conexão AMQP.
+                    task_options = {key: message[key] for key in ('stored', 'checksum') if key in message}
+                    worker_mq.run_with_heartbeat(process_file_task, file_id, file_path, db_uri,
+                                                 session=worker_session, **task_options)
                     
                     # Acknowledge the message after successful processing
                     if method_frame:
-                        worker_mq.channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+                        worker_mq.ack(method_frame.delivery_tag)
                 except Exception as e:
                     logger.error(f"Worker {os.getpid()} encountered an error processing task: {e}", exc_info=True)
                     if method_frame:
-                        worker_mq.channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=False)
+                        worker_mq.nack(method_frame.delivery_tag, requeue=False)
                 finally:
                     if worker_session:
+                        # Métricas vão para o banco em lote, não a cada registro
+                        if time.monotonic() - last_metrics_flush > Config.METRICS_FLUSH_SECONDS:
+                            flush_metrics(worker_session)
+                            last_metrics_flush = time.monotonic()
                         worker_session.close()
             else:
                 # No tasks found in either queue, exit worker
@@ -98,4 +115,10 @@ def worker_main(db_uri: str):
     except Exception as e:
         logger.error(f"Worker {os.getpid()} critical error: {e}")
     finally:
+        try:
+            exit_session = _get_db_session(db_uri)
+            flush_metrics(exit_session)
+            exit_session.close()
+        except Exception as e:
+            logger.error(f"Worker {os.getpid()} failed to flush metrics on exit: {e}")
         worker_mq.close()
\ No newline at end of file
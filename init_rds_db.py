@@ -1,4 +1,5 @@
-from app import create_app, db
+from app import create_app, MIGRATIONS_DIR
+from flask_migrate import upgrade
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -9,13 +10,12 @@ app = create_app()
 def init_db():
     with app.app_context():
         try:
-            logger.info("Limpando banco de dados RDS (drop tables)...")
-            db.drop_all()
-            logger.info("Criando tabelas no banco de dados RDS...")
-            db.create_all()
-            logger.info("Tabelas criadas com sucesso!")
+            # Aplica as migrações em vez de recriar as tabelas: os dados existentes são preservados
+            logger.info("Aplicando migrações no banco de dados RDS...")
+            upgrade(directory=MIGRATIONS_DIR)
+            logger.info("Banco de dados atualizado com sucesso!")
         except Exception as e:
-            logger.error(f"Erro ao criar tabelas: {e}")
+            logger.error(f"Erro ao aplicar migrações: {e}")
 
 if __name__ == "__main__":
     init_db()
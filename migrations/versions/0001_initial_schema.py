@@ -0,0 +1,91 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=64), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('password_hash', sa.String(length=256), nullable=True),
+        sa.Column('is_admin', sa.Boolean(), nullable=True),
+        sa.Column('registration_date', sa.DateTime(), nullable=True),
+        sa.Column('last_login', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('group',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('description', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('creator_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['creator_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('group_members',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['group_id'], ['group.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'group_id')
+    )
+    op.create_table('file',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=256), nullable=False),
+        sa.Column('original_filename', sa.String(length=256), nullable=False),
+        sa.Column('filepath', sa.String(length=512), nullable=False),
+        sa.Column('upload_date', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('checksum', sa.String(length=256), nullable=True),
+        sa.Column('processed_data', sa.Text(), nullable=True),
+        sa.Column('is_deleted', sa.Boolean(), nullable=True),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('nome', sa.String(length=255), nullable=True),
+        sa.Column('matricula', sa.String(length=255), nullable=True),
+        sa.Column('funcao', sa.String(length=255), nullable=True),
+        sa.Column('empregador', sa.String(length=255), nullable=True),
+        sa.Column('rg', sa.String(length=255), nullable=True),
+        sa.Column('cpf', sa.String(length=255), nullable=True),
+        sa.Column('equipamentos', sa.Text(), nullable=True),
+        sa.Column('data_documento', sa.String(length=50), nullable=True),
+        sa.Column('imei_numbers', sa.Text(), nullable=True),
+        sa.Column('patrimonio_numbers', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['group_id'], ['group.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('metric',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.Column('tags', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('metric')
+    op.drop_table('file')
+    op.drop_table('group_members')
+    op.drop_table('group')
+    op.drop_table('user')
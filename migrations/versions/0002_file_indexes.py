@@ -0,0 +1,40 @@
+"""indexes for the hot File queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# Os índices de listagem são parciais (apenas arquivos não deletados)
+NOT_DELETED = dict(
+    sqlite_where=sa.text('is_deleted = 0'),
+    postgresql_where=sa.text('is_deleted = false'),
+)
+
+
+def upgrade():
+    op.create_index('ix_file_checksum', 'file', ['checksum'])
+    op.create_index('ix_file_filename', 'file', ['filename'])
+    op.create_index('ix_file_user_status', 'file', ['user_id', 'status'])
+    op.create_index('ix_file_user_listing', 'file', ['user_id', 'upload_date'], **NOT_DELETED)
+    op.create_index('ix_file_group_listing', 'file', ['group_id', 'upload_date'], **NOT_DELETED)
+    op.create_index('ix_file_status_listing', 'file', ['status', 'upload_date'], **NOT_DELETED)
+
+
+def downgrade():
+    op.drop_index('ix_file_status_listing', table_name='file')
+    op.drop_index('ix_file_group_listing', table_name='file')
+    op.drop_index('ix_file_user_listing', table_name='file')
+    op.drop_index('ix_file_user_status', table_name='file')
+    op.drop_index('ix_file_filename', table_name='file')
+    op.drop_index('ix_file_checksum', table_name='file')
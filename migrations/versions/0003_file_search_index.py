@@ -0,0 +1,60 @@
+"""full-text index over extracted text
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:20:00
+
+"""
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def _fold(value):
+    normalized = unicodedata.normalize('NFD', value or '')
+    return normalized.encode('ascii', 'ignore').decode('utf-8').lower()
+
+
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')")
+        insert = sa.text("INSERT INTO file_search (rowid, body) VALUES (:file_id, :body)")
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS file_search ("
+            "file_id INTEGER PRIMARY KEY REFERENCES file (id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)"
+        )
+        op.execute("CREATE INDEX IF NOT EXISTS ix_file_search_document ON file_search USING gin (document)")
+        insert = sa.text("INSERT INTO file_search (file_id, document) VALUES (:file_id, to_tsvector('portuguese', :body))")
+    else:
+        return
+
+    # Indexa o texto já extraído em lotes, para não carregar a tabela inteira na memória
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id, processed_data FROM file WHERE id > :last_id AND processed_data IS NOT NULL ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        params = [{'file_id': row.id, 'body': _fold(row.processed_data)} for row in rows if (row.processed_data or '').strip()]
+        if params:
+            bind.execute(insert, params)
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS file_search")
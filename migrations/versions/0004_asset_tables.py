@@ -0,0 +1,101 @@
+"""normalized equipment, IMEI and patrimonio tables
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:30:00
+
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def _load_json_list(value):
+    try:
+        parsed = json.loads(value) if value else []
+    except (ValueError, TypeError):
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+
+def _code(value):
+    return str(value).strip().lower()
+
+
+def upgrade():
+    equipment = op.create_table('file_equipment',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('nome_equipamento', sa.String(length=255), nullable=True),
+        sa.Column('imei', sa.String(length=64), nullable=True),
+        sa.Column('patrimonio', sa.String(length=64), nullable=True),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_file_equipment_file_id', 'file_equipment', ['file_id'])
+
+    imeis = op.create_table('file_imei',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('imei', sa.String(length=64), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_file_imei_file_id', 'file_imei', ['file_id'])
+    op.create_index('ix_file_imei_lookup', 'file_imei', ['imei', 'file_id'])
+
+    patrimonios = op.create_table('file_patrimonio',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('patrimonio', sa.String(length=64), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_file_patrimonio_file_id', 'file_patrimonio', ['file_id'])
+    op.create_index('ix_file_patrimonio_lookup', 'file_patrimonio', ['patrimonio', 'file_id'])
+
+    # Backfill a partir das colunas JSON existentes, em lotes
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id, equipamentos, imei_numbers, patrimonio_numbers FROM file "
+                    "WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        equipment_rows, imei_rows, patrimonio_rows = [], [], []
+        for row in rows:
+            for item in _load_json_list(row.equipamentos):
+                if isinstance(item, dict):
+                    equipment_rows.append({
+                        'file_id': row.id,
+                        'nome_equipamento': item.get('nome_equipamento'),
+                        'imei': _code(item['imei']) if item.get('imei') else None,
+                        'patrimonio': _code(item['patrimonio']) if item.get('patrimonio') else None,
+                    })
+            imei_rows.extend({'file_id': row.id, 'imei': _code(v)} for v in _load_json_list(row.imei_numbers) if v)
+            patrimonio_rows.extend({'file_id': row.id, 'patrimonio': _code(v)} for v in _load_json_list(row.patrimonio_numbers) if v)
+        if equipment_rows:
+            op.bulk_insert(equipment, equipment_rows)
+        if imei_rows:
+            op.bulk_insert(imeis, imei_rows)
+        if patrimonio_rows:
+            op.bulk_insert(patrimonios, patrimonio_rows)
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_table('file_patrimonio')
+    op.drop_table('file_imei')
+    op.drop_table('file_equipment')
@@ -0,0 +1,40 @@
+"""per-user and per-group file status counters
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:40:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_status_counter',
+        sa.Column('scope_type', sa.String(length=10), nullable=False),
+        sa.Column('scope_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('scope_type', 'scope_id', 'status')
+    )
+    op.execute(
+        "INSERT INTO file_status_counter (scope_type, scope_id, status, count) "
+        "SELECT 'user', user_id, status, COUNT(*) FROM file "
+        "WHERE user_id IS NOT NULL AND status IS NOT NULL GROUP BY user_id, status"
+    )
+    op.execute(
+        "INSERT INTO file_status_counter (scope_type, scope_id, status, count) "
+        "SELECT 'group', group_id, status, COUNT(*) FROM file "
+        "WHERE group_id IS NOT NULL AND status IS NOT NULL GROUP BY group_id, status"
+    )
+
+
+def downgrade():
+    op.drop_table('file_status_counter')
@@ -0,0 +1,24 @@
+"""index on group.creator_id for access scope checks
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 13:05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_group_creator_id', 'group', ['creator_id'])
+
+
+def downgrade():
+    op.drop_index('ix_group_creator_id', table_name='group')
@@ -0,0 +1,80 @@
+"""move raw extracted text to the compressed file_content table
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 13:30:00
+
+"""
+import zlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+file_table = sa.table('file', sa.column('id', sa.Integer), sa.column('processed_data', sa.Text))
+
+
+def upgrade():
+    content = op.create_table('file_content',
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=10), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('file_id')
+    )
+
+    # Os textos existentes vão com zlib; novos registros usam Config.CONTENT_CODEC
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(file_table.c.id, file_table.c.processed_data)
+            .where(file_table.c.id > last_id, file_table.c.processed_data.isnot(None))
+            .order_by(file_table.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(content.insert(), [
+            {'file_id': row.id, 'codec': 'zlib', 'data': zlib.compress(row.processed_data.encode('utf-8'), 6),
+             'size': len(row.processed_data.encode('utf-8'))}
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    op.drop_column('file', 'processed_data')
+
+
+def downgrade():
+    op.add_column('file', sa.Column('processed_data', sa.Text(), nullable=True))
+
+    content = sa.table('file_content', sa.column('file_id', sa.Integer), sa.column('codec', sa.String),
+                       sa.column('data', sa.LargeBinary))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(content.c.file_id, content.c.codec, content.c.data)
+            .where(content.c.file_id > last_id).order_by(content.c.file_id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            if row.codec == 'zstd':
+                import zstandard
+                text = zstandard.ZstdDecompressor().decompress(row.data).decode('utf-8')
+            else:
+                text = zlib.decompress(row.data).decode('utf-8')
+            connection.execute(
+                file_table.update().where(file_table.c.id == row.file_id).values(processed_data=text)
+            )
+        last_id = rows[-1].file_id
+
+    op.drop_table('file_content')
@@ -0,0 +1,68 @@
+"""archive tables for soft-deleted files and old metrics
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 14:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=256), nullable=False),
+        sa.Column('original_filename', sa.String(length=256), nullable=False),
+        sa.Column('filepath', sa.String(length=512), nullable=False),
+        sa.Column('upload_date', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('checksum', sa.String(length=256), nullable=True),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('nome', sa.String(length=255), nullable=True),
+        sa.Column('matricula', sa.String(length=255), nullable=True),
+        sa.Column('funcao', sa.String(length=255), nullable=True),
+        sa.Column('empregador', sa.String(length=255), nullable=True),
+        sa.Column('rg', sa.String(length=255), nullable=True),
+        sa.Column('cpf', sa.String(length=255), nullable=True),
+        sa.Column('equipamentos', sa.Text(), nullable=True),
+        sa.Column('data_documento', sa.String(length=50), nullable=True),
+        sa.Column('imei_numbers', sa.Text(), nullable=True),
+        sa.Column('patrimonio_numbers', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('content_codec', sa.String(length=10), nullable=True),
+        sa.Column('content_data', sa.LargeBinary(), nullable=True),
+        sa.Column('content_size', sa.Integer(), nullable=True),
+        sa.Column('storage_purged', sa.Boolean(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_file_archive_user_id', 'file_archive', ['user_id'])
+    op.create_table('metric_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.Column('tags', sa.Text(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_metric_timestamp', 'metric', ['timestamp'])
+    op.create_index('ix_file_archive_candidates', 'file', ['deleted_at'],
+                    sqlite_where=sa.text('is_deleted = 1'), postgresql_where=sa.text('is_deleted = true'))
+
+
+def downgrade():
+    op.drop_index('ix_file_archive_candidates', table_name='file')
+    op.drop_index('ix_metric_timestamp', table_name='metric')
+    op.drop_table('metric_archive')
+    op.drop_index('ix_file_archive_user_id', table_name='file_archive')
+    op.drop_table('file_archive')
@@ -0,0 +1,40 @@
+"""content-addressed storage keys and object reference counts
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 15:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stored_object',
+        sa.Column('key', sa.String(length=256), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+    )
+    # Arquivos existentes continuam com o objeto em `filename` (object_key nulo)
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('object_key', sa.String(length=256), nullable=True))
+        batch_op.create_index('ix_file_object_key', ['object_key'])
+    with op.batch_alter_table('file_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('object_key', sa.String(length=256), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('file_archive', schema=None) as batch_op:
+        batch_op.drop_column('object_key')
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_index('ix_file_object_key')
+        batch_op.drop_column('object_key')
+    op.drop_table('stored_object')
@@ -0,0 +1,31 @@
+"""queue of R2 objects awaiting batched deletion
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 16:05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('storage_purge',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=256), nullable=False),
+        sa.Column('requested_at', sa.DateTime(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('storage_purge')
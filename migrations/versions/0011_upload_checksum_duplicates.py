@@ -0,0 +1,36 @@
+"""upload size and duplicate link on file
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 16:50:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('duplicate_of_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_file_duplicate_of_id', 'file', ['duplicate_of_id'], ['id'], ondelete='SET NULL')
+        batch_op.create_index('ix_file_size', ['size'])
+    with op.batch_alter_table('file_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('file_archive', schema=None) as batch_op:
+        batch_op.drop_column('size')
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_index('ix_file_size')
+        batch_op.drop_constraint('fk_file_duplicate_of_id', type_='foreignkey')
+        batch_op.drop_column('duplicate_of_id')
+        batch_op.drop_column('size')
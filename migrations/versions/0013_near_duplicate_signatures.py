@@ -0,0 +1,47 @@
+"""near-duplicate signatures (page dHash and text MinHash with LSH bands)
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-18 23:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0013'
+down_revision = '0012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_signature',
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('page_hash', sa.String(length=64), nullable=True),
+        sa.Column('page_count', sa.Integer(), nullable=True),
+        sa.Column('text_minhash', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('file_id')
+    )
+    op.create_table('file_signature_band',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=8), nullable=False),
+        sa.Column('band', sa.SmallInteger(), nullable=False),
+        sa.Column('value', sa.String(length=16), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['file_signature.file_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('file_signature_band', schema=None) as batch_op:
+        batch_op.create_index('ix_file_signature_band_file_id', ['file_id'], unique=False)
+        batch_op.create_index('ix_file_signature_band_lookup', ['kind', 'band', 'value'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('file_signature_band', schema=None) as batch_op:
+        batch_op.drop_index('ix_file_signature_band_lookup')
+        batch_op.drop_index('ix_file_signature_band_file_id')
+    op.drop_table('file_signature_band')
+    op.drop_table('file_signature')
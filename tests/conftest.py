@@ -46,6 +46,14 @@ def app():
         # Explicitly shut down any worker-related threads
         shutdown_workers(_app)
         db.drop_all()
+        # Per-process caches must not leak ids between test databases
+        from app.access import invalidate_access_scope
+        from app.files.handlers import data_count_cache
+        invalidate_access_scope()
+        data_count_cache.invalidate()
+        # Testes trocam boto3.client por mocks; o cliente R2 compartilhado não pode vazar
+        from app.storage import reset_r2_clients
+        reset_r2_clients()
 
     # Clean up test folders
     for folder in ['UPLOAD_FOLDER', 'PENDING_FOLDER', 'PROCESSING_FOLDER', 'COMPLETED_FOLDER', 'FAILED_FOLDER']:
@@ -1,4 +1,5 @@
 import pytest
+import os
 from app.models import User
 from urllib.parse import urlparse
 
@@ -54,3 +55,126 @@ def test_setup_admin_post_already_exists(client, session, admin_user):
     assert b'Admin user already exists. Please log in.' in response.data
     assert b'Login' in response.data
     assert session.query(User).filter_by(username='anotheradmin').first() is None
+
+def test_metrics_are_buffered_and_flushed_in_batch(session):
+    """record_metric does not touch the database; flush writes aggregated rows at once."""
+    from app.models import Metric
+    from app.metrics import record_metric, flush_metrics, metrics_buffer
+
+    metrics_buffer.drain()
+    record_metric('user_login', 1, {'user_id': 1})
+    record_metric('user_login', 1, {'user_id': 1})
+    record_metric('imei_count', 3, {'file_id': 9})
+    assert session.query(Metric).count() == 0
+
+    assert flush_metrics(session) == 2
+    rows = {m.name: m.value for m in session.query(Metric).all()}
+    assert rows == {'user_login': 2, 'imei_count': 3}
+    assert flush_metrics(session) == 0
+
+def test_metrics_endpoint(client, app, admin_user):
+    """The Prometheus endpoint is denied to anonymous clients; METRICS_TOKEN or an admin login opens it."""
+    from app.metrics import record_metric, metrics_buffer
+    from tests.test_auth import login
+
+    record_metric('file_upload', 1)
+    metrics_buffer.drain()
+    assert client.get('/metrics').status_code == 401
+
+    app.config['METRICS_TOKEN'] = 'scrape-token'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert b'app_metric_events_total{name="file_upload"}' in response.data
+
+    app.config['METRICS_TOKEN'] = None
+    login(client, admin_user.email, 'adminpassword')
+    assert client.get('/metrics').status_code == 200
+
+def test_sqlite_engine_profile(tmp_path):
+    """SQLite engines get WAL, a busy timeout and a pool suited to a local file."""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import StaticPool
+    from app.database import engine_options
+
+    postgres = engine_options('postgresql://u:p@db/app', {'pool_size': 2, 'max_overflow': 3})
+    assert postgres == {'pool_size': 2, 'max_overflow': 3}
+
+    memory = engine_options('sqlite:///:memory:', {'pool_size': 2, 'pool_recycle': 1800})
+    assert memory['poolclass'] is StaticPool and 'pool_size' not in memory
+
+    uri = f"sqlite:///{tmp_path / 'profile.db'}"
+    options = engine_options(uri, {'pool_size': 2, 'max_overflow': 3, 'pool_recycle': 1800})
+    assert options['connect_args']['check_same_thread'] is False
+    engine = create_engine(uri, **options)
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA synchronous')).scalar() == 1
+        assert connection.execute(text('PRAGMA busy_timeout')).scalar() > 0
+    engine.dispose()
+
+def test_hot_folder_waits_for_stable_files_and_ingests_in_batches(session, regular_user, tmp_path):
+    """Scanner output is picked up once it stops changing, copied with its checksum and published in batches."""
+    import hashlib
+    from unittest.mock import patch
+    from app.models import File
+    from app.hot_folder import HotFolderWatcher, parse_hot_folders, REJECTED_FOLDER
+
+    inbox, uploads = tmp_path / 'scanner', tmp_path / 'uploads'
+    inbox.mkdir()
+    uploads.mkdir()
+    now = [0.0]
+    watcher = HotFolderWatcher(parse_hot_folders(str(inbox)), regular_user.id, upload_folder=str(uploads),
+                               settle_seconds=5, batch_size=2, clock=lambda: now[0])
+
+    documents = {f'scan{i}.pdf': b'%PDF-1.4\n%scan ' + bytes([i]) * 50 for i in range(3)}
+    for name, body in documents.items():
+        (inbox / name).write_bytes(body)
+    (inbox / 'notes.txt').write_bytes(b'not a document')
+    (inbox / 'scan9.pdf.part').write_bytes(b'%PDF-1.4 still writing')
+
+    assert watcher.scan() == [] # Primeira observação: ainda pode estar sendo gravado
+    now[0] = 2
+    (inbox / 'scan2.pdf').write_bytes(documents['scan2.pdf'] + b'more pages')
+    documents['scan2.pdf'] += b'more pages'
+    now[0] = 6
+    ready = watcher.scan()
+    assert sorted(os.path.basename(path) for path, _, _ in ready) == ['notes.txt', 'scan0.pdf', 'scan1.pdf']
+    assert watcher.pending()
+
+    with patch('app.ingest.MessageQueue.publish_tasks') as mock_publish_tasks:
+        assert watcher.ingest(session, ready) == (2, 0)
+        now[0] = 11
+        assert [os.path.basename(path) for path, _, _ in watcher.scan()] == ['scan2.pdf']
+        # inotify: arquivo fechado após escrita entra sem esperar a estabilização
+        (inbox / 'scan3.pdf').write_bytes(b'%PDF-1.4\n%closed')
+        ready = watcher.scan(closed={str(inbox / 'scan3.pdf')})
+        assert sorted(os.path.basename(path) for path, _, _ in ready) == ['scan2.pdf', 'scan3.pdf']
+        assert watcher.ingest(session, ready) == (2, 0)
+
+    assert [len(call.args[0]) for call in mock_publish_tasks.call_args_list] == [2, 2]
+    files = {f.original_filename: f for f in session.query(File).all()}
+    assert sorted(files) == ['scan0.pdf', 'scan1.pdf', 'scan2.pdf', 'scan3.pdf']
+    assert files['scan2.pdf'].checksum == hashlib.sha256(documents['scan2.pdf']).hexdigest()
+    assert all(f.user_id == regular_user.id and os.path.dirname(f.filepath) == str(uploads) for f in files.values())
+    assert sorted(os.listdir(inbox)) == [REJECTED_FOLDER, 'scan9.pdf.part']
+    assert os.listdir(inbox / REJECTED_FOLDER) == ['notes.txt']
+
+def test_hot_folder_keeps_sources_when_registration_fails(session, regular_user, tmp_path):
+    from unittest.mock import patch
+    from app.hot_folder import HotFolderWatcher
+
+    inbox, uploads = tmp_path / 'scanner', tmp_path / 'uploads'
+    inbox.mkdir()
+    uploads.mkdir()
+    (inbox / 'scan.pdf').write_bytes(b'%PDF-1.4\n%scan')
+    watcher = HotFolderWatcher([(str(inbox), None)], regular_user.id, upload_folder=str(uploads), settle_seconds=0)
+    watcher.scan()
+    ready = watcher.scan()
+
+    with patch.object(session, 'commit', side_effect=RuntimeError('database is locked')):
+        with pytest.raises(RuntimeError):
+            watcher.ingest(session, ready)
+    assert os.listdir(inbox) == ['scan.pdf']
+    assert os.listdir(uploads) == []
@@ -188,7 +188,7 @@ def test_view_data_filter_no_match(client, session, regular_user):
     assert b'No files found.' in response.data
     assert b'invoice.png' not in response.data
 
-@patch('app.workers.handlers.boto3.client')
+@patch('app.storage.boto3.client')
 def test_download_file_success(mock_boto3_client, client, session, admin_user):
     """Test successful file download from R2."""
     login_response = login(client, admin_user.email, 'adminpassword')
@@ -212,6 +212,22 @@ def test_download_file_success(mock_boto3_client, client, session, admin_user):
         ExpiresIn=60
     )
 
+@patch('app.storage.boto3.client')
+def test_r2_client_is_shared_across_requests(mock_boto3_client, client, session, admin_user):
+    """Downloads reuse the per-process R2 client instead of building one per request."""
+    login_response = login(client, admin_user.email, 'adminpassword')
+    client.get(login_response.headers['Location'])
+    mock_boto3_client.return_value.generate_presigned_url.return_value = 'http://mock-r2-url/shared.pdf'
+
+    session.add(File(filename='shared.pdf', original_filename='shared.pdf', filepath='http://mock-r2-url/shared.pdf',
+                     user_id=admin_user.id, status='completed'))
+    session.commit()
+
+    for _ in range(3):
+        assert client.get(url_for('files.download_file', filename='shared.pdf')).status_code == 302
+    mock_boto3_client.assert_called_once()
+    assert mock_boto3_client.call_args.kwargs['config'].max_pool_connections == client.application.config['R2_MAX_POOL_CONNECTIONS']
+
 @patch('app.files.handlers.os.remove')
 @patch('flask.current_app')
 def test_upload_invalid_file_type(mock_current_app, mock_os_remove, client, session, regular_user):
@@ -250,19 +266,15 @@ def test_download_unauthorized_file(client, session, regular_user, admin_user):
     assert response.status_code == 200
     assert b'You are not authorized to download this file.' in response.data
 
-@patch('app.files.handlers.record_metric')
-@patch('app.mq.mq.publish_task')
-@patch('app.files.handlers.os.remove')
-@patch('flask.current_app')
-def test_upload_with_metrics(mock_current_app, mock_os_remove, mock_publish_task, mock_record_metric, client, session, regular_user):
+@patch('app.ingest.record_metric')
+@patch('app.ingest.MessageQueue.publish_tasks')
+def test_upload_with_metrics(mock_publish_tasks, mock_record_metric, client, session, regular_user):
     """Test upload records metrics."""
     login_response = login(client, regular_user.email, 'userpassword')
     client.get(login_response.headers['Location'])
 
-    mock_current_app.config = client.application.config
-
     data = {
-        'file': (BytesIO(b'file content'), 'metric_test.pdf')
+        'file': (BytesIO(b'%PDF-1.4\n%metric test'), 'metric_test.pdf')
     }
 
     response = client.post(
@@ -273,7 +285,9 @@ def test_upload_with_metrics(mock_current_app, mock_os_remove, mock_publish_task
     )
 
     assert response.status_code == 200
-    mock_record_metric.assert_called_with('file_upload', 1, {'user_id': regular_user.id, 'file_id': ANY})
+    uploaded = session.query(File).filter_by(original_filename='metric_test.pdf').one()
+    mock_record_metric.assert_called_once_with('file_upload', 1, {'user_id': regular_user.id, 'file_id': uploaded.id})
+    assert [m['file_id'] for m in mock_publish_tasks.call_args[0][0]] == [uploaded.id]
 
 @patch('multiprocessing.Process')
 def test_worker_startup(mock_process, app):
@@ -291,3 +305,635 @@ def test_result_processing_thread(mock_thread, app):
     mock_thread.assert_called_once()
     mock_thread.return_value.start.assert_called_once()
     mock_thread.return_value.daemon = True
+
+def test_full_text_search_is_accent_insensitive_and_ranked(client, session, regular_user):
+    """The 'tudo' filter uses the full-text index, ignores accents and ranks results."""
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    weak = File(filename='weak.pdf', original_filename='weak.pdf', filepath='/path/weak.pdf', user_id=regular_user.id,
+                status='completed', processed_data='Termo de responsabilidade. Notebook entregue.')
+    strong = File(filename='strong.pdf', original_filename='strong.pdf', filepath='/path/strong.pdf', user_id=regular_user.id,
+                  status='completed', processed_data='Empregado: João Simões. Notebook Dell, notebook reserva e carregador de notebook.')
+    other = File(filename='other.pdf', original_filename='other.pdf', filepath='/path/other.pdf', user_id=regular_user.id,
+                 status='completed', processed_data='Celular Samsung entregue.')
+    session.add_all([weak, strong, other])
+    session.commit()
+
+    from app.files.routes import file_handler
+    with client.application.test_request_context():
+        from flask_login import login_user
+        login_user(regular_user)
+        results = file_handler._build_data_query('joao', 'processed_data').all()
+        assert [f.filename for f in results] == ['strong.pdf']
+
+        results = file_handler._build_data_query('NOTEBOOK', 'processed_data').all()
+        assert [f.filename for f in results] == ['strong.pdf', 'weak.pdf']
+
+    # The index follows updates to the extracted text
+    other.processed_data = 'Notebook Lenovo'
+    session.commit()
+    with client.application.test_request_context():
+        login_user(regular_user)
+        results = file_handler._build_data_query('lenovo', 'processed_data').all()
+        assert [f.filename for f in results] == ['other.pdf']
+
+def test_asset_tables_follow_structured_data(session, regular_user):
+    """Equipment, IMEI and patrimonio rows are written in the same flush as the JSON columns."""
+    from app.models import FileEquipment, FileImei, FilePatrimonio
+
+    file_record = File(
+        filename='assets.pdf', original_filename='assets.pdf', filepath='/path/assets.pdf', user_id=regular_user.id, status='completed',
+        equipamentos=json.dumps([{'nome_equipamento': 'Notebook Dell', 'imei': '356938035643809', 'patrimonio': 'P1001'}]),
+        imei_numbers=json.dumps(['356938035643809']),
+        patrimonio_numbers=json.dumps(['P1001'])
+    )
+    session.add(file_record)
+    session.commit()
+
+    assert [e.nome_equipamento for e in file_record.equipment_items] == ['Notebook Dell']
+    assert session.query(FileImei).filter_by(imei='356938035643809', file_id=file_record.id).count() == 1
+    assert session.query(FilePatrimonio).filter_by(patrimonio='p1001').one().file_id == file_record.id
+
+    file_record.imei_numbers = json.dumps(['111111111111111'])
+    session.commit()
+    assert [i.imei for i in session.query(FileImei).all()] == ['111111111111111']
+
+    session.delete(file_record)
+    session.commit()
+    assert session.query(FileEquipment).count() == 0
+    assert session.query(FilePatrimonio).count() == 0
+
+def test_view_data_keyset_pagination(client, session, regular_user):
+    """The data listing pages with (upload_date, id) cursors instead of offsets."""
+    from datetime import datetime, timedelta
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    base = datetime(2026, 1, 1)
+    session.add_all([
+        File(filename=f'f{i}.pdf', original_filename=f'doc-{i:02d}.pdf', filepath=f'/path/f{i}.pdf',
+             user_id=regular_user.id, status='completed', upload_date=base + timedelta(minutes=i))
+        for i in range(25)
+    ])
+    session.commit()
+
+    from app.files.routes import file_handler
+    with client.application.test_request_context():
+        from flask_login import login_user
+        login_user(regular_user)
+        files_query = file_handler._build_data_query('', '')
+
+        first, next_args, prev_args = file_handler._keyset_page(files_query, 10)
+        assert [f.original_filename for f in first] == [f'doc-{i:02d}.pdf' for i in range(24, 14, -1)]
+        assert prev_args is None
+
+        second, next_args, prev_args = file_handler._keyset_page(files_query, 10, after=next_args['after'])
+        assert [f.original_filename for f in second] == [f'doc-{i:02d}.pdf' for i in range(14, 4, -1)]
+
+        third, last_next, _ = file_handler._keyset_page(files_query, 10, after=next_args['after'])
+        assert [f.original_filename for f in third] == [f'doc-{i:02d}.pdf' for i in range(4, -1, -1)]
+        assert last_next is None
+
+        back, _, back_prev = file_handler._keyset_page(files_query, 10, before=prev_args['before'])
+        assert back == first
+        assert back_prev is None
+
+    response = client.get(url_for('files.view_data', after=next_args['after']))
+    assert response.status_code == 200
+    assert b'doc-04.pdf' in response.data
+    assert b'doc-05.pdf' not in response.data
+
+def test_group_access_scope(client, session, regular_user, admin_user):
+    """Group files are visible to members, the scope cache follows membership changes and uploads are checked."""
+    from app.models import Group
+    from app.access import accessible_groups, can_access_file, is_member
+    from app.files.routes import file_handler
+
+    group = Group(name='Shared', creator_id=admin_user.id)
+    group.members.append(admin_user)
+    session.add(group)
+    session.commit()
+    shared = File(filename='shared.pdf', original_filename='shared.pdf', filepath='/path/shared.pdf',
+                  user_id=admin_user.id, group_id=group.id, status='completed')
+    session.add(shared)
+    session.commit()
+
+    assert accessible_groups(regular_user.id) == []
+    assert not can_access_file(regular_user, shared)
+
+    login_response = login(client, admin_user.email, 'adminpassword')
+    client.get(login_response.headers['Location'])
+    client.post(url_for('groups.group_details', group_id=group.id), data={'email': regular_user.email})
+    assert is_member(regular_user.id, group.id)
+    assert accessible_groups(regular_user.id) == [(group.id, 'Shared')]
+    assert can_access_file(regular_user, shared)
+
+    with client.application.test_request_context():
+        from flask_login import login_user
+        login_user(regular_user)
+        assert file_handler._build_data_query('', '').all() == [shared]
+
+    other = Group(name='Private', creator_id=admin_user.id)
+    session.add(other)
+    session.commit()
+    client.get(url_for('auth.logout'))
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+    response = client.post(url_for('files.upload_file'), data={
+        'group': other.id, 'file': (BytesIO(b'%PDF-1.4'), 'private.pdf')
+    }, content_type='multipart/form-data', follow_redirects=True)
+    assert b'You cannot upload files to this group.' in response.data
+    assert File.query.filter_by(original_filename='private.pdf').count() == 0
+
+def test_listing_defers_text_and_details_endpoint(client, session, regular_user, admin_user):
+    """The listing leaves the extracted text unloaded; details come from the JSON endpoint."""
+    from sqlalchemy import inspect as sa_inspect
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    own = File(filename='own.pdf', original_filename='own.pdf', filepath='/path/own.pdf', user_id=regular_user.id,
+               status='completed', nome='Maria', processed_data='texto extraido ' * 1000,
+               equipamentos=json.dumps([{'nome_equipamento': 'Notebook'}]), patrimonio_numbers=json.dumps(['P77']))
+    other = File(filename='other.pdf', original_filename='other.pdf', filepath='/path/other.pdf', user_id=admin_user.id,
+                 status='completed', processed_data='segredo')
+    session.add_all([own, other])
+    session.commit()
+    own_id, other_id = own.id, other.id
+    session.expunge(own)
+    session.expunge(other)
+
+    from app.files.routes import file_handler
+    with client.application.test_request_context():
+        from flask_login import login_user
+        login_user(regular_user)
+        files, _, _ = file_handler._keyset_page(file_handler._build_data_query('', ''), 10)
+        assert 'content' in sa_inspect(files[0]).unloaded
+        assert file_handler._equipment_counts(files) == {files[0].id: 1}
+
+    response = client.get(url_for('files.view_data'))
+    assert b'texto extraido' not in response.data
+    assert b'1 Equipments' in response.data
+
+    details = client.get(url_for('files.file_details', file_id=own_id)).get_json()
+    assert details['nome'] == 'Maria'
+    assert details['equipamentos'] == ['Notebook']
+    assert details['patrimonio_numbers'] == ['P77']
+    assert details['processed_data'].startswith('texto extraido')
+    assert details['download_url'].endswith('/download/own.pdf')
+
+    assert client.get(url_for('files.file_details', file_id=other_id)).status_code == 404
+
+def test_processed_data_is_stored_compressed(session, regular_user):
+    """The extracted text lives compressed in file_content and stays searchable."""
+    from app.models import FileContent, decompress_text
+    from app.search import search_index
+
+    text = 'Termo de responsabilidade de equipamento. ' * 200
+    file1 = File(filename='c.pdf', original_filename='c.pdf', filepath='/path/c.pdf', user_id=regular_user.id,
+                 status='completed', processed_data=text)
+    session.add(file1)
+    session.commit()
+
+    content = session.get(FileContent, file1.id)
+    assert content.size == len(text.encode('utf-8'))
+    assert len(content.data) < content.size // 10
+    assert decompress_text(content.codec, content.data) == text
+
+    session.expire_all()
+    assert session.get(File, file1.id).processed_data == text
+
+    def matches(term):
+        subquery = search_index.search_subquery(session.get_bind().dialect.name, term)
+        return [row.file_id for row in session.execute(subquery.select())]
+
+    assert matches('responsabilidade') == [file1.id]
+    file1.processed_data = 'Notebook devolvido'
+    session.commit()
+    assert matches('responsabilidade') == []
+    assert matches('devolvido') == [file1.id]
+
+@patch('app.ingest.MessageQueue.publish_tasks')
+def test_bulk_upload_single_commit_and_batch_publish(mock_publish_tasks, client, session, regular_user):
+    """A multi-file upload inserts all rows together and publishes one batch, reporting bad files individually."""
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    data = {'file': [(BytesIO(b'%PDF-1.4\n%fake pdf ' + bytes([i])), f'batch{i}.pdf') for i in range(5)]
+                    + [(BytesIO(b'plain text'), 'notes.txt')]}
+    response = client.post(url_for('files.upload_file'), data=data,
+                           content_type='multipart/form-data', follow_redirects=True)
+
+    assert b'5 file(s) uploaded successfully' in response.data
+    assert b'Skipped invalid file: notes.txt' in response.data
+    assert session.query(File).count() == 5
+
+    mock_publish_tasks.assert_called_once()
+    messages = mock_publish_tasks.call_args[0][0]
+    assert sorted(m['file_id'] for m in messages) == sorted(f.id for f in session.query(File).all())
+    for uploaded in session.query(File).all():
+        assert os.path.exists(uploaded.filepath)
+
+@patch('app.ingest.MessageQueue.publish_tasks')
+@patch('app.storage.boto3.client')
+def test_streaming_upload_to_r2(mock_boto3_client, mock_publish_tasks, client, session, regular_user):
+    """With STREAM_UPLOADS_TO_R2 the request body goes to R2 while the worker's local copy is written and hashed."""
+    import hashlib
+    client.application.config['STREAM_UPLOADS_TO_R2'] = 'True'
+    uploaded_bodies = []
+    mock_boto3_client.return_value.upload_fileobj.side_effect = \
+        lambda reader, bucket, key, Config=None: uploaded_bodies.append(reader.read())
+
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+    body = b'%PDF-1.4\n%streamed pdf'
+    response = client.post(url_for('files.upload_file'), data={'file': (BytesIO(body), 'stream.pdf')},
+                           content_type='multipart/form-data', follow_redirects=True)
+
+    assert b'1 file(s) uploaded successfully' in response.data
+    assert uploaded_bodies == [body]
+    uploaded = session.query(File).one()
+    with open(uploaded.filepath, 'rb') as spool:
+        assert spool.read() == body
+    message = mock_publish_tasks.call_args[0][0][0]
+    assert message['stored'] is True
+    assert message['checksum'] == hashlib.sha256(body).hexdigest()
+
+@patch('app.storage.boto3.client')
+def test_archive_and_restore_soft_deleted_files(mock_boto3_client, session, regular_user):
+    """Soft-deleted files past the grace period and old metrics leave the hot tables and can be restored."""
+    from datetime import datetime, timedelta, timezone
+    from app.models import Metric, ArchivedFile, ArchivedMetric, FileImei
+    from app.archive import archive_deleted_files, archive_old_metrics, restore_file
+    from app.models import StoragePurge
+    from app.storage import purge_storage_queue
+    from app.counters import get_status_counts
+
+    now = datetime.now(timezone.utc)
+    old = File(filename='old.pdf', original_filename='old.pdf', filepath='/path/old.pdf', user_id=regular_user.id,
+               status='completed', is_deleted=True, deleted_at=now - timedelta(days=40),
+               processed_data='contrato antigo', imei_numbers=json.dumps(['111222333444555']))
+    recent = File(filename='recent.pdf', original_filename='recent.pdf', filepath='/path/recent.pdf', user_id=regular_user.id,
+                  status='completed', is_deleted=True, deleted_at=now - timedelta(days=1))
+    session.add_all([old, recent,
+                     Metric(name='user_login', value=1, timestamp=now - timedelta(days=200)),
+                     Metric(name='user_login', value=1, timestamp=now)])
+    session.commit()
+    old_id = old.id
+
+    assert archive_deleted_files(session, grace_days=30, batch_size=1) == 1
+    assert archive_old_metrics(session, retention_days=90) == 1
+
+    assert session.get(File, old_id) is None
+    assert session.query(File).count() == 1
+    assert session.query(FileImei).count() == 0
+    assert get_status_counts(session, 'user', regular_user.id)['completed'] == 1
+    archived = session.get(ArchivedFile, old_id)
+    assert archived.storage_purged
+    assert [row.key for row in session.query(StoragePurge).all()] == ['old.pdf']
+    assert purge_storage_queue(session, grace_seconds=0) == 1
+    mock_boto3_client.return_value.delete_objects.assert_called_once_with(
+        Bucket=ANY, Delete={'Objects': [{'Key': 'old.pdf'}], 'Quiet': True})
+    assert session.query(Metric).count() == 1 and session.query(ArchivedMetric).count() == 1
+
+    restored = restore_file(session, old_id)
+    assert restored.id == old_id and not restored.is_deleted
+    session.expire_all()
+    assert session.get(File, old_id).processed_data == 'contrato antigo'
+    assert session.query(FileImei).filter_by(file_id=old_id).count() == 1
+    assert session.get(ArchivedFile, old_id) is None
+    # O objeto já foi removido do storage: volta sem download, como 'failed'
+    assert session.get(File, old_id).status == 'failed'
+    counts = get_status_counts(session, 'user', regular_user.id)
+    assert counts['completed'] == 1 and counts['failed'] == 1
+
+@patch('app.storage.boto3.client')
+def test_content_addressed_objects_are_reference_counted(mock_boto3_client, session, regular_user):
+    """Files sharing an object key share one stored object, purged from R2 only after the last reference goes."""
+    from app.models import StoredObject, StoragePurge
+    from app.storage import content_key, purge_storage_queue
+
+    key = content_key('ab' * 32, 'scan.PDF')
+    assert key == f"sha256/ab/{'ab' * 32}.pdf"
+    first = File(filename='a.pdf', original_filename='a.pdf', filepath='http://r2/a', user_id=regular_user.id,
+                 status='completed', object_key=key)
+    second = File(filename='b.pdf', original_filename='b.pdf', filepath='http://r2/b', user_id=regular_user.id,
+                  status='completed', object_key=key)
+    session.add_all([first, second])
+    session.commit()
+    assert session.get(StoredObject, key).ref_count == 2
+    assert second.storage_key == key
+
+    session.delete(first)
+    session.commit()
+    session.expire_all()
+    assert session.get(StoredObject, key).ref_count == 1
+    assert session.query(StoragePurge).count() == 0
+
+    session.delete(second)
+    session.commit()
+    assert session.get(StoredObject, key) is None
+    assert [row.key for row in session.query(StoragePurge).all()] == [key]
+
+    # Conteúdo enviado de novo antes do purge: a chave sai da fila sem remoção
+    session.add(File(filename='c.pdf', original_filename='c.pdf', filepath='http://r2/c', user_id=regular_user.id,
+                     status='completed', object_key=key))
+    session.commit()
+    assert purge_storage_queue(session, grace_seconds=0) == 0
+    assert session.query(StoragePurge).count() == 0
+    mock_boto3_client.return_value.delete_objects.assert_not_called()
+
+
+@patch('app.storage.boto3.client')
+def test_storage_purge_queue_batches_and_retries(mock_boto3_client, session):
+    """The purger deletes queued keys in batches and keeps failed keys for a later attempt."""
+    from app.models import StoragePurge
+    from app.storage import enqueue_purge, purge_storage_queue
+
+    enqueue_purge(session, [f'obj{i}.pdf' for i in range(5)])
+    session.commit()
+    mock_boto3_client.return_value.delete_objects.return_value = {
+        'Errors': [{'Key': 'obj3.pdf', 'Code': 'InternalError', 'Message': 'try again'}]
+    }
+
+    # Pedidos recentes esperam a carência (um worker pode estar reaproveitando o objeto)
+    assert purge_storage_queue(session, batch_size=2, grace_seconds=3600) == 0
+    mock_boto3_client.return_value.delete_objects.assert_not_called()
+
+    assert purge_storage_queue(session, batch_size=2, grace_seconds=0) == 4
+    assert mock_boto3_client.return_value.delete_objects.call_count == 3
+    remaining = session.query(StoragePurge).one()
+    assert remaining.key == 'obj3.pdf' and remaining.attempts == 1
+    assert 'InternalError' in remaining.last_error
+
+@patch('app.ingest.MessageQueue.publish_tasks')
+def test_upload_links_known_duplicates_without_queueing(mock_publish_tasks, client, session, regular_user):
+    """Uploads are hashed on save; repeated checksums are linked to the original and never queued."""
+    import hashlib
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+    body = b'%PDF-1.4\n%same scan'
+
+    data = {'file': [(BytesIO(body), 'first.pdf'), (BytesIO(body), 'again.pdf'), (BytesIO(body + b'!'), 'other.pdf')]}
+    response = client.post(url_for('files.upload_file'), data=data, content_type='multipart/form-data', follow_redirects=True)
+    assert b'1 duplicate file(s) linked' in response.data
+
+    original = session.query(File).filter_by(original_filename='first.pdf').one()
+    duplicate = session.query(File).filter_by(original_filename='again.pdf').one()
+    assert original.checksum == hashlib.sha256(body).hexdigest() and original.size == len(body)
+    assert duplicate.status == 'duplicate' and duplicate.duplicate_of_id == original.id
+    assert not os.path.exists(duplicate.filepath)
+    queued = mock_publish_tasks.call_args[0][0]
+    assert sorted(m['file_id'] for m in queued) == sorted([original.id, session.query(File).filter_by(original_filename='other.pdf').one().id])
+    assert all(m['checksum'] for m in queued)
+
+    # Reenvio posterior com a política 'reject': nada é registrado nem enfileirado
+    client.application.config['DUPLICATE_UPLOAD_POLICY'] = 'reject'
+    mock_publish_tasks.reset_mock()
+    response = client.post(url_for('files.upload_file'), data={'file': (BytesIO(body), 'third.pdf')},
+                           content_type='multipart/form-data', follow_redirects=True)
+    assert b'duplicates a file already uploaded' in response.data
+    assert session.query(File).filter_by(original_filename='third.pdf').count() == 0
+    mock_publish_tasks.assert_not_called()
+
+def test_find_originals_skips_failed_deleted_and_inaccessible_files(session, regular_user, admin_user):
+    """Only visible, live and not failed files count as the original of an uploaded copy."""
+    from app.duplicates import find_originals
+    failed = File(filename='f.pdf', original_filename='f.pdf', filepath='/f.pdf', user_id=regular_user.id,
+                  status='failed', checksum='f' * 64)
+    deleted = File(filename='d.pdf', original_filename='d.pdf', filepath='/d.pdf', user_id=regular_user.id,
+                   status='completed', checksum='d' * 64, is_deleted=True)
+    private = File(filename='p.pdf', original_filename='p.pdf', filepath='/p.pdf', user_id=admin_user.id,
+                   status='completed', checksum='a' * 64)
+    session.add_all([failed, deleted, private])
+    session.commit()
+
+    assert find_originals(session, ['f' * 64, 'd' * 64, 'a' * 64], regular_user.id) == {}
+    assert find_originals(session, ['a' * 64], admin_user.id) == {'a' * 64: private.id}
+
+def test_duplicate_prefilter_only_hashes_possible_duplicates(tmp_path, session, regular_user):
+    """The size/CRC prefilter skips files that cannot match anything registered or in the batch."""
+    from app.duplicates import duplicate_candidates
+    session.add(File(filename='k.pdf', original_filename='k.pdf', filepath='/k.pdf', user_id=regular_user.id, size=4))
+    session.commit()
+
+    paths = {}
+    for name, body in [('same_size.pdf', b'abcd'), ('twin1.pdf', b'twin-body'), ('twin2.pdf', b'twin-body'), ('unique.pdf', b'unique body')]:
+        paths[name] = tmp_path / name
+        paths[name].write_bytes(body)
+
+    candidates = duplicate_candidates(session, [str(p) for p in paths.values()])
+    assert sorted(os.path.basename(p) for p in candidates) == ['same_size.pdf', 'twin1.pdf', 'twin2.pdf']
+
+def _chunk_headers(offset, chunk):
+    import base64
+    import hashlib
+    return {'Upload-Offset': str(offset),
+            'Upload-Checksum': 'sha256 ' + base64.b64encode(hashlib.sha256(chunk).digest()).decode()}
+
+@patch('app.ingest.MessageQueue.publish_tasks')
+def test_chunked_upload_resumes_and_enqueues_on_completion(mock_publish_tasks, client, session, regular_user, tmp_path):
+    """A file sent in checksummed chunks can resume from the confirmed offset and is queued as soon as it is assembled."""
+    import hashlib
+    client.application.config['CHUNKED_UPLOAD_FOLDER'] = str(tmp_path)
+    client.application.config['CHUNKED_UPLOAD_CHUNK_SIZE'] = 16
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    body = b'%PDF-1.4\n%resumable chunked upload body'
+    response = client.post(url_for('files.create_upload'),
+                           json={'filename': 'field report.pdf', 'size': len(body), 'checksum': hashlib.sha256(body).hexdigest()})
+    assert response.status_code == 201
+    upload_url = response.headers['Location']
+    upload_id = response.get_json()['upload_id']
+
+    first = body[:16]
+    assert client.patch(upload_url, data=first, headers=_chunk_headers(0, first)).get_json()['offset'] == 16
+    # Parte corrompida no caminho: recusada sem avançar o offset
+    corrupted = client.patch(upload_url, data=b'x' * 16, headers=_chunk_headers(16, body[16:32]))
+    assert corrupted.status_code == 460
+    assert corrupted.headers['Upload-Offset'] == '16'
+    # Reenvio de uma parte já confirmada (resposta perdida) não duplica bytes
+    assert client.patch(upload_url, data=first, headers=_chunk_headers(0, first)).status_code == 409
+    # Oversized chunk
+    assert client.patch(upload_url, data=body[16:], headers=_chunk_headers(16, body[16:])).status_code == 413
+    mock_publish_tasks.assert_not_called()
+
+    # Cliente retoma a partir do offset informado pelo servidor
+    offset = int(client.get(upload_url).headers['Upload-Offset'])
+    while offset < len(body):
+        chunk = body[offset:offset + 16]
+        result = client.patch(upload_url, data=chunk, headers=_chunk_headers(offset, chunk)).get_json()
+        offset = result['offset']
+
+    assert result['complete'] is True
+    uploaded = session.get(File, result['file_id'])
+    assert uploaded.original_filename == 'field_report.pdf'
+    assert uploaded.filename == f'{upload_id}.pdf'
+    assert uploaded.checksum == hashlib.sha256(body).hexdigest()
+    assert uploaded.size == len(body)
+    with open(uploaded.filepath, 'rb') as assembled:
+        assert assembled.read() == body
+    assert not os.listdir(tmp_path)
+    messages = mock_publish_tasks.call_args[0][0]
+    assert messages == [{'file_id': uploaded.id, 'filepath': uploaded.filepath, 'checksum': uploaded.checksum}]
+
+    assert client.get(upload_url).get_json()['file_id'] == uploaded.id
+
+def test_chunked_upload_rejects_content_and_other_users(client, session, regular_user, admin_user, tmp_path):
+    """Assembled files still pass the magic-number check, and sessions belong to the user who created them."""
+    from app.models import UploadSession
+    client.application.config['CHUNKED_UPLOAD_FOLDER'] = str(tmp_path)
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    assert client.post(url_for('files.create_upload'), json={'filename': 'notes.txt', 'size': 10}).status_code == 400
+    assert client.post(url_for('files.create_upload'),
+                       json={'filename': 'huge.pdf', 'size': client.application.config['MAX_PDF_SIZE'] + 1}).status_code == 413
+
+    body = b'plain text pretending to be a pdf'
+    upload_url = client.post(url_for('files.create_upload'), json={'filename': 'fake.pdf', 'size': len(body)}).headers['Location']
+    response = client.patch(upload_url, data=body, headers={'Upload-Offset': '0'})
+    assert response.status_code == 415
+    assert session.query(File).count() == 0
+    assert session.query(UploadSession).count() == 0
+
+    pending_url = client.post(url_for('files.create_upload'), json={'filename': 'later.pdf', 'size': 100}).headers['Location']
+    client.get(url_for('auth.logout'))
+    login_response = login(client, admin_user.email, 'adminpassword')
+    client.get(login_response.headers['Location'])
+    assert client.get(pending_url).status_code == 404
+    assert client.delete(pending_url).status_code == 404
+
+def test_expire_upload_sessions_removes_stale_parts(session, regular_user, tmp_path):
+    from datetime import datetime, timedelta
+    from app.models import UploadSession
+    from app.files.chunked import expire_upload_sessions, part_path
+
+    stale = UploadSession(id='a' * 32, user_id=regular_user.id, original_filename='old.pdf', size=10, offset=4,
+                          updated_at=datetime.utcnow() - timedelta(hours=48))
+    fresh = UploadSession(id='b' * 32, user_id=regular_user.id, original_filename='new.pdf', size=10, offset=4)
+    session.add_all([stale, fresh])
+    session.commit()
+    for upload_id in (stale.id, fresh.id):
+        open(part_path(upload_id, str(tmp_path)), 'wb').close()
+
+    assert expire_upload_sessions(session, expiry_hours=24, folder=str(tmp_path)) == 1
+    assert [u.id for u in session.query(UploadSession).all()] == [fresh.id]
+    assert os.listdir(tmp_path) == [f'{fresh.id}.part']
+
+def _build_archive(kind, members):
+    import io
+    import tarfile
+    import zipfile
+    buffer = io.BytesIO()
+    if kind == 'zip':
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('termos/', '')
+            for name, body in members:
+                archive.writestr(name, body)
+    else:
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for name, body in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(body)
+                archive.addfile(info, io.BytesIO(body))
+    buffer.seek(0)
+    return buffer
+
+@pytest.mark.parametrize('kind', ['zip', 'tar.gz'])
+@patch('app.ingest.MessageQueue.publish_tasks')
+def test_archive_upload_extracts_and_enqueues_in_batches(mock_publish_tasks, kind, client, session, regular_user, monkeypatch):
+    """Archive members are validated by content, hashed on extraction and queued a batch at a time."""
+    import hashlib
+    from app.config import Config
+    monkeypatch.setattr(Config, 'BULK_IMPORT_BATCH_SIZE', 2)
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    documents = [(f'termos/termo{i}.pdf', b'%PDF-1.4\n%termo ' + bytes([i]) * 100) for i in range(5)]
+    archive = _build_archive(kind, documents + [
+        ('termos/leia-me.txt', b'instructions'),
+        ('termos/fake.pdf', b'not really a pdf'),
+        ('__MACOSX/termos/._termo0.pdf', b'\x00\x05\x16\x07'),
+    ])
+    response = client.post(url_for('files.upload_file'), data={'file': (archive, f'lote.{kind}')},
+                           content_type='multipart/form-data', follow_redirects=True)
+
+    assert b'5 file(s) uploaded successfully' in response.data
+    assert b'Skipped invalid file: termos/leia-me.txt' in response.data
+    assert b'termos/fake.pdf' in response.data
+    assert [len(call.args[0]) for call in mock_publish_tasks.call_args_list] == [2, 2, 1]
+    uploaded = {f.original_filename: f for f in session.query(File).all()}
+    assert sorted(uploaded) == [f'termo{i}.pdf' for i in range(5)]
+    for name, body in documents:
+        record = uploaded[os.path.basename(name)]
+        assert record.checksum == hashlib.sha256(body).hexdigest()
+        assert record.size == len(body)
+        with open(record.filepath, 'rb') as extracted:
+            assert extracted.read() == body
+
+def test_import_archive_streams_tar_and_caps_member_size(session, regular_user, tmp_path, monkeypatch):
+    """Tar archives are read sequentially from non-seekable streams, and members over the size limit are dropped."""
+    from app.config import Config
+    from app.bulk_import import import_archive
+
+    class Unseekable:
+        def __init__(self, raw):
+            self._raw = raw
+
+        def read(self, size=-1):
+            return self._raw.read(size)
+
+    monkeypatch.setattr(Config, 'MAX_PDF_SIZE', 4096)
+    archive = _build_archive('tar.gz', [('small.pdf', b'%PDF-1.4\n' + b'a' * 100),
+                                        ('big.pdf', b'%PDF-1.4\n' + b'b' * 8192)])
+    errors = []
+    with patch('app.ingest.MessageQueue.publish_tasks'):
+        queued, linked = import_archive(session, Unseekable(archive), 'lote.tar.gz', regular_user.id,
+                                        errors=errors, upload_folder=str(tmp_path))
+
+    assert (queued, linked) == (1, 0)
+    assert len(errors) == 1 and errors[0][0].startswith('File "big.pdf" is too large.')
+    assert [f.original_filename for f in session.query(File).all()] == ['small.pdf']
+    assert len(os.listdir(tmp_path)) == 1
+
+def test_import_archive_skips_members_that_cannot_be_opened(session, regular_user, tmp_path):
+    """An encrypted member is reported on its own; the rest of the archive is still imported."""
+    import io
+    import zipfile
+    from app.bulk_import import import_archive
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('ok.pdf', b'%PDF-1.4\n' + b'a' * 100)
+        archive.writestr('secret.pdf', b'%PDF-1.4\n' + b'b' * 100)
+    raw = bytearray(buffer.getvalue())
+    # Liga o bit de criptografia do último membro no cabeçalho local e no diretório central
+    for signature, flags_offset in ((b'PK\x03\x04', 6), (b'PK\x01\x02', 8)):
+        raw[raw.rfind(signature) + flags_offset] |= 0x1
+    errors = []
+    with patch('app.ingest.MessageQueue.publish_tasks'):
+        queued, linked = import_archive(session, io.BytesIO(bytes(raw)), 'lote.zip', regular_user.id,
+                                        errors=errors, upload_folder=str(tmp_path))
+
+    assert (queued, linked) == (1, 0)
+    assert errors == [('File "secret.pdf" in "lote.zip" could not be extracted.', 'danger')]
+    assert [f.original_filename for f in session.query(File).all()] == ['ok.pdf']
+    assert len(os.listdir(tmp_path)) == 1
+
+@patch('app.ingest.MessageQueue.publish_tasks')
+def test_chunked_upload_of_archive_imports_members(mock_publish_tasks, client, session, regular_user, tmp_path):
+    from app.models import UploadSession
+    client.application.config['CHUNKED_UPLOAD_FOLDER'] = str(tmp_path)
+    login_response = login(client, regular_user.email, 'userpassword')
+    client.get(login_response.headers['Location'])
+
+    body = _build_archive('zip', [('a.pdf', b'%PDF-1.4\n%a'), ('b.pdf', b'%PDF-1.4\n%b')]).getvalue()
+    upload_url = client.post(url_for('files.create_upload'), json={'filename': 'lote.zip', 'size': len(body)}).headers['Location']
+    result = client.patch(upload_url, data=body, headers={'Upload-Offset': '0'}).get_json()
+
+    assert result['complete'] is True and result['queued'] == 2
+    assert sorted(f.original_filename for f in session.query(File).all()) == ['a.pdf', 'b.pdf']
+    assert session.query(UploadSession).count() == 0
+    assert not os.listdir(tmp_path)
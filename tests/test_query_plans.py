@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import text
+from app.models import db, File
+
+
+def explain(session, query):
+    """Returns the SQLite query plan for a SQLAlchemy query as a single string."""
+    sql = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    rows = session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+    return ' | '.join(row[-1] for row in rows)
+
+
+@pytest.fixture(autouse=True)
+def sqlite_only(app):
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('Query plan assertions are written for SQLite.')
+
+
+def test_duplicate_lookup_uses_checksum_index(session):
+    """DuplicateChecker's checksum lookup is an index probe."""
+    plan = explain(session, session.query(File).filter(File.checksum == 'abc', File.id != 1))
+    assert 'USING INDEX ix_file_checksum' in plan
+
+
+def test_download_lookup_uses_filename_index(session):
+    """download_file looks files up by filename through an index."""
+    plan = explain(session, File.query.filter_by(filename='some-uuid.pdf'))
+    assert 'USING INDEX ix_file_filename' in plan
+
+
+def test_listing_uses_partial_indexes(session):
+    """The listing query filters through the partial indexes on non-deleted files."""
+    user_query = File.query.filter(File.is_deleted == False, File.user_id == 1).order_by(File.upload_date.desc())
+    assert 'ix_file_user_listing' in explain(session, user_query)
+
+    group_query = File.query.filter(File.is_deleted == False, File.group_id == 1).order_by(File.upload_date.desc())
+    assert 'ix_file_group_listing' in explain(session, group_query)
+
+    status_query = File.query.filter(
+        File.status.in_(['completed', 'failed']),
+        File.is_deleted == False
+    ).order_by(File.upload_date.desc())
+    assert 'ix_file_status_listing' in explain(session, status_query)
+
+
+def test_asset_lookups_are_index_probes(session):
+    """IMEI and patrimonio prefix lookups probe the normalized asset tables' indexes."""
+    from sqlalchemy import select
+    from app.models import FileImei, FilePatrimonio, prefix_match
+
+    imei_query = File.query.filter(File.id.in_(select(FileImei.file_id).where(prefix_match(FileImei.imei, '3569'))))
+    assert 'ix_file_imei_lookup' in explain(session, imei_query)
+
+    patrimonio_query = File.query.filter(
+        File.id.in_(select(FilePatrimonio.file_id).where(prefix_match(FilePatrimonio.patrimonio, 'p10')))
+    )
+    assert 'ix_file_patrimonio_lookup' in explain(session, patrimonio_query)
+
+
+def test_access_filter_probes_membership_indexes(session):
+    """The per-file access check is a correlated EXISTS on indexed columns, not a group list."""
+    from app.access import file_access_filter
+    plan = explain(session, File.query.filter(File.is_deleted == False, file_access_filter(1)))
+    assert 'sqlite_autoindex_group_members_1' in plan
+    assert 'ix_group_creator_id' in plan or 'INTEGER PRIMARY KEY' in plan
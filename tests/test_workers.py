@@ -252,3 +252,462 @@ def test_ocr_processing(mock_check_duplicates, mock_tesseract, mock_convert, moc
     assert test_file.status == 'completed'
     mock_tesseract.assert_called_once()
     mock_publish_result.assert_called_once()
+
+def test_run_with_heartbeat_services_connection():
+    """Long tasks run in a thread while the AMQP connection keeps processing events."""
+    import time
+    from app.mq import MessageQueue
+
+    worker_mq = MessageQueue()
+    worker_mq.connection = MagicMock()
+    worker_mq.connection.is_open = True
+    worker_mq.connection.process_data_events.side_effect = lambda time_limit: time.sleep(0.01)
+
+    def slow_task(value):
+        time.sleep(0.1)
+        return value * 2
+
+    assert worker_mq.run_with_heartbeat(slow_task, 21) == 42
+    assert worker_mq.connection.process_data_events.call_count > 1
+
+def test_run_with_heartbeat_propagates_errors():
+    """Errors raised by the task are re-raised in the connection thread."""
+    from app.mq import MessageQueue
+
+    worker_mq = MessageQueue()
+    worker_mq.connection = MagicMock()
+    worker_mq.connection.is_open = True
+
+    def failing_task():
+        raise ValueError('OCR failed')
+
+    with pytest.raises(ValueError, match='OCR failed'):
+        worker_mq.run_with_heartbeat(failing_task)
+
+def test_status_counters_follow_transitions(session, regular_user):
+    """Counters are updated in the same flush as the status change, including deletes."""
+    from app.models import Group
+    from app.counters import get_status_counts, reconcile_status_counters
+
+    group = Group(name='Counters', creator_id=regular_user.id)
+    session.add(group)
+    session.commit()
+
+    files = [File(filename=f'c{i}.pdf', original_filename=f'c{i}.pdf', filepath=f'/path/c{i}.pdf',
+                  user_id=regular_user.id, group_id=group.id, status='pending') for i in range(3)]
+    session.add_all(files)
+    session.commit()
+    assert get_status_counts(session, 'user', regular_user.id)['pending'] == 3
+
+    files[0].status = 'processing'
+    files[1].status = 'completed'
+    session.commit()
+    files[0].status = 'failed'
+    session.delete(files[2])
+    session.commit()
+
+    expected = {'pending': 0, 'processing': 0, 'completed': 1, 'failed': 1, 'duplicate': 0}
+    assert get_status_counts(session, 'user', regular_user.id) == expected
+    assert get_status_counts(session, 'group', group.id) == expected
+    assert reconcile_status_counters(session) == 0
+
+def test_reconcile_status_counters_repairs_drift(session, regular_user):
+    """Reconciliation rewrites counters that drifted from the file table."""
+    from app.models import FileStatusCounter
+    from app.counters import get_status_counts, reconcile_status_counters
+
+    session.add(File(filename='d.pdf', original_filename='d.pdf', filepath='/path/d.pdf',
+                     user_id=regular_user.id, status='completed'))
+    session.commit()
+    counter = session.get(FileStatusCounter, ('user', regular_user.id, 'completed'))
+    counter.count = 7
+    session.add(FileStatusCounter(scope_type='user', scope_id=regular_user.id, status='failed', count=2))
+    session.commit()
+    session.add(File(filename='e.pdf', original_filename='e.pdf', filepath='/path/e.pdf',
+                     user_id=regular_user.id, status='pending'))
+    session.flush()
+    session.execute(FileStatusCounter.__table__.delete().where(FileStatusCounter.status == 'pending'))
+    session.commit()
+
+    assert reconcile_status_counters(session) == 3
+    counts = get_status_counts(session, 'user', regular_user.id)
+    assert counts['completed'] == 1
+    assert counts['failed'] == 0
+    assert counts['pending'] == 1
+
+def test_worker_status_json(client, session, regular_user, admin_user):
+    """The JSON status endpoint serves the user's counters and checks group access."""
+    from flask import url_for
+    from app.models import Group
+    from tests.test_auth import login
+
+    other_group = Group(name='Other', creator_id=admin_user.id)
+    session.add(other_group)
+    session.add(File(filename='j.pdf', original_filename='j.pdf', filepath='/path/j.pdf',
+                     user_id=regular_user.id, status='pending'))
+    session.commit()
+
+    login(client, regular_user.email, 'userpassword')
+    response = client.get(url_for('workers.worker_status_json'))
+    assert response.status_code == 200
+    assert response.get_json()['counts']['pending'] == 1
+
+    response = client.get(url_for('workers.worker_status_json', group_id=other_group.id))
+    assert response.status_code == 403
+
+def test_publish_tasks_uses_confirms_and_falls_back_mid_batch():
+    """Batch publishing enables confirms once and sends unconfirmed leftovers to the local queue."""
+    from app.mq import MessageQueue, local_task_queue
+
+    batch_mq = MessageQueue()
+    batch_mq.connection = MagicMock()
+    batch_mq.connection.is_closed = False
+    batch_mq.channel = MagicMock()
+    batch_mq.channel.basic_publish.side_effect = [None, Exception('nacked')]
+
+    while not local_task_queue.empty():
+        local_task_queue.get_nowait()
+    batch_mq.publish_tasks([{'file_id': 1}, {'file_id': 2}, {'file_id': 3}])
+
+    batch_mq.channel.confirm_delivery.assert_called_once()
+    queued = [json.loads(local_task_queue.get(timeout=1)) for _ in range(2)]
+    assert queued == [{'file_id': 2}, {'file_id': 3}]
+    assert batch_mq.use_local_fallback
+
+@patch('app.workers.handlers.mq.publish_result')
+def test_single_writer_funnel_routes_status_updates(mock_publish_result, session):
+    """With SQLITE_SINGLE_WRITER the worker sends transitions to the main process instead of writing."""
+    from app.workers.handlers import FileProcessingTask
+
+    test_file = File(filename='sw.pdf', original_filename='sw.pdf', filepath='/tmp/sw.pdf', user_id=1, status='pending')
+    session.add(test_file)
+    session.commit()
+
+    with patch('app.database.Config.SQLITE_SINGLE_WRITER', 'True'):
+        task = FileProcessingTask(file_id=test_file.id, file_path='/tmp/sw.pdf', session=session)
+    assert task.single_writer
+
+    task._update_db_status('processing')
+    task._update_db_status('failed', processed_data='boom')
+    session.expire_all()
+
+    assert session.get(File, test_file.id).status == 'pending'
+    mock_publish_result.assert_called_once_with({'file_id': test_file.id, 'status': 'processing'})
+
+def test_r2_upload_skips_existing_content_addressed_object():
+    """A HEAD hit on the content-addressed key skips the transfer."""
+    from app.workers.handlers import R2Uploader
+    s3_client = MagicMock()
+    with patch.object(R2Uploader, '_get_client', return_value=s3_client):
+        url = R2Uploader().upload('/tmp/scan.pdf', 'sha256/ab/abc.pdf', skip_existing=True)
+
+    assert url.endswith('/sha256/ab/abc.pdf')
+    s3_client.head_object.assert_called_once_with(Bucket=ANY, Key='sha256/ab/abc.pdf')
+    s3_client.upload_file.assert_not_called()
+
+@pytest.mark.parametrize('compressed_size, expected_size', [(300, 300), (950, 1000)])
+def test_compress_if_smaller_keeps_only_worthwhile_results(tmp_path, compressed_size, expected_size):
+    """Ghostscript output replaces the PDF only when it saves at least PDF_COMPRESSION_MIN_SAVING."""
+    from app.workers.pdf_processing import compression
+
+    pdf_path = tmp_path / 'scan.pdf'
+    pdf_path.write_bytes(b'x' * 1000)
+
+    def fake_compress(input_path, output_path, quality, timeout):
+        assert quality == 'ebook' and timeout == Config.PDF_COMPRESSION_TIMEOUT_SECONDS
+        with open(output_path, 'wb') as f:
+            f.write(b'y' * compressed_size)
+        return True
+
+    with patch.object(compression, 'check_ghostscript_installed', return_value=True), \
+         patch.object(compression, 'is_scanned_pdf', return_value=True), \
+         patch.object(compression, 'compress_pdf', side_effect=fake_compress), \
+         patch.object(Config, 'PDF_COMPRESSION_MIN_BYTES', 100), \
+         patch.object(Config, 'PDF_COMPRESSION_LARGE_BYTES', 500):
+        assert compression.compress_if_smaller(str(pdf_path)) == (1000, expected_size)
+
+    assert pdf_path.stat().st_size == expected_size
+    assert [p.name for p in tmp_path.iterdir()] == ['scan.pdf']
+
+@patch('app.workers.handlers.Config.R2_FEATURE_FLAG', 'True')
+@patch('app.workers.handlers.R2Uploader.upload', side_effect=lambda path, key, skip_existing=False: f'http://mock-r2-url/{key}')
+@patch('app.workers.handlers.extract_data_from_text', return_value={'nome': 'Fulano', 'cpf': '123'})
+@patch('app.workers.handlers.extract_text_from_pdf', return_value='Extracted text')
+def test_run_batch_processes_directory_and_resumes(mock_extract_text, mock_extract_data, mock_upload,
+                                                    session, regular_user, tmp_path):
+    """The offline batch stores final results in bulk, links in-run duplicates and resumes from its journal."""
+    from app.batch import run_batch, STATE_FILENAME
+
+    source = tmp_path / 'acervo'
+    (source / 'sub').mkdir(parents=True)
+    (source / 'a.pdf').write_bytes(b'%PDF-1.4 one')
+    (source / 'sub' / 'b.pdf').write_bytes(b'%PDF-1.4 one')
+    (source / 'c.pdf').write_bytes(b'%PDF-1.4 two')
+    (source / 'notes.txt').write_text('ignored')
+    work = tmp_path / 'work'
+    reports = []
+
+    counts = run_batch(session, str(source), regular_user.id, workers=0, commit_every=2,
+                       work_folder=str(work), report=reports.append)
+
+    assert counts['completed'] == 2 and counts['duplicate'] == 1
+    files = session.query(File).order_by(File.id).all()
+    assert [f.original_filename for f in files] == ['a.pdf', 'c.pdf', 'b.pdf']
+    assert files[0].status == 'completed' and files[0].nome == 'Fulano'
+    assert files[0].filepath.startswith('http://mock-r2-url/')
+    assert files[2].status == 'duplicate' and files[2].duplicate_of_id == files[0].id
+    assert len((source / STATE_FILENAME).read_text().splitlines()) == 3
+    assert any('files/s' in line for line in reports)
+
+    # Segunda execução: tudo já está no diário
+    mock_extract_text.reset_mock()
+    assert run_batch(session, str(source), regular_user.id, workers=0, work_folder=str(work)) == {}
+    mock_extract_text.assert_not_called()
+    assert session.query(File).count() == 3
+
+def test_files_status_json_reports_only_visible_files(client, session, regular_user, admin_user):
+    """The batch status endpoint returns the visible files among the requested ids in one response."""
+    from flask import url_for
+    from tests.test_auth import login
+
+    mine = File(filename='m.pdf', original_filename='m.pdf', filepath='/path/m.pdf', user_id=regular_user.id, status='completed')
+    queued = File(filename='q.pdf', original_filename='q.pdf', filepath='/path/q.pdf', user_id=regular_user.id, status='pending')
+    other = File(filename='o.pdf', original_filename='o.pdf', filepath='/path/o.pdf', user_id=admin_user.id, status='completed')
+    session.add_all([mine, queued, other])
+    session.commit()
+
+    login(client, regular_user.email, 'userpassword')
+    response = client.get(url_for('workers.files_status_json', ids=f'{mine.id},{queued.id},{other.id}'))
+    data = response.get_json()
+    assert [f['id'] for f in data['files']] == [mine.id, queued.id]
+    assert data['counts']['completed'] == 1 and data['counts']['pending'] == 1
+    assert data['done'] is False
+
+    assert client.get(url_for('workers.files_status_json', ids='1,x')).status_code == 400
+
+def test_status_event_stream_pushes_transitions(client, session, regular_user, admin_user):
+    """The SSE stream starts with the counters and then pushes transitions of the user's files only."""
+    from flask import url_for
+    from app.events import publish_file_status, status_events
+    from tests.test_auth import login
+
+    mine = File(filename='s.pdf', original_filename='s.pdf', filepath='/path/s.pdf', user_id=regular_user.id, status='pending')
+    other = File(filename='t.pdf', original_filename='t.pdf', filepath='/path/t.pdf', user_id=admin_user.id, status='pending')
+    session.add_all([mine, other])
+    session.commit()
+
+    login(client, regular_user.email, 'userpassword')
+    response = client.get(url_for('workers.status_events_stream'), buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    stream = response.iter_encoded()
+    first = next(stream).decode()
+    assert 'event: counts' in first and '"pending": 1' in first
+    assert status_events.subscriber_count() == 1
+
+    other.status = 'completed'
+    mine.status = 'completed'
+    session.commit()
+    publish_file_status(other, 'pending')
+    publish_file_status(mine, 'pending')
+    event = next(stream).decode()
+    assert 'event: status' in event
+    assert f'"file_id": {mine.id}' in event and '"previous": "pending"' in event
+
+    response.close()
+    assert status_events.subscriber_count() == 0
+
+@patch('app.workers.handlers.mq.publish_result')
+def test_results_ingester_streams_worker_completion(mock_publish_result, session, regular_user):
+    """The worker commits the final status before publishing it; the ingester still streams the transition."""
+    from app import apply_result
+    from app.events import status_events
+    from app.workers.handlers import FileProcessingTask
+
+    record = File(filename='r.png', original_filename='r.png', filepath='/path/r.png', user_id=regular_user.id, status='pending')
+    session.add(record)
+    session.commit()
+
+    subscription = status_events.subscribe([('user', regular_user.id)])
+    try:
+        with patch.object(FileProcessingTask, '_is_duplicate', return_value=False), \
+                patch.object(FileProcessingTask, '_extract_data'), patch.object(FileProcessingTask, '_compress'), \
+                patch.object(FileProcessingTask, '_upload_to_r2'):
+            FileProcessingTask(file_id=record.id, file_path=record.filepath, session=session).run()
+        assert session.get(File, record.id).status == 'completed'
+
+        for call in mock_publish_result.call_args_list:
+            apply_result(json.loads(json.dumps(call.args[0])))
+
+        event = subscription.get(timeout=0)
+        assert (event['file_id'], event['status'], event['previous']) == (record.id, 'completed', 'processing')
+        assert subscription.get(timeout=0) is None
+    finally:
+        status_events.unsubscribe(subscription)
+
+def test_status_broadcaster_flags_slow_subscribers():
+    """A full subscriber queue never blocks the publisher; the client is told to resync instead."""
+    from app.events import StatusBroadcaster
+
+    broadcaster = StatusBroadcaster()
+    subscription = broadcaster.subscribe([('user', 1)], max_size=1)
+    broadcaster.publish([('user', 1)], {'file_id': 1, 'status': 'processing'})
+    broadcaster.publish([('user', 1)], {'file_id': 1, 'status': 'completed'})
+    broadcaster.publish([('user', 2)], {'file_id': 2, 'status': 'completed'})
+
+    assert subscription.get(timeout=0)['status'] == 'processing'
+    assert subscription.get(timeout=0) is None
+    assert subscription.overflowed
+
+TERMO_TEXT = (
+    "TERMO DE RECEBIMENTO E RESPONSABILIDADE Empregado: Fulano de Tal Matricula: 4512 Funcao: Tecnico "
+    "R.G. Nº: 12.345.678-9 Empregador: Empresa Exemplo CPF: 123.456.789-00 ( ) Declaro ter recebido as "
+    "ferramentas abaixo relacionadas para uso exclusivo no desempenho das minhas funcoes, comprometendo-me "
+    "a devolve-las em perfeito estado. Equipamento: Notebook Patrimonio: 99812 IMEI: 356938035643809 "
+    "Sao Paulo, 12 de marco de 2025"
+)
+
+def test_near_duplicate_signatures_match_rescans_only(session, regular_user, admin_user):
+    """Page dHash and text MinHash find a re-scan; a different page count, CPF or owner keeps documents apart."""
+    from PIL import Image, ImageDraw
+    from app.near_duplicates import (dhash, text_minhash, attach_signature, find_page_match, find_text_match,
+                                     minhash_similarity)
+
+    page = Image.new('L', (170, 220), 255)
+    draw = ImageDraw.Draw(page)
+    for y in range(20, 200, 12):
+        draw.rectangle([15, y, 20 + (y * 7) % 130, y + 5], fill=0)
+    rescan = page.rotate(0.4, fillcolor=255).point(lambda value: min(255, value + 12))
+    page_hash, rescan_hash = dhash(page), dhash(rescan)
+
+    original_text = TERMO_TEXT
+    rescan_text = TERMO_TEXT.replace('Notebook', 'Notebo0k').replace('devolve-las', 'devolve las')
+    assert minhash_similarity(text_minhash(original_text), text_minhash(rescan_text)) >= 0.9
+
+    original = File(filename='o.pdf', original_filename='o.pdf', filepath='/path/o.pdf', user_id=regular_user.id,
+                    status='completed', cpf='123.456.789-00', matricula='4512')
+    attach_signature(original, {'page_hash': page_hash, 'page_count': 1, 'text_minhash': text_minhash(original_text)})
+    session.add(original)
+    session.commit()
+
+    assert find_page_match(session, rescan_hash, 1, regular_user.id)[0] == original.id
+    assert find_page_match(session, rescan_hash, 2, regular_user.id) is None
+    assert find_page_match(session, page_hash, 1, regular_user.id, exclude_id=original.id) is None
+    assert find_page_match(session, rescan_hash, 1, admin_user.id) is None
+
+    assert find_text_match(session, text_minhash(rescan_text), regular_user.id, {'cpf': '12345678900'})[0] == original.id
+    assert find_text_match(session, text_minhash(rescan_text), regular_user.id, {'cpf': '987.654.321-00'}) is None
+    assert find_text_match(session, text_minhash(rescan_text), admin_user.id, {'cpf': '12345678900'}) is None
+
+@patch('app.workers.handlers.mq.publish_result')
+@patch('app.workers.handlers.extract_text_from_pdf')
+def test_rescan_with_matching_first_page_is_linked_before_ocr(mock_extract_text, mock_publish_result, session, regular_user,
+                                                              tmp_path):
+    """A near-identical first page with the same page count marks the duplicate without running extraction."""
+    from app.near_duplicates import attach_signature
+    from app.workers.handlers import FileProcessingTask
+
+    original = File(filename='o.pdf', original_filename='o.pdf', filepath='/path/o.pdf', user_id=regular_user.id, status='completed')
+    attach_signature(original, {'page_hash': 'f0' * 32, 'page_count': 1})
+    pdf_path = tmp_path / 'rescan.pdf'
+    pdf_path.write_bytes(b'%PDF-1.4 rescan')
+    rescan = File(filename='rescan.pdf', original_filename='rescan.pdf', filepath=str(pdf_path),
+                  user_id=regular_user.id, status='pending')
+    session.add_all([original, rescan])
+    session.commit()
+
+    with patch('app.workers.handlers.page_signature', return_value=('f1' + 'f0' * 31, 1)):
+        FileProcessingTask(file_id=rescan.id, file_path=str(pdf_path), session=session).run()
+
+    mock_extract_text.assert_not_called()
+    session.expire_all()
+    rescan = session.get(File, rescan.id)
+    assert rescan.status == 'duplicate'
+    assert rescan.duplicate_of_id == original.id
+    assert rescan.signature is None
+
+@patch('app.workers.handlers.mq.publish_result')
+@patch('app.workers.handlers.extract_text_from_pdf')
+def test_rescan_page_match_is_confirmed_by_text(mock_extract_text, mock_publish_result, session, regular_user, tmp_path):
+    """A first page that only resembles an earlier scan flags the candidate: extraction still runs and the text decides."""
+    from app.near_duplicates import attach_signature, text_minhash
+    from app.workers.handlers import FileProcessingTask
+
+    page_hash = 'f0' * 32
+    original = File(filename='o.pdf', original_filename='o.pdf', filepath='/path/o.pdf', user_id=regular_user.id, status='completed')
+    attach_signature(original, {'page_hash': page_hash, 'page_count': 1, 'text_minhash': text_minhash(TERMO_TEXT)})
+    session.add(original)
+    files = []
+    for name in ('rescan.pdf', 'other.pdf'):
+        pdf_path = tmp_path / name
+        pdf_path.write_bytes(b'%PDF-1.4 ' + name.encode())
+        files.append(File(filename=name, original_filename=name, filepath=str(pdf_path), user_id=regular_user.id, status='pending'))
+    session.add_all(files)
+    session.commit()
+    rescan, other = files
+
+    # 8 bits de diferença: dentro de NEAR_DUPLICATE_PAGE_DISTANCE, acima de NEAR_DUPLICATE_PAGE_CONFIRM_DISTANCE
+    near_hash = 'ffff' + 'f0' * 30
+    with patch('app.workers.handlers.page_signature', return_value=(near_hash, 1)), \
+            patch.object(FileProcessingTask, '_compress'), patch.object(FileProcessingTask, '_upload_to_r2'):
+        mock_extract_text.return_value = TERMO_TEXT.replace('Notebook', 'Notebo0k')
+        FileProcessingTask(file_id=rescan.id, file_path=rescan.filepath, session=session).run()
+        # Mesmo modelo de formulário, outro empregado: a página bate, o texto não
+        mock_extract_text.return_value = TERMO_TEXT.replace('Fulano de Tal', 'Beltrano Souza').replace(
+            '4512', '7730').replace('123.456.789-00', '987.654.321-00').replace('99812', '40117')
+        FileProcessingTask(file_id=other.id, file_path=other.filepath, session=session).run()
+
+    assert mock_extract_text.call_count == 2
+    session.expire_all()
+    rescan, other = session.get(File, rescan.id), session.get(File, other.id)
+    assert rescan.status == 'duplicate'
+    assert rescan.duplicate_of_id == original.id
+    assert 'first page matches' in rescan.processed_data
+    assert rescan.signature is None
+    assert other.status == 'completed'
+    assert other.duplicate_of_id is None
+    assert other.signature.page_hash == near_hash
+
+def test_worker_duplicate_check_ignores_failed_deleted_and_inaccessible_originals(session, regular_user, admin_user):
+    """The worker's checksum lookup applies the same original filter as the upload path."""
+    from app.workers.duplicate_checker.tasks import process_file_for_duplicates
+
+    originals = [
+        File(filename='f.pdf', original_filename='f.pdf', filepath='/f.pdf', user_id=regular_user.id, status='failed'),
+        File(filename='d.pdf', original_filename='d.pdf', filepath='/d.pdf', user_id=regular_user.id, status='completed',
+             is_deleted=True),
+        File(filename='p.pdf', original_filename='p.pdf', filepath='/p.pdf', user_id=admin_user.id, status='completed'),
+    ]
+    for index, original in enumerate(originals):
+        original.checksum = str(index) * 64
+    session.add_all(originals)
+    session.commit()
+
+    for index in range(len(originals)):
+        copy = File(filename=f'c{index}.pdf', original_filename=f'c{index}.pdf', filepath=f'/c{index}.pdf',
+                    user_id=regular_user.id, status='pending')
+        session.add(copy)
+        session.commit()
+        assert process_file_for_duplicates(copy.id, copy.filepath, session, File, checksum=str(index) * 64) is False
+        assert session.get(File, copy.id).duplicate_of_id is None
+
+@patch('app.workers.handlers.mq.publish_result')
+def test_single_writer_duplicate_check_sends_fields_instead_of_writing(mock_publish_result, session, regular_user):
+    """In single-writer mode the checksum and duplicate link travel in the result message."""
+    from app.workers.handlers import FileProcessingTask
+
+    original = File(filename='a.pdf', original_filename='a.pdf', filepath='/path/a.pdf', user_id=regular_user.id,
+                    status='completed', checksum='c' * 64)
+    copy = File(filename='b.pdf', original_filename='b.pdf', filepath='/tmp/b.pdf', user_id=regular_user.id, status='pending')
+    session.add_all([original, copy])
+    session.commit()
+
+    with patch('app.database.Config.SQLITE_SINGLE_WRITER', 'True'):
+        task = FileProcessingTask(file_id=copy.id, file_path='/tmp/b.pdf', session=session, checksum='c' * 64)
+    task.run()
+    session.expire_all()
+
+    stored = session.get(File, copy.id)
+    assert stored.checksum is None and stored.duplicate_of_id is None
+    result = mock_publish_result.call_args_list[-1].args[0]
+    assert result['status'] == 'duplicate'
+    assert result['checksum'] == 'c' * 64 and result['duplicate_of_id'] == original.id